@@ -132,6 +132,8 @@ from __future__ import print_function
 
 from pprint import pprint as pp  # for debugging
 
+import sys
+
 
 ###############
 # this package
@@ -149,6 +151,10 @@ from .collectionsplus import *
 from .ssh import *
 from .dbms import *
 
+# the async/await syntax is a syntax error before Python 3.5
+if sys.hexversion >= 0x03050000:
+    from .asynccmd import *
+
 
 ########################################################################
 #                           RUN STANDALONE
@@ -0,0 +1,491 @@
+#!/usr/bin/env python
+
+
+"""
+This is the asyncio submodule for the nori library; see __main__.py for
+license and usage information.
+
+
+DOCSTRING CONTENTS:
+-------------------
+
+    1) About and Requirements
+    2) API Functions
+
+
+1) ABOUT AND REQUIREMENTS:
+--------------------------
+
+    This submodule provides coroutine versions of the core functions
+    for running external commands, for scripts that run many commands
+    at once (e.g., remote commands built with SSH.get_cmd()) from an
+    asyncio event loop.  Waiting for a command, and for its output, is
+    done by the event loop, so there are no threads involved, however
+    many commands are running.
+
+    It requires Python 3.5+, for the async/await syntax, and a Unix
+    event loop (one that supports add_reader()).  On earlier versions
+    of Python, it isn't loaded at all; see the imports in __main__.py.
+
+
+2) API FUNCTIONS:
+-----------------
+
+    run_command_async()
+        Run an external command, with flexible input/output targeting,
+        from an event loop.
+
+    run_with_logging_async()
+        Run a command and log its output to the output log and stdout,
+        from an event loop.
+
+"""
+
+
+########################################################################
+#                               IMPORTS
+########################################################################
+
+#########
+# system
+#########
+
+from __future__ import division
+from __future__ import absolute_import
+from __future__ import print_function
+
+from pprint import pprint as pp  # for debugging
+
+import sys
+import os
+import time
+import subprocess
+import threading
+import asyncio
+
+
+###############
+# this package
+###############
+
+from . import core
+
+
+########################################################################
+#                              FUNCTIONS
+########################################################################
+
+async def _fan_out_async(stream_tuples, flush_policy, chunk_size):
+
+    """
+    Copy data from multiple streams to multiple streams, in chunks.
+
+    Like multi_fan_out(), but the inputs are watched by the event loop
+    instead of a poller, so other coroutines can run while waiting for
+    input.  (Writing to the outputs is still done directly, as it is by
+    multi_fan_out().)
+
+    May raise IOError/OSError exceptions.
+
+    Parameters:
+        stream_tuples: a list of tuples, each of which contains a file
+                       descriptor for an input and a list of outputs;
+                       see multi_fan_out()
+        flush_policy: when to flush the outputs; see multi_fan_out()
+        chunk_size: the maximum number of bytes to copy at a time; may
+                    not be None
+
+    Dependencies:
+        classes: _FanOutJob
+        modules: core, asyncio
+
+    """
+
+    loop = asyncio.get_event_loop()
+    job = core._FanOutJob(stream_tuples, flush_policy, chunk_size)
+    done = loop.create_future()
+    timer = None
+
+    def fail(e):
+        """Stop watching the inputs, and pass on an exception."""
+        for fd in job.open_fds:
+            loop.remove_reader(fd)
+        if not done.done():
+            done.set_exception(e)
+
+    def schedule_tick():
+        """Set a timer for the next flush under a time policy."""
+        nonlocal timer
+        if timer is None and not done.done():
+            wait = job.timeout()
+            if wait is not None:
+                timer = loop.call_later(wait, tick)
+
+    def tick():
+        """Flush the outputs, if they're due."""
+        nonlocal timer
+        timer = None
+        try:
+            job.tick()
+        except (IOError, OSError) as e:
+            fail(e)
+            return
+        schedule_tick()
+
+    def readable(fd):
+        """Copy what's available from an input."""
+        if done.done():
+            return
+        try:
+            if not job.handle(fd):
+                loop.remove_reader(fd)
+        except (IOError, OSError) as e:
+            fail(e)
+            return
+        if not job.open_fds:
+            done.set_result(None)
+        else:
+            schedule_tick()
+
+    for fd in job.open_fds:
+        loop.add_reader(fd, readable, fd)
+    try:
+        await done
+    finally:
+        for fd in job.open_fds:
+            loop.remove_reader(fd)
+        if timer is not None:
+            timer.cancel()
+        job.finish()
+
+
+def _kill_stages(procs):
+    """
+    Kill the processes that are still running.
+    Parameters:
+        procs: a list of asyncio Process objects
+    """
+    for p in procs:
+        if p.returncode is None:
+            try:
+                p.kill()
+            except ProcessLookupError:
+                pass  # it's just finished
+
+
+async def _start_stages(stages, stdin, real_stdout, real_stderr,
+                        kwargs):
+
+    """
+    Start the stages of a pipeline, connected by OS pipes.
+
+    Like core._start_pipeline(), but the output pipes, if any, have
+    already been made (see run_command_async()).  A single command is
+    a pipeline with one stage.
+
+    Returns a list of the asyncio Process objects for the stages.
+
+    May raise OSError/ValueError exceptions; if it does, any stages
+    that were started have been killed.
+
+    Parameters:
+        stages: a list of lists, each containing a command and its
+                arguments
+        stdin, real_stdout, real_stderr, kwargs: what to pass to
+            asyncio.create_subprocess_exec(); see run_command() and
+            _prepare_command_targets()
+
+    Dependencies:
+        functions: _kill_stages()
+        modules: os, subprocess, asyncio
+
+    """
+
+    # with subprocess.STDOUT, the middle stages' stderr goes where the
+    # last stage's stdout does (and None means ours)
+    mid_stderr = real_stderr
+    if real_stderr == subprocess.STDOUT:
+        mid_stderr = 1 if real_stdout is None else real_stdout
+
+    procs = []
+    stage_stdin = stdin
+    try:
+        for i, stage in enumerate(stages):
+            last = (i == len(stages) - 1)
+            next_stdin = None
+            stage_stdout = real_stdout
+            if not last:
+                next_stdin, stage_stdout = os.pipe()
+            try:
+                procs.append(await asyncio.create_subprocess_exec(
+                    *stage, stdin=stage_stdin, stdout=stage_stdout,
+                    stderr=real_stderr if last else mid_stderr, **kwargs
+                ))
+            except BaseException:
+                if next_stdin is not None:
+                    os.close(next_stdin)
+                raise
+            finally:
+                # the stages have their own copies
+                if i > 0:
+                    os.close(stage_stdin)
+                if not last:
+                    os.close(stage_stdout)
+            stage_stdin = next_stdin
+    except BaseException:
+        _kill_stages(procs)
+        raise
+    return procs
+
+
+async def run_command_async(cmd_descr, cmd, stdin=None, stdout=None,
+                            stderr=None, use_logger=False,
+                            warn_only=False,
+                            exit_val=core.exitvals['startup']['num'],
+                            env_add=None, flush_policy='line',
+                            chunk_size=None, nice='default',
+                            ionice='default', cgroup_limits='default',
+                            **kwargs):
+
+    """
+    Run an external command, with flexible input/output targeting.
+
+    This is a coroutine version of run_command(); the command is run
+    with asyncio.create_subprocess_exec(), and the coroutine finishes
+    when the command does.  To run commands in the background, wrap
+    calls in tasks (e.g., with asyncio.ensure_future()) or use
+    asyncio.gather(); there is no bg argument.
+
+    If the command fails, returns None.  Otherwise, returns the
+    command's exit value.
+
+    If the coroutine is cancelled while the command is running, the
+    command is killed.
+
+    Pipelines are supported, as in run_command(); for a pipeline, the
+    exit value is a list of the stages' exit values.  So are iterables
+    for stdin (but not async iterables); they're still fed from a
+    thread, since the iterable itself may block.  So are the nice,
+    ionice, and cgroup_limits arguments; the cgroup, if any, is removed
+    when the command finishes.
+
+    The output is always copied in chunks, when there is copying to do
+    (see run_command()); with the default 'line' flush policy, the
+    outputs are flushed after each chunk.  Because the process is
+    handed its own pipes, Popen arguments that only apply to
+    asyncio-managed pipes, such as universal_newlines, text, and a
+    non-zero bufsize, can't be used.
+
+    Parameters:
+        chunk_size: the maximum number of bytes to copy at a time, or
+                    None for FAN_OUT_CHUNK_SIZE
+        kwargs: passed to asyncio.create_subprocess_exec(); but see
+                env_add
+        see run_command() for the rest
+
+    Dependencies:
+        globals: exitvals['startup'], exitvals['internal'],
+                 email_logger, FAN_OUT_CHUNK_SIZE
+        functions: command_error_handler(), pps(),
+                   _check_fan_out_args(), _prepare_command_targets(),
+                   _add_command_env(), _is_pipeline(), _start_stages(),
+                   _kill_stages(), _fan_out_async(),
+                   _is_iterable_stdin(), _stdin_feeder_pipe(),
+                   _feed_stdin(), _resolve_command_limits(),
+                   _make_command_cgroup(), _remove_command_cgroup(),
+                   _limit_command()
+        modules: core, os, subprocess, sys, threading, asyncio
+        external commands: (nice), (ionice), (sh)
+
+    """
+
+    # sanity check
+    if (stdin == subprocess.PIPE or
+          stdout == subprocess.PIPE or
+          (isinstance(stdout, list) and subprocess.PIPE in stdout) or
+          stderr == subprocess.PIPE or
+          (isinstance(stderr, list) and subprocess.PIPE in stderr)):
+        core.email_logger.error(
+'''Internal Error: subprocess.PIPE may not be included in the arguments to
+run_command_async(); call was (in expanded notation):
+
+run_command_async(cmd_descr={0},
+                  cmd={1},
+                  stdin={2}, stdout={3}, stderr={4},
+                  use_logger={5}, warn_only={6}, exit_val={7},
+                  env_add={8},
+                  kwargs={9})
+
+Exiting.''' .
+            format(*map(core.pps, [cmd_descr, cmd, stdin, stdout, stderr,
+                                   use_logger, warn_only, exit_val,
+                                   env_add, kwargs]))
+        )
+        sys.exit(core.exitvals['internal']['num'])
+    core._check_fan_out_args('run_command_async', flush_policy,
+                             chunk_size)
+    if chunk_size is None:
+        chunk_size = core.FAN_OUT_CHUNK_SIZE
+    nice, ionice, cgroup_limits = core._resolve_command_limits(
+        'run_command_async', nice, ionice, cgroup_limits
+    )
+
+    # sort out the targets and the environment
+    stdin, stdout, real_stdout, stderr, real_stderr = (
+        core._prepare_command_targets(stdin, stdout, stderr)
+    )
+    core._add_command_env(env_add, kwargs)
+
+    # set up the cgroup, if any
+    cgroup_path = None
+    if cgroup_limits:
+        try:
+            cgroup_path = core._make_command_cgroup(cgroup_limits)
+        except (OSError, IOError) as e:
+            core.command_error_handler(e, cmd_descr, use_logger,
+                                       warn_only, exit_val)
+            return None
+    limited_cmd = core._limit_command(cmd, nice, ionice, cgroup_path)
+
+    # iterable input goes through a pipe of our own
+    stdin_source = None
+    if core._is_iterable_stdin(stdin):
+        stdin_source = stdin
+        stdin, stdin_w = core._stdin_feeder_pipe()
+
+    # outputs that need copying get pipes of our own, which the event
+    # loop can watch directly
+    stream_tuples = []
+    write_fds = []
+    if real_stdout == subprocess.PIPE:
+        r, real_stdout = os.pipe()
+        stream_tuples.append((r, stdout))
+        write_fds.append(real_stdout)
+    if real_stderr == subprocess.PIPE:
+        r, real_stderr = os.pipe()
+        stream_tuples.append((r, stderr))
+        write_fds.append(real_stderr)
+
+    # run the command
+    stages = limited_cmd if core._is_pipeline(cmd) else [limited_cmd]
+    procs = []
+    try:
+        try:
+            procs = await _start_stages(stages, stdin, real_stdout,
+                                        real_stderr, kwargs)
+        finally:
+            # the processes have their own copies
+            for fd in write_fds:
+                os.close(fd)
+    except (OSError, ValueError) as e:
+        for r, out_list in stream_tuples:
+            os.close(r)
+        if stdin_source is not None:
+            os.close(stdin)
+            os.close(stdin_w)
+        if cgroup_path is not None:
+            core._remove_command_cgroup(cgroup_path)
+        core.command_error_handler(e, cmd_descr, use_logger, warn_only,
+                                   exit_val)
+        return None
+
+    # start feeding the input; the iterable may block, so it gets a
+    # thread of its own
+    if stdin_source is not None:
+        os.close(stdin)  # the command has its own copy
+        feeder = threading.Thread(
+            target=core._feed_stdin,
+            args=(stdin_source, stdin_w, chunk_size, cmd_descr)
+        )
+        feeder.daemon = True
+        feeder.start()
+
+    # deal with the output and wait for the command
+    try:
+        if stream_tuples:
+            await _fan_out_async(stream_tuples, flush_policy, chunk_size)
+        statuses = []
+        for p in procs:
+            statuses.append(await p.wait())
+        return statuses if core._is_pipeline(cmd) else statuses[0]
+    except BaseException:
+        # e.g., we've been cancelled
+        _kill_stages(procs)
+        raise
+    finally:
+        for r, out_list in stream_tuples:
+            os.close(r)
+        if cgroup_path is not None:
+            # best effort; if we've been cancelled, the killed
+            # processes may not have exited yet
+            core._remove_command_cgroup(cgroup_path)
+
+
+async def run_with_logging_async(cmd_descr, cmd, log_stdout=True,
+                                 log_stderr=True, print_output=True,
+                                 output_logger='default',
+                                 output_log_fo='default',
+                                 use_logger=False, warn_only=False,
+                                 exit_val=core.exitvals['startup']['num'],
+                                 env_add=None, flush_policy='line',
+                                 chunk_size=None, stdin=None, **kwargs):
+
+    """
+    Run a command and log its output to the output log and stdout.
+
+    This is a coroutine version of run_with_logging(); see
+    run_command_async() for the differences.
+
+    Returns the command's exit value, or None if it couldn't be run.
+
+    Output from commands that are running at the same time is written
+    to the output log as it arrives, so it may be mixed together, even
+    in the middle of lines; if that matters, give each command its own
+    log, or see run_commands_parallel().
+
+    Parameters:
+        see run_with_logging() and run_command_async()
+
+    Dependencies:
+        globals: output_logger, output_log_fo, FULL_DATE_FORMAT,
+                 exitvals['startup']
+        functions: run_command_async(), _start_logged_command(),
+                   _logged_command_targets()
+        modules: core, time
+
+    """
+
+    # handle defaults; we can't set these in the definition because at
+    # the time it's processed, they haven't been set yet
+    if output_logger == 'default':
+        output_logger = core.output_logger
+    if output_log_fo == 'default':
+        output_log_fo = core.output_log_fo
+
+    # log the start and the command
+    core._start_logged_command(cmd_descr, cmd, env_add, output_logger,
+                               output_log_fo)
+
+    # get the streams sorted out
+    stdout, stderr = core._logged_command_targets(log_stdout, log_stderr,
+                                                  print_output,
+                                                  output_log_fo)
+
+    # run the command
+    ret = await run_command_async(cmd_descr, cmd, stdin, stdout, stderr,
+                                  use_logger, warn_only, exit_val,
+                                  env_add, flush_policy, chunk_size,
+                                  **kwargs)
+
+    # failure?
+    if ret is None:
+        return ret
+
+    # log the ending time
+    if output_logger:
+        output_logger.info('%s finished %s.', cmd_descr.capitalize(),
+                           time.strftime(core.FULL_DATE_FORMAT,
+                                         time.localtime()))
+
+    # return the command's exit value
+    return ret
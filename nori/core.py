@@ -32,6 +32,13 @@ DOCSTRING CONTENTS:
     FULL_DATE_FORMAT
         Format for printing certain timestamps.
 
+    FAN_OUT_CHUNK_SIZE
+        Chunk size for copying the output of commands with a lot of
+        output.
+
+    CAPTURE_SPOOL_SIZE
+        Default amount of captured command output to keep in memory.
+
     INTEGER_TYPES
     NUMBER_TYPES
     STRING_TYPES
@@ -237,6 +244,15 @@ DOCSTRING CONTENTS:
     filemode()
         Reimplementation of Python 3.3's stat.filemode().
 
+    get_user_name()
+        Get the name of a user from a uid, with caching.
+
+    get_group_name()
+        Get the name of a group from a gid, with caching.
+
+    get_files_metadata()
+        Get a list of strings with the metadata for a list of files.
+
     get_file_metadata()
         Get a string with the metadata for a file.
 
@@ -252,12 +268,21 @@ DOCSTRING CONTENTS:
     touch_file()
         Update a file's timestamp, or create it if it doesn't exist.
 
+    write_state_file()
+        Atomically create or replace a small state file.
+
     mkdir_p()
         Create a directory, recursively if necessary.
 
     rm_rf()
         Remove a file or directory, recursively if necessary.
 
+    hardlink_tree()
+        Copy a directory tree, using hard links for the files.
+
+    get_disk_usage()
+        Get the disk usage of a file or directory tree, in bytes.
+
 
     File Rotation and Pruning:
     --------------------------
@@ -266,13 +291,14 @@ DOCSTRING CONTENTS:
         Rotate numbered files or directories.
 
     prune_num_files()
-        Prune numbered files or directories by number and date.
+        Prune numbered files or directories by number, date, and size.
 
     prune_date_files()
-        Prune dated files or directories by number and date.
+        Prune dated files or directories by number, date, and size.
 
     prune_files()
-        Wrapper: prune numbered or dated files/dirs by number and date.
+        Wrapper: prune numbered or dated files/dirs by number, date, and
+        size.
 
     rotate_prune_files()
         Wrapper: rotate and prune numbered or dated files or
@@ -294,6 +320,9 @@ DOCSTRING CONTENTS:
     email_diagnostics()
       Return a diagnostic string suitable for alert/error emails.
 
+    render_recent_context()
+        Return the recent log messages and command output.
+
     logging_init_syslog()
         Set up a syslog handler and return it.
 
@@ -303,10 +332,29 @@ DOCSTRING CONTENTS:
     logging_init_main()
         Initialize most of the logging.
 
+    logging_async_wrap()
+        Wrap a handler so that it's run by the logging thread, if
+        active.
+
+    logging_start_async()
+        Start the background logging thread.
+
+    logging_flush_async()
+        Wait until all queued log messages have been written out.
+
+    logging_stop_async()
+        Flush the log queue and stop the background logging thread.
+
     logging_init_logfile()
         Initialize logfile logging, including both logger and file
         objects.
 
+    logging_rotate_logfile()
+        Rotate a logfile while the script is running, if it's due.
+
+    logging_rotate_logfiles()
+        Rotate all logfiles that are due while the script is running.
+
     logging_close_logfile()
         Close a logfile's file object.
 
@@ -344,6 +392,13 @@ DOCSTRING CONTENTS:
     generic_error_handler()
         Handle exceptions with various options.
 
+    summarize_repeat_warnings()
+        Log summaries of all warnings that have been suppressed as
+        repeats.
+
+    query_logs()
+        Print the log entries that match a query.
+
 
     Running External Commands:
     --------------------------
@@ -359,15 +414,29 @@ DOCSTRING CONTENTS:
         Copy data from multiple streams to multiple streams, line by
         line.
 
+    flush_fan_out_outputs()
+        Flush all outputs with data buffered by multi_fan_out().
+
     run_command()
         Run an external command, with flexible input/output targeting.
 
+    wait_with_usage()
+        Wait for a process, and return its exit value and resource
+        usage.
+
     kill_bg_command()
         Kill a background command and return the exit value.
 
+    kill_bg_commands()
+        Kill background commands, all at once, and return the exit
+        values.
+
     run_with_logging()
         Run a command and log its output to the output log and stdout.
 
+    run_commands_parallel()
+        Run several commands at once, and log their output.
+
 
     Network Operations:
     -------------------
@@ -590,6 +659,9 @@ DOCSTRING CONTENTS:
     statusall_mode()
         Wrapper for render_status(True) to add blank lines.
 
+    logs_mode()
+        Search the logs, as specified on the command line.
+
     createfull_mode()
         Wrapper for create_blank_config_files(True).
 
@@ -604,9 +676,26 @@ DOCSTRING CONTENTS:
 3) API CLASSES:
 ---------------
 
+    RingBufferHandler(logging.Handler)
+        Keep the most recent log messages in memory.
+
     SMTPDiagHandler(logging.handlers.SMTPHandler)
         Override SMTPHandler to add diagnostics to the email.
 
+    BatchedSysLogHandler(logging.Handler)
+        Send syslog messages over TCP in batches, reconnecting as
+        necessary.
+
+    AsyncHandler(logging.Handler)
+        Hand records off to the logging thread.
+
+    RotatingLogfile(object)
+        A logfile object that can be reopened without being replaced.
+
+    CapturedOutput(object)
+        A target for command output that collects it for use in the
+        script.
+
 
 4) MODIFICATION NOTES:
 ----------------------
@@ -653,6 +742,16 @@ import re
 import pprint
 import operator
 import collections
+import json
+import io
+import codecs
+import tempfile
+import mmap
+import bisect
+import gzip
+import smtplib
+import email.utils
+from email.mime.text import MIMEText
 
 # see import_file()
 if sys.hexversion < 0x03040000:
@@ -666,12 +765,42 @@ except ImportError:
     from io import StringIO  # Python 3.x
 
 try:
-    import pwd  # Unix; see get_file_metadata()
+    import Queue as queue  # Python 2.x
+except ImportError:
+    import queue  # Python 3.x
+
+try:
+    import pwd  # Unix; see get_user_name()
+except ImportError:
+    pass
+
+try:
+    import bz2  # may be missing; see RotatingLogfile
+except ImportError:
+    pass
+
+try:
+    import lzma  # Python 3.3+; see RotatingLogfile
+except ImportError:
+    pass
+
+try:
+    import selectors  # Python 3.4+; see _FDPoller
+except ImportError:
+    pass
+
+try:
+    from compression import zstd  # Python 3.14+; see RotatingLogfile
+except ImportError:
+    pass
+
+try:
+    import grp  # Unix; see get_group_name()
 except ImportError:
     pass
 
 try:
-    import grp  # Unix; see get_file_metadata()
+    import fcntl  # Unix; see _stdin_feeder_pipe()
 except ImportError:
     pass
 
@@ -869,7 +998,53 @@ if sys.hexversion >= 0x03040000:
     }
 
 # see file rotation functions
-ZIP_SUFFIXES = ['.gz', '.bz2', '.lz', '.xz', ]
+ZIP_SUFFIXES = ['.gz', '.bz2', '.lz', '.xz', '.zst', ]
+
+# filename suffixes for logfiles that are compressed as they're written
+# (see the *_log_compress settings), and how often to make sure that
+# everything written so far can be decompressed, in seconds
+LOG_COMPRESS_SUFFIXES = {
+    'gz': '.gz',
+    'bz2': '.bz2',
+    'xz': '.xz',
+    'zst': '.zst',
+}
+LOG_COMPRESS_SYNC_SECS = 5
+
+# number of worker threads to use when walking directory trees;
+# see _parallel_tree_walk()
+TREE_WALK_THREADS = 8
+
+# suffix for the sidecar files that cache directory sizes for
+# size-bounded pruning; see _prune_files_by_usage()
+USAGE_INDEX_SUFFIX = '.usage_index'
+
+# suffix for the sidecar files that index logfiles by hour, and how much
+# of a compressed logfile to decompress at a time (in bytes); see
+# query_logs()
+LOG_INDEX_SUFFIX = '.log_index'
+LOG_SCAN_CHUNK = 16 * 1024 * 1024
+
+# pooled SMTP connections that have been idle for longer than this many
+# seconds are closed and replaced rather than reused (most servers
+# time out idle connections after a few minutes); see SMTPDiagHandler
+SMTP_IDLE_TIMEOUT = 60
+
+# for BatchedSysLogHandler: the most records to send in one write, the
+# connection timeout, the maximum delay between reconnection attempts,
+# and how long to wait for the backlog to drain when closing (seconds)
+SYSLOG_BATCH_MAX = 256
+SYSLOG_CONNECT_TIMEOUT = 5
+SYSLOG_BACKOFF_MAX = 60
+SYSLOG_CLOSE_TIMEOUT = 5
+
+# a good chunk size for copying the output of commands with a lot of
+# output; see multi_fan_out()
+FAN_OUT_CHUNK_SIZE = 65536
+
+# how much captured command output to keep in memory before spilling
+# to disk; see CapturedOutput
+CAPTURE_SPOOL_SIZE = 4 * 1024 * 1024
 
 # for pps() pretty-printer
 PPS_INDENT = 1
@@ -880,6 +1055,20 @@ PPS_DEPTH = None
 # output logs
 FULL_DATE_FORMAT = '%a %b %d %H:%M:%S %Z %Y'
 
+# what FULL_DATE_FORMAT timestamps look like at the start of status log
+# entries (followed by the PID) and at the end of the output log's
+# start/finish lines; see query_logs()
+# (the time zone name can be empty or contain spaces on some platforms)
+_LOG_TIMESTAMP_RE = (r'([A-Za-z]{3} [A-Za-z]{3} [0-9]{2} '
+                     r'[0-9]{2}:[0-9]{2}:[0-9]{2}) [^\n]*?([0-9]{4})')
+_LOG_HEADER_RE = re.compile(
+    ('^' + _LOG_TIMESTAMP_RE + r' \[([0-9]+)\]: ').encode('ascii'),
+    re.MULTILINE
+)
+_LOG_MARKER_RE = re.compile(
+    (' ' + _LOG_TIMESTAMP_RE + r'\.$').encode('ascii'), re.MULTILINE
+)
+
 #
 # see config setting functions and type_tuple_string()
 #
@@ -1077,6 +1266,18 @@ are also included (if applicable)
     req_config=True,
 )
 
+script_modes['logs'] = dict(
+    descr=(
+'''
+'logs': the status and output logs, including rotated and compressed
+files, are searched; entries can be selected using --since, --until,
+--pid, and --grep (without any, everything is printed)
+'''
+    ),
+    callback=lambda: logs_mode(),
+    req_config=True,
+)
+
 script_modes['silence'] = dict(
     descr=(
 '''
@@ -1217,6 +1418,11 @@ start_time = None
 # internal; see create_email_settings() and validate_email_config()
 _ignore_email_config = {}
 
+# internal; caches of user/group names; see get_user_name() and
+# get_group_name()
+_user_names = {}
+_group_names = {}
+
 # internal; see create_logfile_settings(), validate_logfile_config(),
 # logging_init_logfile(), etc.
 _logfile_info = collectionsplus.OrderedDict()
@@ -1225,6 +1431,17 @@ _atexit_close_logfiles_registered = False
 # internal; see command-running functions
 _atexit_kill_bg_commands_registered = False
 _running_bg_commands = []  # contains process objects
+_atexit_flush_fan_out_registered = False
+_fan_out_buffered = []  # contains output objects with pending data
+_fan_out_copier = None  # shared copier thread; see _FanOutCopier
+# run_command() can be called from several threads at once (see
+# run_commands_parallel())
+_fan_out_copier_lock = threading.Lock()
+_atexit_remove_cgroups_registered = False
+_bg_cgroups = []  # contains cgroup paths
+_cgroup_counter = 0
+# for the counter and _bg_cgroups; see _fan_out_copier_lock
+_cgroup_lock = threading.Lock()
 
 
 #########################
@@ -1246,6 +1463,10 @@ default_config_files = ['/etc/{0}/{0}.conf'.format(script_shortname)]
 # see process_command_line()
 config_file_paths = None
 
+# the query for the 'logs' mode: a dict of the --since, --until, --pid,
+# and --grep arguments; see process_command_line() and logs_mode()
+logs_mode_args = None
+
 # module objects for the config file(s); see import_config_by_name()
 config_modules = []
 
@@ -1531,11 +1752,76 @@ Ignored if send_{0}_emails is False.
         default=None,
     )
 
+    config_settings[name_str + '_emails_digest_secs'] = dict(
+        descr=(
+'''
+How long to collect {0} messages before sending them, in seconds.
+
+If this is not 0, messages are held, and all of the messages received
+during this time are sent together as one digest email, with a single
+copy of the diagnostics.  (See also {1}_emails_digest_max.)  Any
+held messages are always sent before the script exits.
+
+A value of 0 means that messages are sent as they arrive (unless
+{1}_emails_digest_max is set).
+
+Ignored if send_{1}_emails is False.
+''' .
+            format(descr_str, name_str)
+        ),
+        default=0,
+        cl_coercer=float,
+    )
+
+    config_settings[name_str + '_emails_digest_max'] = dict(
+        descr=(
+'''
+The maximum number of {0} messages to collect into one digest
+email.
+
+When this many messages are being held, they are sent immediately,
+without waiting for the rest of {1}_emails_digest_secs.  If
+{1}_emails_digest_secs is 0, messages are only sent in groups of this
+many (and before the script exits).
+
+A value of 0 means no limit.
+
+Ignored if send_{1}_emails is False.
+''' .
+            format(descr_str, name_str)
+        ),
+        default=0,
+        cl_coercer=int,
+    )
+
+    config_settings[name_str + '_emails_max_per_hour'] = dict(
+        descr=(
+'''
+The maximum number of {0} emails to send to the same
+{1}_emails_to addresses in any one-hour period.
+
+Messages over the limit are held and sent as a digest once the limit
+allows it (or before the script exits, whichever comes first).  The
+limit is shared with any other email loggers that have the same list of
+addresses.
+
+A value of 0 means no limit.
+
+Ignored if send_{1}_emails is False.
+''' .
+            format(descr_str, name_str)
+        ),
+        default=0,
+        cl_coercer=int,
+    )
+
     setting_list = [
         'send_' + name_str + '_emails', name_str + '_emails_from',
         name_str + '_emails_to', name_str + '_emails_subject',
         name_str + '_emails_host', name_str + '_emails_cred',
-        name_str + '_emails_sec',
+        name_str + '_emails_sec', name_str + '_emails_digest_secs',
+        name_str + '_emails_digest_max',
+        name_str + '_emails_max_per_hour',
     ]
     settings_extra_text(setting_list, extra_text)
     settings_extra_requires(setting_list, extra_requires)
@@ -1684,7 +1970,9 @@ more than once a day.
 for the format of this value.)
 
 Dates refer to when the script starts; all files created during a given
-run of the script will have the same date suffix.
+run of the script will have the same date suffix (unless the logfile is
+rotated while the script is running; see {1}_log_rotate_bytes and
+{1}_log_rotate_mins).
 
 This may not include path-separator characters ('{3}'; all directories
 in the path must be in the {1}_log setting).  However, it may be blank.
@@ -1742,10 +2030,107 @@ Ignored if {1}_log is None or {1}_log_layout is 'append'.
         cl_coercer=int,
     )
 
+    config_settings[name_str + '_log_max_bytes'] = dict(
+        descr=(
+'''
+The maximum total size of the {0} logfiles to keep, in bytes,
+including the current one.
+
+Once the other limits have been applied (see {1}_log_num and
+{1}_log_days), the oldest logfiles are removed until the total fits
+within this size.  The current logfile is never removed, even if it is
+larger than this limit by itself.
+
+A value of 0 means no size limit.
+
+Note: this applies to both 'number' and 'date' values of
+{1}_log_layout.
+
+Ignored if {1}_log is None or {1}_log_layout is 'append'.
+''' .
+            format(descr_str, name_str)
+        ),
+        default=0,
+        cl_coercer=int,
+    )
+
+    config_settings[name_str + '_log_rotate_bytes'] = dict(
+        descr=(
+'''
+The size, in bytes, at which to rotate the current {0} logfile while
+the script is running.
+
+Normally, {0} logs are only rotated when the script starts.  If this is
+not 0, the current logfile is also checked before each command run by
+run_with_logging() (and whenever logging_rotate_logfiles() is called),
+and rotated if it has reached this size.  Commands that are already
+running keep writing to the file they started with.
+
+With a {1}_log_layout of 'date', the logfile can only be rotated if
+the date string has changed; see {1}_log_date.
+
+A value of 0 means no in-run rotation by size.
+
+Ignored if {1}_log is None or {1}_log_layout is 'append'.
+''' .
+            format(descr_str, name_str)
+        ),
+        default=0,
+        cl_coercer=int,
+    )
+
+    config_settings[name_str + '_log_rotate_mins'] = dict(
+        descr=(
+'''
+How long to use the current {0} logfile, in minutes, before rotating
+it while the script is running.
+
+This works the same way as {1}_log_rotate_bytes (see above), but
+rotates the logfile once it has been open for this long.
+
+A value of 0 means no in-run rotation by time.
+
+Ignored if {1}_log is None or {1}_log_layout is 'append'.
+''' .
+            format(descr_str, name_str)
+        ),
+        default=0,
+        cl_coercer=int,
+    )
+
+    config_settings[name_str + '_log_compress'] = dict(
+        descr=(
+'''
+Compress the {0} logfile as it's written?
+
+This can be None (no compression), 'gz' (gzip), 'bz2' (bzip2), 'xz'
+(xz/LZMA), or 'zst' (Zstandard).  The matching suffix ('.gz', etc.) is
+added to the filename.  'bz2' and 'xz' require Python 3.3 or later, and
+'zst' requires Python 3.14 or later.
+
+Every {1} seconds (if anything has been written), the compressed stream
+is ended and a new one is started, so that everything up to that point
+can be decompressed even if the script dies.  The usual tools (zcat,
+etc.) handle the resulting multi-stream files transparently.
+
+External commands can't write directly to a compressed logfile, so
+their output is always copied by the script in this case (see
+run_command()).  {2}_log_rotate_bytes applies to the compressed size.
+
+Ignored if {2}_log is None.
+''' .
+            format(descr_str, LOG_COMPRESS_SYNC_SECS, name_str)
+        ),
+        default=None,
+        cl_coercer=lambda x: None if x.lower() == 'none' else x,
+    )
+
     setting_list = [
         name_str + '_log', name_str + '_log_layout', name_str + '_log_sep',
         name_str + '_log_date', name_str + '_log_num',
-        name_str + '_log_days',
+        name_str + '_log_days', name_str + '_log_max_bytes',
+        name_str + '_log_rotate_bytes', name_str + '_log_rotate_mins',
+        name_str + '_log_compress',
     ]
     settings_extra_text(setting_list, extra_text)
     settings_extra_requires(setting_list, extra_requires)
@@ -1837,6 +2222,103 @@ Can be True or False.
         no_print=True,
     )
 
+    config_settings['cmd_nice'] = dict(
+        descr=(
+'''
+Nice level (CPU priority adjustment) for external commands, from -20
+(highest priority) to 19 (lowest).
+
+This is an adjustment relative to the script's own nice level, as with
+the nice command; negative values generally require root.  Applies to
+both foreground and background commands (including SSH tunnels), unless
+the script overrides it for a particular command.
+
+If None, commands run at the script's own priority.
+'''
+        ),
+        default=None,
+        cl_coercer=lambda x: None if x.lower() == 'none' else int(x),
+        no_print=True,
+    )
+
+    config_settings['cmd_ionice_class'] = dict(
+        descr=(
+'''
+I/O scheduling class for external commands, as with the ionice command.
+
+Can be 'idle', 'best-effort', 'realtime' (generally requires root), or
+None, in which case commands run with the script's own I/O scheduling.
+Only has an effect with I/O schedulers that support it (e.g., BFQ).
+
+Applies to the same commands as cmd_nice.
+'''
+        ),
+        default=None,
+        cl_coercer=lambda x: None if x.lower() == 'none' else x,
+        no_print=True,
+    )
+
+    config_settings['cmd_ionice_level'] = dict(
+        descr=(
+'''
+I/O priority level within the scheduling class, from 0 (highest) to 7
+(lowest).
+
+Ignored for the 'idle' class, or if cmd_ionice_class is None.  If None,
+the kernel's default for the class is used.
+'''
+        ),
+        default=None,
+        cl_coercer=lambda x: None if x.lower() == 'none' else int(x),
+        no_print=True,
+    )
+
+    config_settings['cmd_cgroup_parent'] = dict(
+        descr=(
+'''
+Directory of a cgroup (v2) in which to create cgroups for external
+commands, e.g., '/sys/fs/cgroup/user.slice/user-1000.slice/nori'.
+
+The cgroup must have been delegated to the user running the script
+(i.e., the user must be able to create subgroups and write to their
+control files), and the controllers needed for the limits in
+cmd_cgroup_limits must be enabled in its cgroup.subtree_control file.
+
+Only used if there are cgroup limits to apply; see cmd_cgroup_limits.
+'''
+        ),
+        default=None,
+        cl_coercer=lambda x: None if x.lower() == 'none' else x,
+        no_print=True,
+    )
+
+    config_settings['cmd_cgroup_limits'] = dict(
+        descr=(
+'''
+Resource limits for external commands, as a dict of cgroup (v2) control
+files and the values to write to them.
+
+If this is not empty, each command (or pipeline) is run in a transient
+cgroup of its own, created under cmd_cgroup_parent, with these limits.
+The cgroup is removed when the command finishes (or, for background
+commands, when the script exits, if the command has been stopped by
+then).  For example:
+
+    {'cpu.max': '50000 100000',
+     'memory.max': '2G',
+     'io.max': '8:0 rbps=10485760 wbps=10485760'}
+
+limits a command to half of a CPU, 2 GiB of memory, and 10 MiB/s of
+reads and writes to device 8:0.
+
+Applies to the same commands as cmd_nice.  Options must be supplied as a
+dict.
+'''
+        ),
+        default={},
+        no_print=True,
+    )
+
     config_settings['debug'] = dict(
         descr=(
 '''
@@ -2067,6 +2549,44 @@ Ignored if use_syslog is False.
         cl_coercer=str,
     )
 
+    config_settings['syslog_batched'] = dict(
+        descr=(
+'''
+Send syslog messages in batches over a persistent TCP connection?
+
+If True, messages are framed using octet counting (RFC 6587) and sent
+by a background thread, several at a time.  If the syslog relay can't
+be reached (e.g., because it's restarting), messages are held in memory
+(see syslog_backlog), and the connection is retried with increasing
+delays.  Otherwise, each message is sent as it's logged, and a relay
+that goes away will cause errors.
+
+Can be True or False.
+
+Ignored if use_syslog is False, if syslog_addr is not a (host, port)
+tuple, or if syslog_sock_type is not socket.SOCK_STREAM.
+'''
+        ),
+        default=False,
+        cl_coercer=str_to_bool,
+    )
+
+    config_settings['syslog_backlog'] = dict(
+        descr=(
+'''
+The maximum number of syslog messages to hold while they can't be sent.
+
+When there are more than this many, the oldest are discarded (and a
+message saying how many were lost is sent when the connection comes
+back).
+
+Ignored if syslog_batched is False (or ignored).
+'''
+        ),
+        default=10000,
+        cl_coercer=int,
+    )
+
     config_settings['syslog_tag'] = dict(
         descr=(
 '''
@@ -2097,25 +2617,100 @@ If set to None, no status log will be used.
         cl_coercer=str,
     )
 
-    create_logfile_settings(
-        'output', 'output',
-        'This gets a copy of the output of various external commands, '
-        'plus a few\ntimestamps and diagnostics.'
+    config_settings['async_logging'] = dict(
+        descr=(
+'''
+Write log messages from a background thread?
+
+If True, log messages are queued, and a single background thread does
+the actual writing to the status log, syslog, stdout/stderr, alert
+emails, and logfiles.  This way, slow I/O (e.g., an unresponsive syslog
+relay or SMTP server) doesn't hold up the script itself.
+
+Queued messages are always written out before the script exits.
+
+Can be True or False.
+'''
+        ),
+        default=False,
+        cl_coercer=str_to_bool,
     )
-    settings_no_print_logfile('output', True)
 
-    #
-    # extra stuff:
-    # fix up config settings that are platform-dependent or complicated
-    #
+    config_settings['alert_context_lines'] = dict(
+        descr=(
+'''
+How many recent log messages and lines of command output to include in
+alert/error emails.
 
-    ### syslog_addr, syslog_sock_type ###
+The most recent status/alert messages, and the most recent lines of
+output from external commands (when the output is being sent to more
+than one place, e.g. to the output log and stdout), are kept in memory,
+so the emails don't need to re-read any log files.
 
-    found_it = False
+A value of 0 means none.
+'''
+        ),
+        default=20,
+        cl_coercer=int,
+    )
 
-    if hasattr(socket, 'AF_UNIX'):
-        for sock_path in ['/dev/log', '/var/run/syslog']:
-            try:
+    config_settings['repeat_warning_limit'] = dict(
+        descr=(
+'''
+How many times to log the same warning before suppressing it.
+
+This applies to warnings from errors that the script is allowed to
+continue past (e.g., DBMS warnings, or file problems that have been
+marked as non-fatal), which can otherwise flood the logs when they occur
+in a loop.  Warnings are considered the same if they come from the
+same kind of problem (e.g., the same action failing on the same kind of
+file), even if the file paths or other details differ.
+
+Once a warning has been suppressed, a summary with the number of
+suppressed occurrences is logged at most once every
+repeat_warning_interval seconds, and before the script exits.
+
+A value of 0 means no limit; this is the default, so that every warning
+is logged (and emailed) unless the script opts in.
+'''
+        ),
+        default=0,
+        cl_coercer=int,
+    )
+
+    config_settings['repeat_warning_interval'] = dict(
+        descr=(
+'''
+The minimum time between summaries of suppressed warnings, in seconds.
+
+See repeat_warning_limit.
+
+Ignored if repeat_warning_limit is 0.
+'''
+        ),
+        default=60,
+        cl_coercer=float,
+    )
+
+    create_logfile_settings(
+        'output', 'output',
+        'This gets a copy of the output of various external commands, '
+        'plus a few\ntimestamps and diagnostics.'
+    )
+    settings_no_print_logfile('output', True)
+
+    #
+    # extra stuff:
+    # fix up config settings that are platform-dependent or complicated
+    #
+
+    ### syslog_addr, syslog_sock_type ###
+
+    found_it = False
+
+    if hasattr(socket, 'AF_UNIX'):
+        for sock_path in ['/dev/log', '/var/run/syslog']:
+            try:
                 st_mode = os.stat(sock_path)[0]
             except OSError:
                 continue
@@ -2219,10 +2814,22 @@ _null_handler = None
 _syslog_handler = None
 _stdout_handler = None
 _stderr_handler = None
+_log_queue = None
+_log_thread = None
+_atexit_stop_async_registered = False
+_recent_messages = None  # see RingBufferHandler
+
+# internal, see multi_fan_out() and render_recent_context()
+_recent_output = None
 
 # internal, see run_command()
 _devnull_fo = None
 
+# internal, see generic_error_handler()
+_repeat_warnings = {}
+_repeat_warnings_lock = threading.Lock()
+_atexit_summarize_repeat_warnings_registered = False
+
 
 ########################################################################
 #                              FUNCTIONS
@@ -2403,7 +3010,8 @@ def file_error_handler(e, verb, file_label, file_path, must_exist=True,
         must_exist: if false, and if the exception was because of a
                     non-existent file, the exception is ignored and the
                     function returns None
-        see generic_error_handler() for the rest
+        see generic_error_handler() for the rest; repeated warnings are
+        counted together by verb and file_label, whatever the path
 
     Dependencies:
         globals: exitvals['startup']
@@ -2420,7 +3028,8 @@ def file_error_handler(e, verb, file_label, file_path, must_exist=True,
     msg = ('could not {0} {1} ({2})' .
            format(verb, file_label, pps(file_path)))
     return generic_error_handler(e, msg, render_io_exception, use_logger,
-                                 warn_only, exit_val)
+                                 warn_only, exit_val,
+                                 ('file', verb, file_label))
 
 
 def check_file_type(file_path, file_label, type_char='f', follow_links=True,
@@ -2770,85 +3379,146 @@ def filemode(mode):
     return ''.join(mode_chars)
 
 
-def get_file_metadata(file_path, if_noent=None):
+def get_user_name(uid):
+    """
+    Get the name of a user from a uid, with caching.
+    Lookups can be slow (e.g., on LDAP/SSSD systems), so the results
+    are cached for the life of the script.
+    Returns the uid as a string if there is no name for it, or if the pwd
+    module isn't available.
+    Dependencies:
+        globals: _user_names
+        modules: sys, pwd [optional]
+    """
+    if uid not in _user_names:
+        _user_names[uid] = str(uid)
+        if 'pwd' in sys.modules:
+            try:
+                _user_names[uid] = pwd.getpwuid(uid)[0]
+            except KeyError:
+                pass
+    return _user_names[uid]
 
+
+def get_group_name(gid):
     """
-    Get a string with the metadata for a file.
+    Get the name of a group from a gid, with caching.
+    Lookups can be slow (e.g., on LDAP/SSSD systems), so the results
+    are cached for the life of the script.
+    Returns the gid as a string if there is no name for it, or if the grp
+    module isn't available.
+    Dependencies:
+        globals: _group_names
+        modules: sys, grp [optional]
+    """
+    if gid not in _group_names:
+        _group_names[gid] = str(gid)
+        if 'grp' in sys.modules:
+            try:
+                _group_names[gid] = grp.getgrgid(gid)[0]
+            except KeyError:
+                pass
+    return _group_names[gid]
+
+
+def get_files_metadata(file_paths, if_noent=None):
+
+    """
+    Get a list of strings with the metadata for a list of files.
 
     For purposes of this function, 'file' includes directories,
     symlinks, etc.
 
+    All of the files are stat'ed first, and then rendered together, with
+    cached user and group names (see get_user_name() and
+    get_group_name()).
+
     Format is similar to 'ls -l':
         mode links owner group size mtime name
 
     Does not follow symlinks.
 
-    Returns if_noent if the file doesn't exist; may raise an OSError for
-    other error conditions.
+    The list contains if_noent for each file that doesn't exist; may
+    raise an OSError for other error conditions.
 
     Parameters:
-        file_path: path to the file
-        if_noent: value to return if the file doesn't exist
+        file_paths: a list of paths to the files
+        if_noent: value to use for files that don't exist
 
     Dependencies:
-        functions: fix_path(), filemode() [if Python <3.3]
-        modules: os, errno, sys, pwd [optional], grp [optional], time
+        functions: fix_path(), filemode() [if Python <3.3],
+                   get_user_name(), get_group_name()
+        modules: os, errno, sys, time
         Python: 3.3 for stat.filemode() [optional]
 
     """
 
     # get metadata
-    try:
-        (st_mode, unused, unused, st_nlink, st_uid,
-         st_gid, st_size, unused, st_mtime, unused) = (
-            os.lstat(fix_path(file_path)))
-    except OSError as e:
-        if e.errno == errno.ENOENT:
-            return '(none)'
+    st_list = []
+    for file_path in file_paths:
+        try:
+            st_list.append(os.lstat(fix_path(file_path)))
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                st_list.append(None)
+            else:
+                raise
+
+    now = time.time()
+    metadata_list = []
+    for file_path, st in zip(file_paths, st_list):
+        if st is None:
+            metadata_list.append(if_noent)
+            continue
+
+        # get mode string
+        if sys.hexversion >= 0x03030000:
+            st_mode_str = stat.filemode(st.st_mode)
         else:
-            raise
+            st_mode_str = filemode(st.st_mode)
 
-    # get mode string
-    if sys.hexversion >= 0x03030000:
-        st_mode_str = stat.filemode(st_mode)
-    else:
-        st_mode_str = filemode(st_mode)
+        # size string; size doesn't really make sense for all file types
+        if st_mode_str[0] in ['-', 'f', 'd', 'l']:
+            st_size_str = str(st.st_size)
+        else:
+            st_size_str = '-'
 
-    # get username from uid
-    if 'pwd' in sys.modules:
-        st_uid_str = pwd.getpwuid(st_uid)[0]
-    else:
-        st_uid_str = str(st_uid)
+        # get date string
+        if (now - st.st_mtime) > (60 * 60 * 24 * 182.5):  # 6 months
+            st_mtime_str = time.strftime('%b %d %Y',
+                                         time.localtime(st.st_mtime))
+        else:
+            st_mtime_str = time.strftime('%b %d %H:%M',
+                                         time.localtime(st.st_mtime))
 
-    # get group name from gid
-    if 'grp' in sys.modules:
-        st_gid_str = grp.getgrgid(st_gid)[0]
-    else:
-        st_gid_str = str(st_gid)
+        # join what we have so far
+        metadata_str = ' '.join([st_mode_str, str(st.st_nlink),
+                                 get_user_name(st.st_uid),
+                                 get_group_name(st.st_gid), st_size_str,
+                                 st_mtime_str, file_path])
 
-    # size string; size doesn't really make sense for all file types
-    if st_mode_str[0] in ['-', 'f', 'd', 'l']:
-        st_size_str = str(st_size)
-    else:
-        st_size_str = '-'
+        # if it's a link, get the target
+        if st_mode_str[0] == 'l':
+            metadata_str += ' -> ' + os.readlink(fix_path(file_path))
 
-    # get date string
-    if (time.time() - st_mtime) > (60 * 60 * 24 * 182.5):  # 6 months
-        st_mtime_str = time.strftime('%b %d %Y', time.localtime(st_mtime))
-    else:
-        st_mtime_str = time.strftime('%b %d %H:%M',
-                                     time.localtime(st_mtime))
+        metadata_list.append(metadata_str)
 
-    # join what we have so far
-    metadata_str = ' '.join([st_mode_str, str(st_nlink), st_uid_str,
-                             st_gid_str, st_size_str, st_mtime_str,
-                             file_path])
+    return metadata_list
 
-    # if it's a link, get the target
-    if st_mode_str[0] == 'l':
-        metadata_str += ' -> ' + os.readlink(fix_path(file_path))
 
-    return metadata_str
+def get_file_metadata(file_path, if_noent=None):
+    """
+    Get a string with the metadata for a file.
+    Returns if_noent if the file doesn't exist; may raise an OSError for
+    other error conditions.
+    See get_files_metadata() for details.
+    Parameters:
+        file_path: path to the file
+        if_noent: value to return if the file doesn't exist
+    Dependencies:
+        functions: get_files_metadata()
+    """
+    return get_files_metadata([file_path], if_noent)[0]
 
 
 def file_newer_than(file_path, num_min):
@@ -2998,6 +3668,144 @@ def touch_file(file_path, file_label, times=None, use_logger=False,
             pass
 
 
+def write_state_file(file_path, file_label, contents='', use_logger=False,
+                     warn_only=False, exit_val=exitvals['startup']['num']):
+
+    """
+    Atomically create or replace a small state file.
+
+    The file is written to a temporary file in the same directory (see
+    _state_tmp_path()), fsync()ed, and renamed into place, so that a
+    crash can't leave a torn or partially-written file behind; then the
+    directory is fsync()ed, so that the rename is durable.  (The script
+    writes at most one state file per invocation, so there's nothing to
+    batch: this is one directory sync per invocation.)
+
+    This is meant for semaphore and timestamp files, such as the
+    last-started file; the new file gets the current time as its mtime.
+    Because the file is replaced rather than updated in place, it's a
+    new file: it's owned by the user running the script, it gets the
+    usual permissions (0666 minus the umask) rather than keeping any
+    that were set by hand, and any other hard links to the old file are
+    left pointing at the old contents.
+
+    If the script dies between creating the temporary file and renaming
+    it, the temporary file is left behind; these are cleaned up at the
+    next startup (see _remove_stale_state_tmpfiles()).
+
+    Returns True on success; on error, see file_error_handler().
+
+    Parameters:
+        file_path: the file to write
+        contents: a string to write to the file (may be blank)
+        see file_error_handler() for the rest
+
+    Dependencies:
+        globals: exitvals['startup']
+        functions: fix_path(), parentdir(), file_error_handler(),
+                   _state_tmp_path()
+        modules: os, errno
+
+    """
+
+    tmp_path = _state_tmp_path(file_path, os.getpid())
+    try:
+        fd = os.open(fix_path(tmp_path),
+                     os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+        try:
+            if contents:
+                os.write(fd, contents.encode('utf-8'))
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        os.rename(fix_path(tmp_path), fix_path(file_path))
+    except OSError as e:
+        try:
+            os.unlink(fix_path(tmp_path))
+        except OSError:
+            pass
+        # must_exist=True
+        return file_error_handler(e, 'write', file_label, file_path, True,
+                                  use_logger, warn_only, exit_val)
+
+    # directories can't be opened/synced everywhere (e.g., on Windows),
+    # and some filesystems don't support it
+    if os.name != 'posix':
+        return True
+    dir_path = parentdir(file_path)
+    try:
+        fd = os.open(fix_path(dir_path), os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+    except OSError as e:
+        if e.errno not in [errno.EINVAL, errno.EBADF]:
+            # must_exist=True
+            return file_error_handler(e, 'sync', 'directory', dir_path,
+                                      True, use_logger, warn_only,
+                                      exit_val)
+    return True
+
+
+def _state_tmp_path(file_path, pid):
+    """
+    Return the path of the temporary file for a state file.
+    See write_state_file().
+    Parameters:
+        file_path: the state file
+        pid: the ID of the process writing the file
+    Dependencies:
+        functions: parentdir()
+        modules: os
+    """
+    return os.path.join(parentdir(file_path),
+                        '.' + os.path.basename(file_path) + '.tmp' +
+                        str(pid))
+
+
+def _remove_stale_state_tmpfiles(file_list):
+    """
+    Remove temporary files left behind by write_state_file() in
+    processes that have died.
+    Files belonging to processes that are still running (e.g., another
+    copy of the script) are left alone.  Errors are ignored; the files
+    are harmless, apart from the clutter.
+    Parameters:
+        file_list: a list of state file paths
+    Dependencies:
+        functions: fix_path(), parentdir()
+        modules: os, re, errno
+    """
+    # checking for live processes is POSIX-only
+    if os.name != 'posix':
+        return
+    for file_path in file_list:
+        dir_path = parentdir(file_path)
+        r = re.compile('^' +
+                       re.escape('.' + os.path.basename(file_path) +
+                                 '.tmp') +
+                       '([0-9]+)$')
+        try:
+            names = os.listdir(fix_path(dir_path))
+        except OSError:
+            continue
+        for f in names:
+            res = r.search(f)
+            if not res or int(res.group(1)) == os.getpid():
+                continue
+            try:
+                os.kill(int(res.group(1)), 0)
+                continue  # still running
+            except OSError as e:
+                if e.errno != errno.ESRCH:
+                    continue  # e.g., EPERM: running as another user
+            try:
+                os.unlink(fix_path(os.path.join(dir_path, f)))
+            except OSError:
+                pass
+
+
 def mkdir_p(mkdir_path, file_label, use_logger=False, warn_only=False,
             exit_val=exitvals['startup']['num']):
     """
@@ -3049,12 +3857,215 @@ def rm_rf(rm_path, file_label, must_exist=False, use_logger=False,
                                use_logger, warn_only, exit_val)
 
 
+def _parallel_tree_walk(top, entry_func, num_threads=TREE_WALK_THREADS):
+
+    """
+    Walk a directory tree using a pool of worker threads.
+
+    entry_func(rel_path, st) is called once for each entry below top
+    (in no particular order, and possibly from several threads at once),
+    with the entry's path relative to top and its os.lstat() results.
+    For directories, it must return True for the walk to descend into
+    them; symlinks are never followed.
+
+    Returns None, or the first OSError/IOError raised by os.listdir(),
+    os.lstat(), or entry_func(); the walk winds down after the first
+    exception.
+
+    Parameters:
+        top: the directory to walk; must already be run through
+             fix_path()
+        entry_func: see above
+        num_threads: the number of worker threads to use
+
+    Dependencies:
+        globals: TREE_WALK_THREADS
+        modules: os, stat, threading, Queue / queue
+
+    """
+
+    dir_q = queue.Queue()
+    errors = []
+
+    def walk_worker():
+        while True:
+            rel_dir = dir_q.get()
+            if rel_dir is None:
+                dir_q.task_done()
+                return
+            try:
+                if not errors:
+                    for name in os.listdir(os.path.join(top, rel_dir)):
+                        rel_path = os.path.join(rel_dir, name)
+                        st = os.lstat(os.path.join(top, rel_path))
+                        if (entry_func(rel_path, st) and
+                              stat.S_ISDIR(st.st_mode)):
+                            dir_q.put(rel_path)
+            except (OSError, IOError) as e:
+                errors.append(e)
+            finally:
+                dir_q.task_done()
+
+    threads = []
+    for i in range(max(1, num_threads)):
+        t = threading.Thread(target=walk_worker)
+        t.daemon = True
+        t.start()
+        threads.append(t)
+    dir_q.put('')
+    dir_q.join()
+    for t in threads:
+        dir_q.put(None)
+    for t in threads:
+        t.join()
+
+    return errors[0] if errors else None
+
+
+def hardlink_tree(src_path, dest_path, file_label, use_logger=False,
+                  warn_only=False, exit_val=exitvals['startup']['num']):
+
+    """
+    Copy a directory tree, using hard links for the files.
+
+    This is the equivalent of 'cp -al': directories are created,
+    symlinks are copied, and everything else is hard-linked, so the
+    copy takes almost no extra space or I/O.  Anything that updates the
+    copy afterwards must replace files rather than rewriting them in
+    place (e.g., rsync without --inplace), or the changes will show up
+    in both trees.
+
+    The source tree is walked in parallel; see _parallel_tree_walk().
+
+    On error, the partial copy is removed before the error is handled,
+    so that a half-built tree can't be mistaken for a complete one.
+
+    Parameters:
+        src_path: the directory to copy
+        dest_path: the path of the copy; must not exist yet
+        see file_error_handler() for the rest
+
+    Dependencies:
+        globals: exitvals['startup']
+        functions: fix_path(), _parallel_tree_walk(),
+                   file_error_handler(), rm_rf()
+        modules: os, stat, shutil
+
+    """
+
+    src = fix_path(src_path)
+    dest = fix_path(dest_path)
+    as_root = hasattr(os, 'geteuid') and (os.geteuid() == 0)
+    dir_list = []
+    created = False
+
+    def link_entry(rel_path, st):
+        dest_entry = os.path.join(dest, rel_path)
+        if stat.S_ISDIR(st.st_mode):
+            os.mkdir(dest_entry)
+            if as_root:
+                os.chown(dest_entry, st.st_uid, st.st_gid)
+            dir_list.append(rel_path)
+            return True
+        if stat.S_ISLNK(st.st_mode):
+            os.symlink(os.readlink(os.path.join(src, rel_path)), dest_entry)
+            if as_root:
+                os.lchown(dest_entry, st.st_uid, st.st_gid)
+        else:
+            os.link(os.path.join(src, rel_path), dest_entry)
+        return False
+
+    try:
+        os.mkdir(dest)
+        created = True
+        e = _parallel_tree_walk(src, link_entry)
+        if e:
+            raise e
+        # directory metadata goes last, children before parents,
+        # because adding entries changes the timestamps
+        dir_list.sort(key=len, reverse=True)
+        for rel_path in dir_list + ['']:
+            shutil.copystat(os.path.join(src, rel_path),
+                            os.path.join(dest, rel_path))
+    except (OSError, IOError) as e:
+        # the walk is over (all of the workers have finished), so
+        # nothing else is adding to the tree
+        if created:
+            rm_rf(dest_path, 'partial copy of ' + file_label,
+                  must_exist=False, use_logger=use_logger, warn_only=True)
+        # must_exist=True
+        file_error_handler(e, 'hard-link', file_label, src_path, True,
+                           use_logger, warn_only, exit_val)
+
+
+def get_disk_usage(file_path):
+
+    """
+    Get the disk usage of a file or directory tree, in bytes.
+
+    Usage is measured in allocated blocks where the platform reports
+    them, otherwise in apparent sizes.  Files with more than one hard
+    link are counted in proportion (e.g., half their size for two
+    links), so that trees which share files (see hardlink_tree()) add up
+    to roughly their real combined usage.  Symlinks are not followed.
+
+    Directories are walked in parallel; see _parallel_tree_walk().
+
+    May raise an OSError exception.
+
+    Parameters:
+        file_path: the file or directory to measure
+
+    Dependencies:
+        functions: _get_disk_usage()
+
+    """
+
+    return _get_disk_usage(file_path)[0]
+
+
+def _get_disk_usage(file_path):
+    """
+    Get the disk usage of a file or directory tree, in bytes, and
+    whether it contains any files with more than one hard link.
+    Returns a tuple: (usage, shared?).  See get_disk_usage().
+    Dependencies:
+        functions: fix_path(), _parallel_tree_walk()
+        modules: os, stat
+    """
+
+    # appended to from the walker threads
+    shared = []
+
+    def entry_usage(st):
+        if hasattr(st, 'st_blocks'):
+            usage = st.st_blocks * 512
+        else:
+            usage = st.st_size
+        if (not stat.S_ISDIR(st.st_mode)) and (st.st_nlink > 1):
+            usage //= st.st_nlink
+            if not shared:
+                shared.append(True)
+        return usage
+
+    st = os.lstat(fix_path(file_path))
+    usage_list = [entry_usage(st)]
+    if stat.S_ISDIR(st.st_mode):
+        def add_entry(rel_path, st):
+            usage_list.append(entry_usage(st))
+            return True
+        e = _parallel_tree_walk(fix_path(file_path), add_entry)
+        if e:
+            raise e
+    return (sum(usage_list), bool(shared))
+
+
 ############################
 # file rotation and pruning
 ############################
 
 def rotate_num_files(path_prefix, sep, suffix,
-                     exit_val=exitvals['startup']['num']):
+                     exit_val=exitvals['startup']['num'], hardlink=False):
 
     """
     Rotate numbered files or directories.
@@ -3062,6 +4073,12 @@ def rotate_num_files(path_prefix, sep, suffix,
     File/directory names can optionally have any of the suffixes in
     ZIP_SUFFIXES following the suffix parameter.
 
+    If hardlink is true and the newly-rotated #1 entry is a directory,
+    a new current (un-numbered) directory is seeded from it as a
+    hard-link copy (see hardlink_tree()), rsnapshot-style; this way,
+    something like rsync only has to transfer the changes since the
+    last run.  (rsync must not be run with --inplace in this case.)
+
     Parameters:
         path_prefix: the full file/directory path up to the number, not
                      including any trailing separator
@@ -3070,10 +4087,11 @@ def rotate_num_files(path_prefix, sep, suffix,
         suffix: the suffix after the number, including any leading
                 separator; cannot begin with a number
         exit_val: the value to exit the script with on error
+        hardlink: if true, seed the new current directory; see above
 
     Dependencies:
         globals: email_logger, exitvals['startup'], ZIP_SUFFIXES
-        functions: parentdir(), fix_path(), pps()
+        functions: parentdir(), fix_path(), pps(), hardlink_tree()
         modules: re, os, operator, sys
 
     """
@@ -3147,12 +4165,142 @@ def rotate_num_files(path_prefix, sep, suffix,
                                       pps(new_name), e.errno, e.strerror))
             sys.exit(exit_val)
 
+    # seed the new current directory from the previous one
+    if hardlink:
+        prev_path = path_prefix + sep + '1' + suffix
+        if (os.path.isdir(fix_path(prev_path)) and
+              not os.path.lexists(fix_path(path_prefix + suffix))):
+            hardlink_tree(prev_path, path_prefix + suffix, 'directory',
+                          use_logger=True, warn_only=False,
+                          exit_val=exit_val)
+
+
+def _prune_files_by_usage(dir_path, prefix, keep_list, old_list, bytes_f,
+                          exit_val=exitvals['startup']['num']):
+
+    """
+    Remove the oldest files/directories until a size budget is met.
+
+    Directory sizes are cached in a sidecar file in dir_path (named
+    '.' + prefix + USAGE_INDEX_SUFFIX), so that old generations which
+    haven't changed don't have to be walked again on each run.  Entries
+    are keyed on each directory's device and inode numbers, which
+    survive rotation (unlike names), and checked against its mtime.
+    (Changes deep inside a directory don't update its mtime; this is
+    fine for old generations, which shouldn't be changing, and the
+    current entries are never looked up in the cache.)
+
+    Sizes of directories containing hard-linked files depend on the
+    other generations that share the files (see get_disk_usage()), so
+    those are only reused if the set of generations is the same as when
+    they were cached; in practice, this means that hard-linked
+    generations (see rotate_num_files()) are walked on every run, but
+    others aren't.
+
+    Parameters:
+        dir_path: the directory containing the files/directories
+        prefix: the filename prefix of the files/directories; used to
+                name the sidecar file
+        keep_list: names of entries that count towards the budget but
+                   are never removed (i.e., the current one)
+        old_list: names of entries that may be removed, oldest first
+        bytes_f: the size budget, in bytes
+        exit_val: the value to exit the script with on error
+
+    Dependencies:
+        globals: email_logger, exitvals['startup'], USAGE_INDEX_SUFFIX
+        functions: fix_path(), pps(), get_disk_usage(),
+                   _get_disk_usage(), rm_rf(), file_error_handler()
+        modules: os, stat, json, sys
+
+    """
+
+    # load the cache; it's only a cache, so any problems just mean we
+    # start from scratch
+    index_path = os.path.join(dir_path, '.' + prefix + USAGE_INDEX_SUFFIX)
+    try:
+        with open(fix_path(index_path), 'r') as index_fo:
+            old_index = json.load(index_fo)
+        if (not isinstance(old_index, dict) or
+              not isinstance(old_index.get('entries'), dict)):
+            old_index = {}
+    except (IOError, OSError, ValueError):
+        old_index = {}
+    old_entries = old_index.get('entries', {})
+
+    # identify the entries
+    stats = {}
+    for f in keep_list + old_list:
+        f_path = os.path.join(dir_path, f)
+        try:
+            stats[f] = os.lstat(fix_path(f_path))
+        except OSError as e:
+            email_logger.error('Error: could not get the size of '
+                               'file/directory {0}; exiting.\n'
+                               'Details: [Errno {1}] {2}' .
+                               format(pps(f_path), e.errno, e.strerror))
+            sys.exit(exit_val)
+    ids = dict((f, '{0}:{1}'.format(st.st_dev, st.st_ino))
+               for f, st in stats.items())
+    generations = sorted(ids.values())
+    same_generations = (old_index.get('generations') == generations)
+
+    # get the sizes
+    new_entries = {}
+    sizes = {}
+    for f in keep_list + old_list:
+        f_path = os.path.join(dir_path, f)
+        st = stats[f]
+        try:
+            if not stat.S_ISDIR(st.st_mode) or f in keep_list:
+                sizes[f] = get_disk_usage(f_path)
+                continue
+            cached = old_entries.get(ids[f])
+            if (isinstance(cached, list) and len(cached) == 3 and
+                  cached[0] == st.st_mtime and
+                  (not cached[2] or same_generations)):
+                sizes[f], shared = cached[1], cached[2]
+            else:
+                sizes[f], shared = _get_disk_usage(f_path)
+            new_entries[ids[f]] = [st.st_mtime, sizes[f], shared]
+        except OSError as e:
+            email_logger.error('Error: could not get the size of '
+                               'file/directory {0}; exiting.\n'
+                               'Details: [Errno {1}] {2}' .
+                               format(pps(f_path), e.errno, e.strerror))
+            sys.exit(exit_val)
+
+    # delete files
+    total = sum(sizes.values())
+    for f in old_list:
+        if total <= bytes_f:
+            break
+        rm_rf(os.path.join(dir_path, f), 'file/directory',
+              must_exist=False, use_logger=True, warn_only=False,
+              exit_val=exit_val)
+        total -= sizes[f]
+        new_entries.pop(ids[f], None)
+
+    # save the cache; the generations are recorded as they were when
+    # the sizes were measured, so if any were just removed, the next run
+    # will re-walk the ones with shared files
+    if new_entries or old_entries:
+        try:
+            with open(fix_path(index_path + '.new'), 'w') as index_fo:
+                json.dump(dict(generations=generations,
+                               entries=new_entries), index_fo)
+            os.rename(fix_path(index_path + '.new'), fix_path(index_path))
+        except (IOError, OSError) as e:
+            file_error_handler(e, 'write', 'usage index file', index_path,
+                               must_exist=True, use_logger=True,
+                               warn_only=True)
+
 
 def prune_num_files(path_prefix, sep, suffix, num_f, days_f,
-                    exit_val=exitvals['startup']['num']):
+                    exit_val=exitvals['startup']['num'], bytes_f=0):
 
     """
-    Prune numbered files or directories by number and date.
+    Prune numbered files or directories by number, date, and size.
 
     File/directory names can optionally have any of the suffixes in
     ZIP_SUFFIXES following the suffix parameter.
@@ -3168,17 +4316,21 @@ def prune_num_files(path_prefix, sep, suffix, num_f, days_f,
                (un-numbered) one; 0 = unlimited
         days_f: the number of days worth of files to keep; 0 = unlimited
         exit_val: the value to exit the script with on error
+        bytes_f: the maximum total size of the files to keep, in bytes,
+                 including the current one (which is never removed);
+                 applied after num_f and days_f, oldest files first;
+                 0 = unlimited
 
     Dependencies:
         globals: email_logger, exitvals['startup'], ZIP_SUFFIXES
         functions: parentdir(), fix_path(), pps(), file_newer_than(),
-                   rm_rf()
-        modules: re, os, sys
+                   rm_rf(), _prune_files_by_usage()
+        modules: re, os, operator, sys
 
     """
 
     # anything to do?
-    if not num_f and not days_f:
+    if not num_f and not days_f and not bytes_f:
         return
 
     # pull apart the path prefix
@@ -3205,6 +4357,7 @@ def prune_num_files(path_prefix, sep, suffix, num_f, days_f,
         sys.exit(exit_val)
 
     # delete files
+    f_remain = []
     for ft in f_list:
         # by number
         if num_f and (ft[1] >= num_f):
@@ -3231,13 +4384,35 @@ def prune_num_files(path_prefix, sep, suffix, num_f, days_f,
                 rm_rf(os.path.join(dir_path, ft[0]), 'file/directory',
                       must_exist=False, use_logger=True, warn_only=False,
                       exit_val=exit_val)
+                continue
+
+        f_remain.append(ft)
+
+    # by size
+    if bytes_f:
+        r = re.compile('^' +
+                       re.escape(prefix + suffix) +
+                       '(|' + '|'.join(map(re.escape, ZIP_SUFFIXES)) + ')' +
+                       '$')
+        try:
+            cur_list = [f for f in os.listdir(fix_path(dir_path))
+                          if r.search(f)]
+        except OSError as e:
+            email_logger.error('Error: could not list directory {0}; '
+                               'exiting.\nDetails: [Errno {1}] {2}' .
+                               format(pps(dir_path), e.errno, e.strerror))
+            sys.exit(exit_val)
+        f_remain.sort(key=operator.itemgetter(1), reverse=True)
+        _prune_files_by_usage(dir_path, prefix, cur_list,
+                              [ft[0] for ft in f_remain], bytes_f,
+                              exit_val)
 
 
 def prune_date_files(path_prefix, sep, suffix, num_f, days_f,
-                     exit_val=exitvals['startup']['num']):
+                     exit_val=exitvals['startup']['num'], bytes_f=0):
 
     """
-    Prune dated files or directories by number and date.
+    Prune dated files or directories by number, date, and size.
 
     File/directory names can optionally have any of the suffixes in
     ZIP_SUFFIXES following the suffix parameter.
@@ -3261,16 +4436,21 @@ def prune_date_files(path_prefix, sep, suffix, num_f, days_f,
                0 = unlimited
         days_f: the number of days worth of files to keep; 0 = unlimited
         exit_val: the value to exit the script with on error
+        bytes_f: the maximum total size of the files to keep, in bytes,
+                 including the current (newest) one, which is never
+                 removed; applied after num_f and days_f, oldest files
+                 first; 0 = unlimited
 
     Dependencies:
         globals: email_logger, exitvals['startup'], ZIP_SUFFIXES
-        functions: parentdir(), fix_path(), pps(), rm_rf()
+        functions: parentdir(), fix_path(), pps(), rm_rf(),
+                   _prune_files_by_usage()
         modules: re, os, time, operator, sys
 
     """
 
     # anything to do?
-    if not num_f and not days_f:
+    if not num_f and not days_f and not bytes_f:
         return
 
     # pull apart the path prefix
@@ -3312,19 +4492,26 @@ def prune_date_files(path_prefix, sep, suffix, num_f, days_f,
             f_remain.append((f, st_mtime))
 
     # delete by number
+    f_remain.sort(key=operator.itemgetter(1), reverse=True)
     if num_f:
-        f_remain.sort(key=operator.itemgetter(1), reverse=True)
         for i, ft in enumerate(f_remain):
             if i >= num_f:
                 rm_rf(os.path.join(dir_path, ft[0]), 'file/directory',
                     must_exist=False, use_logger=True, warn_only=False,
                     exit_val=exit_val)
+        f_remain = f_remain[:num_f]
+
+    # delete by size
+    if bytes_f and f_remain:
+        _prune_files_by_usage(dir_path, prefix, [f_remain[0][0]],
+                              [ft[0] for ft in reversed(f_remain[1:])],
+                              bytes_f, exit_val)
 
 
 def prune_files(layout, path_prefix, sep, suffix, num_f, days_f,
-                exit_val=exitvals['startup']['num']):
+                exit_val=exitvals['startup']['num'], bytes_f=0):
     """
-    Wrapper: prune numbered or dated files/dirs by number and date.
+    Wrapper: prune numbered or dated files/dirs by number, date, and size.
     File/directory names can optionally have any of the suffixes in
     ZIP_SUFFIXES following the suffix parameter.
     Parameters:
@@ -3338,13 +4525,16 @@ def prune_files(layout, path_prefix, sep, suffix, num_f, days_f,
         # not generally called for these, but here for future use / FTR
         pass  # nothing to do
     elif layout in ['number', 'numberdir']:
-        prune_num_files(path_prefix, sep, suffix, num_f, days_f, exit_val)
+        prune_num_files(path_prefix, sep, suffix, num_f, days_f, exit_val,
+                        bytes_f)
     elif layout in ['date', 'datedir']:
-        prune_date_files(path_prefix, sep, suffix, num_f, days_f, exit_val)
+        prune_date_files(path_prefix, sep, suffix, num_f, days_f, exit_val,
+                         bytes_f)
 
 
 def rotate_prune_files(layout, path_prefix, sep, suffix, num_f, days_f,
-                       exit_val=exitvals['startup']['num']):
+                       exit_val=exitvals['startup']['num'], hardlink=False,
+                       bytes_f=0):
 
     """
     Wrapper: rotate and prune numbered or dated files or directories.
@@ -3352,6 +4542,14 @@ def rotate_prune_files(layout, path_prefix, sep, suffix, num_f, days_f,
     File/directory names can optionally have any of the suffixes in
     ZIP_SUFFIXES following the suffix parameter.
 
+    Parameters:
+        hardlink: for the 'numberdir' layout, rotate the directories
+                  and seed the new current directory as a hard-link
+                  copy of the previous one (see rotate_num_files());
+                  otherwise, 'numberdir' directories are only pruned
+                  (rotating them is up to the caller)
+        see rotate_num_files() and prune_files() for the rest
+
     Dependencies:
         functions: rotate_num_files(), prune_files()
 
@@ -3359,9 +4557,12 @@ def rotate_prune_files(layout, path_prefix, sep, suffix, num_f, days_f,
     # rotate
     if layout == 'number':
         rotate_num_files(path_prefix, sep, suffix, exit_val)
+    elif layout == 'numberdir' and hardlink:
+        rotate_num_files(path_prefix, sep, suffix, exit_val, True)
 
     # prune
-    prune_files(layout, path_prefix, sep, suffix, num_f, days_f, exit_val)
+    prune_files(layout, path_prefix, sep, suffix, num_f, days_f, exit_val,
+                bytes_f)
 
 
 def rotate_prune_logfiles(name_str, exit_val=exitvals['startup']['num']):
@@ -3377,7 +4578,8 @@ def rotate_prune_logfiles(name_str, exit_val=exitvals['startup']['num']):
 
     Dependencies:
         config settings: [where * = name_str]: *_log, *_log_layout,
-                         *_log_sep, *_log_num, *_log_days
+                         *_log_sep, *_log_num, *_log_days,
+                         *_log_max_bytes
         globals: cfg, config_settings, status_logger, _logfile_info,
                  exitvals['startup']
         functions: rotate_prune_files()
@@ -3389,8 +4591,8 @@ def rotate_prune_logfiles(name_str, exit_val=exitvals['startup']['num']):
         if ('no_print' not in config_settings[name_str + '_log'] or
               not config_settings[name_str + '_log']['no_print']):
             status_logger.info(
-                '{0} logging is off; not rotating logs.' .
-                format(_logfile_info[name_str]['descr_str'].capitalize())
+                '%s logging is off; not rotating logs.',
+                _logfile_info[name_str]['descr_str'].capitalize()
             )
         return
 
@@ -3399,25 +4601,26 @@ def rotate_prune_logfiles(name_str, exit_val=exitvals['startup']['num']):
         if ('no_print' not in config_settings[name_str + '_log'] or
               not config_settings[name_str + '_log']['no_print']):
             status_logger.info(
-                '{0} logs are being appended to a single file; '
-                'not rotating logs.' .
-                format(_logfile_info[name_str]['descr_str'].capitalize())
+                '%s logs are being appended to a single file; '
+                'not rotating logs.',
+                _logfile_info[name_str]['descr_str'].capitalize()
             )
         return
 
-    status_logger.info('Rotating/pruning {0} logs...' .
-                       format(_logfile_info[name_str]['descr_str']))
+    status_logger.info('Rotating/pruning %s logs...',
+                       _logfile_info[name_str]['descr_str'])
 
     # rotate and prune
     rotate_prune_files(
         cfg[name_str + '_log_layout'], cfg[name_str + '_log'],
         cfg[name_str + '_log_sep'], '', cfg[name_str + '_log_num'],
-        cfg[name_str + '_log_days'], exit_val
+        cfg[name_str + '_log_days'], exit_val,
+        bytes_f=cfg[name_str + '_log_max_bytes']
     )
 
     status_logger.info(
-        '{0} log rotation/pruning complete.' .
-        format(_logfile_info[name_str]['descr_str'].capitalize())
+        '%s log rotation/pruning complete.',
+        _logfile_info[name_str]['descr_str'].capitalize()
     )
 
 
@@ -3449,13 +4652,17 @@ def err_exit(msg, exit_val):
     In general, this function should only be used for errors which might
     happen before the config file has been imported and the logger
     objects have been initialized.
+    Any queued log messages are written out first (see
+    logging_flush_async()).
     Parameters:
         msg: the message to print
         exit_val: the value to exit the script with; if this is None,
                   don't actually exit
     Dependencies:
+        functions: logging_flush_async()
         modules: sys
     """
+    logging_flush_async()
     print('\n' + msg + '\n', file=sys.stderr)
     if exit_val is not None:
         sys.exit(exit_val)
@@ -3467,14 +4674,115 @@ def email_diagnostics():
     This is a sample that can be used as-is or overridden by redefining
     this function.
     Dependencies:
-        functions: render_config()
+        functions: render_config(), render_status(),
+                   render_recent_context()
     """
-    return ('\n\n' + render_config() + '\n\n\n' + render_status(full=True))
+    return ('\n\n' + render_config() + '\n\n\n' + render_status(full=True) +
+            render_recent_context())
 
 
-class SMTPDiagHandler(logging.handlers.SMTPHandler):
+def render_recent_context():
+    """
+    Return the recent log messages and command output.
+    Returns an empty string if there is nothing to show (or if the
+    alert_context_lines setting is 0); otherwise, the string starts with
+    blank lines, for use in email_diagnostics().
+    Dependencies:
+        globals: _recent_messages, _recent_output
+    """
+    msg = ''
+    if _recent_messages:
+        msg += (
+'''
+
+
+-----------------------
+Recent Status Messages:
+-----------------------
+
+'''
+        )
+        # copy first; other threads may be adding to it
+        msg += '\n'.join(list(_recent_messages))
+    if _recent_output:
+        msg += (
+'''
+
+
+----------------------
+Recent Command Output:
+----------------------
+
+'''
+        )
+        lines = []
+        for line in list(_recent_output):
+            if isinstance(line, bytes) and not isinstance(line, str):
+                line = line.decode('utf-8', 'replace')
+            lines.append(line.rstrip('\n'))
+        msg += '\n'.join(lines)
+    return msg
+
+
+class RingBufferHandler(logging.Handler):
+
+    """
+    Keep the most recent log messages in memory.
+
+    The messages are stored, formatted, in a bounded deque; see
+    render_recent_context().
+
+    """
+
+    def __init__(self, buf):
+        """
+        Set up instance variables here and in the superclass.
+        Parameters:
+            buf: the collections.deque (with a maxlen) to store
+                 messages in
+        """
+        super(RingBufferHandler, self).__init__()
+        self.buf = buf
+
+
+    def emit(self, record):
+        """
+        Format the record and add it to the buffer.
+        """
+        try:
+            self.buf.append(self.format(record))
+        except Exception:
+            self.handleError(record)
+
+
+class SMTPDiagHandler(logging.handlers.SMTPHandler):
+
+    """
+    Override SMTPHandler to add diagnostics to the email.
+
+    Also supports collecting messages into digest emails, and rate
+    limiting; see the *_emails_digest_secs, *_emails_digest_max, and
+    *_emails_max_per_hour settings.
+
+    SMTP connections are kept open and shared between all handlers with
+    the same server, credentials, and security settings, instead of
+    connecting (and doing any TLS and authentication) for every email.
+
+    """
+
+    # pooled SMTP connections; keys are tuples of (host, port, username,
+    # password, secure), values are [connection, last-used time] lists
+    _smtp_pool = {}
+    _smtp_pool_lock = threading.RLock()
+
+    # rate limiting is shared between handlers with the same recipients;
+    # keys are tuples of addresses, values are lists of send times
+    _send_times = {}
+
+    # for flushing held messages at exit
+    _atexit_flush_all_registered = False
+    _digest_handlers = []  # contains handlers that can hold messages
 
-    """Override SMTPHandler to add diagnostics to the email."""
 
     def __init__(self, name_str, descr_str, notify_logger='status'):
         """
@@ -3490,11 +4798,15 @@ class SMTPDiagHandler(logging.handlers.SMTPHandler):
                                * 'alert' for alert_logger
                                * None for no notifications
         Dependencies:
+            class vars: _atexit_flush_all_registered, _digest_handlers
+            class methods: flush_all()
             config settings: [where * = name_str]: *_emails_host,
                              *_emails_from, *_emails_to,
                              *_emails_subject, *_emails_cred,
-                             *_emails_sec
+                             *_emails_sec, *_emails_digest_secs,
+                             *_emails_digest_max, *_emails_max_per_hour
             globals: cfg, status_logger, alert_logger
+            modules: atexit
             Python: 2.7/3.2, for the 'secure' parameter to SMTPHandler()
         """
         self.name_str = name_str
@@ -3513,29 +4825,510 @@ class SMTPDiagHandler(logging.handlers.SMTPHandler):
             cfg[name_str + '_emails_cred'],
             cfg[name_str + '_emails_sec'],
         )
+        self.pool_key = (
+            self.mailhost, self.mailport, self.username,
+            getattr(self, 'password', None),
+            tuple(self.secure) if self.secure is not None else None
+        )
+        self.digest_secs = cfg[name_str + '_emails_digest_secs']
+        self.digest_max = cfg[name_str + '_emails_digest_max']
+        self.max_per_hour = cfg[name_str + '_emails_max_per_hour']
+        self.held = []
+        self.timer = None
+        self.exiting = False
+        if self.digest_secs or self.digest_max or self.max_per_hour:
+            if self not in SMTPDiagHandler._digest_handlers:
+                SMTPDiagHandler._digest_handlers.append(self)
+        # also closes the pooled connections
+        if not SMTPDiagHandler._atexit_flush_all_registered:
+            atexit.register(SMTPDiagHandler.flush_all)
+            SMTPDiagHandler._atexit_flush_all_registered = True
+
+
+    @classmethod
+    def flush_all(cls):
+        """
+        Send all held messages, ignoring the rate limits.
+        Then close all pooled SMTP connections.
+        Registered to run at exit.
+        Dependencies:
+            class vars: _digest_handlers
+            class methods: close_connections()
+            instance methods: flush()
+            functions: logging_flush_async()
+        """
+        # make sure any queued messages have arrived first
+        logging_flush_async()
+        for handler in cls._digest_handlers[:]:
+            handler.exiting = True
+            handler.flush()
+        cls.close_connections()
+
+
+    @classmethod
+    def close_connections(cls):
+        """
+        Close all pooled SMTP connections.
+        Dependencies:
+            class vars: _smtp_pool, _smtp_pool_lock
+            class methods: _drop_connection()
+        """
+        with cls._smtp_pool_lock:
+            for key in list(cls._smtp_pool):
+                cls._drop_connection(key)
+
+
+    @classmethod
+    def _drop_connection(cls, key):
+        """
+        Close a pooled SMTP connection and remove it from the pool.
+        Errors are ignored, since the connection may already be dead.
+        Parameters:
+            key: the pool key of the connection
+        Dependencies:
+            class vars: _smtp_pool
+            modules: smtplib, socket
+        """
+        smtp = cls._smtp_pool.pop(key)[0]
+        try:
+            smtp.quit()
+        except (smtplib.SMTPException, socket.error):
+            try:
+                smtp.close()
+            except (smtplib.SMTPException, socket.error):
+                pass
+
+
+    def _get_connection(self):
+        """
+        Return a working pooled SMTP connection for this handler.
+        An existing connection is reused if it hasn't been idle for too
+        long and it passes a NOOP health check; otherwise, a new one is
+        made, including any TLS and authentication.
+        Dependencies:
+            class vars: _smtp_pool
+            class methods: _drop_connection()
+            instance vars: (from SMTPHandler), pool_key
+            globals: SMTP_IDLE_TIMEOUT
+            modules: smtplib, socket, time
+        """
+        key = self.pool_key
+        if key in SMTPDiagHandler._smtp_pool:
+            smtp, last_used = SMTPDiagHandler._smtp_pool[key]
+            if (time.time() - last_used) <= SMTP_IDLE_TIMEOUT:
+                try:
+                    if smtp.noop()[0] == 250:
+                        return smtp
+                except (smtplib.SMTPException, socket.error):
+                    pass
+            SMTPDiagHandler._drop_connection(key)
+        port = self.mailport if self.mailport else smtplib.SMTP_PORT
+        smtp = smtplib.SMTP(self.mailhost, port,
+                            timeout=getattr(self, 'timeout', 5.0))
+        try:
+            if self.username:
+                if self.secure is not None:
+                    smtp.ehlo()
+                    smtp.starttls(*self.secure)
+                    smtp.ehlo()
+                smtp.login(self.username, self.password)
+        except Exception:
+            smtp.close()
+            raise
+        SMTPDiagHandler._smtp_pool[key] = [smtp, time.time()]
+        return smtp
+
+
+    def send_email(self, record):
+        """
+        Send one email for a log record, using a pooled connection.
+        If the connection turns out to be broken, reconnect and try
+        once more.
+        Dependencies:
+            class vars: _smtp_pool, _smtp_pool_lock
+            class methods: _drop_connection()
+            instance vars: (from SMTPHandler), pool_key
+            instance methods: _get_connection()
+            modules: smtplib, socket, time, email.utils, MIMEText
+        """
+        try:
+            msg = MIMEText(self.format(record), 'plain', 'utf-8')
+            msg['From'] = self.fromaddr
+            msg['To'] = ','.join(self.toaddrs)
+            msg['Subject'] = self.getSubject(record)
+            msg['Date'] = email.utils.formatdate(localtime=True)
+            msg_str = msg.as_string()
+            with SMTPDiagHandler._smtp_pool_lock:
+                try:
+                    smtp = self._get_connection()
+                    smtp.sendmail(self.fromaddr, self.toaddrs, msg_str)
+                except (smtplib.SMTPServerDisconnected, socket.error):
+                    if self.pool_key in SMTPDiagHandler._smtp_pool:
+                        SMTPDiagHandler._drop_connection(self.pool_key)
+                    smtp = self._get_connection()
+                    smtp.sendmail(self.fromaddr, self.toaddrs, msg_str)
+                SMTPDiagHandler._smtp_pool[self.pool_key][1] = time.time()
+        except Exception:
+            self.handleError(record)
+
+
+    def _rate_wait(self):
+        """
+        Return how long to wait before another email may be sent.
+        Returns 0 if an email may be sent now.
+        Dependencies:
+            class vars: _send_times
+            instance vars: max_per_hour, toaddrs
+            modules: time
+        """
+        if not self.max_per_hour:
+            return 0
+        key = tuple(self.toaddrs)
+        now = time.time()
+        send_times = [t for t in SMTPDiagHandler._send_times.get(key, [])
+                        if t > (now - 3600)]
+        SMTPDiagHandler._send_times[key] = send_times
+        if len(send_times) < self.max_per_hour:
+            return 0
+        return send_times[0] + 3600 - now
+
+
+    def _set_timer(self, delay):
+        """
+        Arrange for the held messages to be sent after a delay.
+        Dependencies:
+            instance vars: timer
+            instance methods: flush()
+            modules: threading
+        """
+        if self.timer is not None:
+            self.timer.cancel()
+        self.timer = threading.Timer(delay, self.flush)
+        self.timer.daemon = True
+        self.timer.start()
+
 
     def emit(self, record):
         """
-        Add diagnostics to the message, and log that an email was sent.
+        Send the message now, or hold it for a digest email.
         Dependencies:
-            config settings: [where * = name_str]: *_emails_to
-            globals: cfg, (contents of self.notify_logger)
-            functions: pps(), email_diagnostics()
+            instance vars: digest_secs, digest_max, max_per_hour, held,
+                           timer, exiting
+            instance methods: send_records(), _rate_wait(),
+                              _set_timer(), flush()
             modules: copy
         """
-        # use a copy so the parent loggers won't see the changed message
+        # use a copy so the parent loggers won't see any changes
         r = copy.copy(record)
-        if r.msg[-1] != '\n':
+        if (not (self.digest_secs or self.digest_max or self.max_per_hour)
+              or self.exiting):
+            self.send_records([r])
+            return
+        self.held.append(r)
+        if self.digest_max and len(self.held) >= self.digest_max:
+            self.flush()
+        elif not (self.digest_secs or self.digest_max):
+            # only rate-limited
+            self.flush()
+        elif self.digest_secs and self.timer is None:
+            self._set_timer(self.digest_secs)
+
+
+    def flush(self):
+        """
+        Send any held messages as a digest, subject to the rate limit.
+        If the rate limit doesn't allow it, try again when it will.
+        Dependencies:
+            instance vars: held, timer, exiting
+            instance methods: send_records(), _rate_wait(), _set_timer()
+        """
+        self.acquire()
+        try:
+            if not self.held:
+                return
+            wait = 0 if self.exiting else self._rate_wait()
+            if wait:
+                self._set_timer(wait)
+                return
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            records = self.held
+            self.held = []
+            self.send_records(records)
+        finally:
+            self.release()
+
+
+    def close(self):
+        """
+        Send any held messages, then close the handler.
+        Dependencies:
+            instance vars: exiting
+            instance methods: flush()
+        """
+        self.exiting = True
+        self.flush()
+        super(SMTPDiagHandler, self).close()
+
+
+    def send_records(self, records):
+        """
+        Send one email for a list of records, with diagnostics added.
+        A list of more than one record is sent as a digest.
+        Dependencies:
+            class vars: _send_times
+            config settings: [where * = name_str]: *_emails_to
+            globals: cfg, (contents of self.notify_logger),
+                     FULL_DATE_FORMAT
+            instance methods: send_email()
+            functions: pps(), email_diagnostics()
+            modules: copy, time
+        """
+        r = copy.copy(records[-1])
+        if len(records) == 1:
+            r.msg = r.getMessage()
+        else:
+            r.msg = ('{0} messages:\n\n' .
+                     format(len(records)))
+            r.msg += '\n\n'.join(
+                [time.strftime(FULL_DATE_FORMAT,
+                               time.localtime(x.created)) + ':\n' +
+                     x.getMessage()
+                 for x in records]
+            )
+        r.args = None
+        if r.msg[-1:] != '\n':
             r.msg += '\n'
         r.msg += email_diagnostics()
-        super(SMTPDiagHandler, self).emit(r)
+        self.send_email(r)
+        SMTPDiagHandler._send_times.setdefault(
+            tuple(self.toaddrs), []
+        ).append(time.time())
         if self.notify_logger:
-            notify_msg = ('{0} email sent to {1}.' .
-                          format(self.descr_str.capitalize(),
-                                 pps(cfg[self.name_str + '_emails_to'])))
+            if len(records) == 1:
+                notify_msg = ('{0} email sent to {1}.' .
+                              format(self.descr_str.capitalize(),
+                                     pps(cfg[self.name_str +
+                                             '_emails_to'])))
+            else:
+                notify_msg = ('{0} digest email ({1} messages) sent to '
+                              '{2}.' .
+                              format(self.descr_str.capitalize(),
+                                     len(records),
+                                     pps(cfg[self.name_str +
+                                             '_emails_to'])))
             self.notify_logger.info(notify_msg)
 
 
+class BatchedSysLogHandler(logging.Handler):
+
+    """
+    Send syslog messages over TCP in batches, reconnecting as necessary.
+
+    Records are formatted and framed (RFC 6587 octet counting) when they
+    are emitted, and put in a bounded backlog; a background thread sends
+    everything in the backlog (up to SYSLOG_BATCH_MAX messages) in a
+    single write over a persistent connection.  If the connection fails,
+    the thread reconnects with exponential backoff, and if the backlog
+    fills up in the meantime, the oldest messages are discarded.
+
+    """
+
+    def __init__(self, address, facility='user', backlog=10000):
+        """
+        Set up instance variables and start the sender thread.
+        Parameters:
+            address: a (host, port) tuple for the syslog relay
+            facility: the syslog facility, as a name or a number
+            backlog: the maximum number of messages to hold while they
+                     can't be sent
+        Dependencies:
+            instance methods: _send_loop()
+            modules: logging, logging.handlers, collections, threading
+        """
+        super(BatchedSysLogHandler, self).__init__()
+        sl_class = logging.handlers.SysLogHandler  # for readability
+        if not isinstance(facility, INTEGER_TYPES):
+            facility = sl_class.facility_names[facility]
+        self.address = address
+        self.facility = facility
+        self.sock = None
+        self.backlog = collections.deque(maxlen=backlog)
+        self.in_flight = []  # the batch currently being sent
+        self.dropped = 0
+        self.retry_delay = 0  # non-zero while the relay is unreachable
+        self.closing = False
+        self.cond = threading.Condition()
+        self.thread = threading.Thread(target=self._send_loop)
+        self.thread.daemon = True
+        self.thread.start()
+
+
+    def emit(self, record):
+        """
+        Format and frame a record, and add it to the backlog.
+        Dependencies:
+            instance vars: facility, backlog, dropped, cond
+            modules: logging.handlers
+        """
+        try:
+            sl_class = logging.handlers.SysLogHandler  # for readability
+            severity = sl_class.priority_names[
+                sl_class.priority_map.get(record.levelname, 'warning')
+            ]
+            msg = '<{0}>{1}'.format((self.facility << 3) | severity,
+                                    self.format(record))
+            if not isinstance(msg, bytes):
+                msg = msg.encode('utf-8')
+            # RFC 6587 octet counting: the length, a space, the message
+            frame = str(len(msg)).encode('ascii') + b' ' + msg
+            with self.cond:
+                if len(self.backlog) == self.backlog.maxlen:
+                    self.dropped += 1
+                self.backlog.append(frame)
+                self.cond.notify_all()
+        except Exception:
+            self.handleError(record)
+
+
+    def _connect(self):
+        """
+        Connect to the relay, and queue a note about any lost messages.
+        Dependencies:
+            instance vars: address, sock, facility, in_flight, dropped,
+                           cond
+            globals: SYSLOG_CONNECT_TIMEOUT
+            modules: socket
+        """
+        self.sock = socket.create_connection(self.address,
+                                             SYSLOG_CONNECT_TIMEOUT)
+        with self.cond:
+            if self.dropped:
+                msg = ('<{0}>{1} syslog messages were discarded while the '
+                       'relay was unreachable' .
+                       format((self.facility << 3) | 4, self.dropped))
+                msg = msg.encode('utf-8')
+                self.in_flight.insert(0, str(len(msg)).encode('ascii') +
+                                         b' ' + msg)
+                self.dropped = 0
+
+
+    def _disconnect(self):
+        """
+        Close the connection, ignoring errors.
+        Dependencies:
+            instance vars: sock
+            modules: socket
+        """
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except socket.error:
+                pass
+            self.sock = None
+
+
+    def _peer_closed(self):
+        """
+        Check if the relay has closed an idle connection.
+        Otherwise, the first write after a relay restart would appear to
+        succeed, and its messages would be lost.
+        Dependencies:
+            instance vars: sock
+            modules: select, socket
+        """
+        try:
+            if select.select([self.sock], [], [], 0)[0]:
+                return not self.sock.recv(4096)
+        except (select.error, socket.error):
+            return True
+        return False
+
+
+    def _send_loop(self):
+        """
+        Send batches from the backlog until the handler is closed.
+        Runs in the sender thread.
+        Dependencies:
+            instance vars: sock, backlog, in_flight, retry_delay, closing,
+                           cond
+            instance methods: _connect(), _disconnect(), _peer_closed()
+            globals: SYSLOG_BATCH_MAX, SYSLOG_BACKOFF_MAX
+            modules: socket, time
+        """
+        while True:
+            with self.cond:
+                while not self.in_flight and not self.backlog:
+                    if self.closing:
+                        return
+                    self.cond.wait()
+                if self.closing and self.retry_delay:
+                    # the relay is down, and we're not waiting around
+                    return
+                if not self.in_flight:
+                    while self.backlog and (len(self.in_flight) <
+                                            SYSLOG_BATCH_MAX):
+                        self.in_flight.append(self.backlog.popleft())
+            try:
+                if self.sock is not None and self._peer_closed():
+                    self._disconnect()
+                if self.sock is None:
+                    self._connect()
+                self.sock.sendall(b''.join(self.in_flight))
+            except socket.error:
+                self._disconnect()
+                with self.cond:
+                    self.retry_delay = (
+                        min(self.retry_delay * 2, SYSLOG_BACKOFF_MAX) or 1
+                    )
+                    # let flush() know not to wait
+                    self.cond.notify_all()
+                    # wake up early only for close()
+                    deadline = time.time() + self.retry_delay
+                    while not self.closing and time.time() < deadline:
+                        self.cond.wait(deadline - time.time())
+                continue
+            with self.cond:
+                self.retry_delay = 0
+                self.in_flight = []
+                self.cond.notify_all()
+
+
+    def flush(self):
+        """
+        Wait (briefly) for the backlog to be sent.
+        Doesn't wait if the relay is currently unreachable.
+        Dependencies:
+            instance vars: backlog, in_flight, retry_delay, thread, cond
+            globals: SYSLOG_CLOSE_TIMEOUT
+            modules: time
+        """
+        deadline = time.time() + SYSLOG_CLOSE_TIMEOUT
+        with self.cond:
+            while ((self.backlog or self.in_flight) and
+                     not self.retry_delay and self.thread.is_alive() and
+                     time.time() < deadline):
+                self.cond.wait(deadline - time.time())
+
+
+    def close(self):
+        """
+        Send what we can, then stop the sender thread and disconnect.
+        Dependencies:
+            instance vars: thread, closing, cond
+            instance methods: flush(), _disconnect()
+            globals: SYSLOG_CLOSE_TIMEOUT
+        """
+        self.flush()
+        with self.cond:
+            self.closing = True
+            self.cond.notify_all()
+        self.thread.join(SYSLOG_CLOSE_TIMEOUT)
+        self._disconnect()
+        super(BatchedSysLogHandler, self).close()
+
+
 def logging_init_syslog():
 
     """
@@ -3545,10 +5338,11 @@ def logging_init_syslog():
 
     Dependencies:
         config settings: syslog_addr, syslog_sock_type, syslog_fac,
-                         syslog_tag
+                         syslog_tag, syslog_batched, syslog_backlog
         globals: cfg
+        classes: BatchedSysLogHandler
         functions: fix_path()
-        modules: sys, logging, logging.handlers
+        modules: sys, logging, logging.handlers, socket
         Python: 2.7/3.2, for SysLogHandler(socktype)
 
     """
@@ -3557,7 +5351,14 @@ def logging_init_syslog():
     if '/' in addr:
         addr = fix_path(addr)
 
-    if sys.hexversion >= 0x03040000 and cfg['syslog_tag'] != '':
+    if (cfg['syslog_batched'] and isinstance(addr, tuple) and
+          cfg['syslog_sock_type'] == socket.SOCK_STREAM):
+        slh = BatchedSysLogHandler(addr, cfg['syslog_fac'],
+                                   cfg['syslog_backlog'])
+        syslog_formatter = logging.Formatter(cfg['syslog_tag'] +
+                                             '[%(process)d]: %(message)s')
+        slh.setFormatter(syslog_formatter)
+    elif sys.hexversion >= 0x03040000 and cfg['syslog_tag'] != '':
         slh = logging.handlers.SysLogHandler(
                   address=addr,
                   socktype=cfg['syslog_sock_type'],
@@ -3607,6 +5408,7 @@ def logging_init_email(name_str, descr_str, parent_str=__name__ + '.status',
         config settings: [where * = name_str]: send_*_email
         globals: cfg, email_logger, email_loggers, _null_handler
         classes: SMTPDiagHandler
+        functions: logging_async_wrap()
         modules: logging
 
     """
@@ -3624,7 +5426,9 @@ def logging_init_email(name_str, descr_str, parent_str=__name__ + '.status',
     email_loggers[name_str].propagate = propagate
 
     if cfg['send_' + name_str + '_emails']:
-        email_handler = SMTPDiagHandler(name_str, descr_str, notify_logger)
+        email_handler = logging_async_wrap(
+            SMTPDiagHandler(name_str, descr_str, notify_logger)
+        )
         email_loggers[name_str].addHandler(email_handler)
     else:
         # if we turn off propagation temporarily (see
@@ -3653,19 +5457,34 @@ def logging_init_main():
     Note: syslog may turn control characters into octal, including
     whitespace (e.g., newline -> #012).
 
+    If the async_logging setting is True, the handlers are wrapped so
+    that the actual I/O is done in a background thread; see
+    logging_start_async().
+
+    Recent messages (and command output) are also kept in memory for
+    alert emails; see the alert_context_lines setting.
+
     Dependencies:
-        config settings: debug, quiet, use_syslog, status_log
+        config settings: debug, quiet, use_syslog, status_log,
+                         async_logging, alert_context_lines
         globals: cfg, status_logger, alert_logger, _base_logger,
                  _null_handler, _syslog_handler,
                  _stdout_handler, _stderr_handler, FULL_DATE_FORMAT,
-                 exitvals['startup']
-        functions: fix_path(), pps(), logging_init_syslog(), err_exit()
-        modules: logging, sys
+                 exitvals['startup'], _recent_messages, _recent_output
+        classes: RingBufferHandler
+        functions: fix_path(), pps(), logging_init_syslog(), err_exit(),
+                   logging_start_async(), logging_async_wrap()
+        modules: logging, sys, collections
 
     """
 
     global status_logger, alert_logger, _base_logger
     global _null_handler, _syslog_handler, _stdout_handler, _stderr_handler
+    global _recent_messages, _recent_output
+
+    # start the logging thread before creating any handlers
+    if cfg['async_logging']:
+        logging_start_async()
 
     # common to status messages and alerts/errors
     _base_logger = logging.getLogger(__name__)
@@ -3698,153 +5517,492 @@ def logging_init_main():
         )
         # (syslog uses %e instead of %d, but it's less portable)
         status_log_handler.setFormatter(status_log_formatter)
-        _base_logger.addHandler(status_log_handler)
+        _base_logger.addHandler(logging_async_wrap(status_log_handler))
 
     # syslog
     if cfg['use_syslog']:
-        _syslog_handler = logging_init_syslog()
+        _syslog_handler = logging_async_wrap(logging_init_syslog())
         _base_logger.addHandler(_syslog_handler)
 
+    # recent messages and output for alert emails; this is cheap, so
+    # it's never done in the logging thread
+    if cfg['alert_context_lines']:
+        _recent_messages = collections.deque(
+            maxlen=cfg['alert_context_lines']
+        )
+        _recent_output = collections.deque(
+            maxlen=cfg['alert_context_lines']
+        )
+        recent_handler = RingBufferHandler(_recent_messages)
+        recent_handler.setFormatter(logging.Formatter(
+            '%(asctime)s [%(process)d]: %(message)s', FULL_DATE_FORMAT
+        ))
+        _base_logger.addHandler(recent_handler)
+
     # specific to status messages
     status_logger = logging.getLogger(__name__ + '.status')
     # stdout
     if not cfg['quiet']:
-        _stdout_handler = logging.StreamHandler(sys.stdout)
+        _stdout_handler = logging_async_wrap(
+            logging.StreamHandler(sys.stdout)
+        )
         status_logger.addHandler(_stdout_handler)
 
     # specific to alerts/errors; use when you don't want email
     alert_logger = logging.getLogger(__name__ + '.alert')
     # stderr
     if not cfg['quiet']:
-        _stderr_handler = logging.StreamHandler(sys.stderr)
+        _stderr_handler = logging_async_wrap(
+            logging.StreamHandler(sys.stderr)
+        )
         alert_logger.addHandler(_stderr_handler)
 
 
-def logging_init_logfile(name_str, parent_str=None, propagate=None):
+class AsyncHandler(logging.Handler):
 
-    """
-    Initialize logfile logging, including both logger and file objects.
+    """Hand records off to the logging thread; see logging_start_async()."""
 
-    The file_loggers[name_str] object logs to the logfile and stdout (if
-    the 'quiet' setting is False).  Whether the message is then handed
-    off to the parent logger depends on the 'propagate' parameter.  (But
-    see logging_start_logfile_prop() and logging_stop_logfile_prop().)
+    def __init__(self, target):
+        """
+        Set up instance variables here and in the superclass.
+        Parameters:
+            target: the handler that will actually emit the records
+        """
+        super(AsyncHandler, self).__init__(target.level)
+        self.target = target
 
-    Direct access to the logfile is available via the
-    logfile_objs[name_str] file object.
 
-    If name_str is 'output', aliases called output_logger and
-    output_log_fo are created (for the built-in output logging; see
-    run_with_logging()).
+    def emit(self, record):
+        """
+        Queue the record for the logging thread.
+        The message arguments are merged in first, so that they can't
+        change (or be formatted concurrently) after the call returns.
+        Dependencies:
+            globals: _log_queue
+            modules: copy
+        """
+        try:
+            r = copy.copy(record)
+            r.msg = r.getMessage()
+            r.args = None
+            _log_queue.put((self.target, r))
+        except Exception:
+            self.handleError(record)
 
-    If the name_str + '_log' setting is None, the objects are still
-    created.  The logger only prints to stdout (subject to the 'quiet'
-    setting) and propagates to the parent logger (subject to the
-    'propagate' argument).  The file object points to /dev/null or its
-    equivalent.
 
+def logging_async_wrap(handler):
+    """
+    Wrap a handler so that it's run by the logging thread, if active.
+    Returns the handler unchanged if the logging thread isn't running.
     Parameters:
-        name_str: a string to use in setting names, e.g. 'output'
-        parent_str: a string naming the parent logger object to use;
-                    if None, the value from the original
-                    create_logfile_settings() call is used
-        propagate: if True, messages are handed off to the parent logger
-                   if None, the value from the original
-                   create_logfile_settings() call is used
-
+        handler: the handler to wrap
     Dependencies:
-        config settings: [where * = name_str]: quiet, *_log,
-                         *_log_layout, *_log_sep, *_log_date,
-                         (*_log_num), (*_log_days)
-        globals: cfg, _logfile_info, file_loggers, logfile_objs,
-                 output_logger, output_log_fo, email_logger,
-                 _null_handler, _stdout_handler, start_time,
-                 _atexit_close_logfiles_registered, exitvals['startup']
-        functions: touch_file(), fix_path(), rotate_prune_logfiles(),
-                   pps(), logging_close_logfiles()
-        modules: logging, sys, os, time, atexit
+        globals: _log_queue
+        classes: AsyncHandler
+    """
+    if _log_queue is None:
+        return handler
+    return AsyncHandler(handler)
+
+
+def logging_start_async():
 
     """
+    Start the background logging thread.
 
-    global output_logger, output_log_fo, _atexit_close_logfiles_registered
+    This is the equivalent of a QueueHandler/QueueListener pair (which
+    aren't available before Python 3.2), except that each record is
+    passed to the specific handler that queued it, so the usual logger
+    hierarchy and handler routing are preserved.  Handlers are wrapped
+    with logging_async_wrap(); this is done automatically by the
+    logging_init_*() functions when the async_logging setting is True.
 
-    # assemble the complete path, including datestring if applicable
-    if cfg[name_str + '_log']:
-        logfile_path = cfg[name_str + '_log']
-        if cfg[name_str + '_log_layout'] == 'date':
-            logfile_path += (cfg[name_str + '_log_sep'] +
-                                time.strftime(cfg[name_str + '_log_date'],
-                                              time.localtime(start_time)))
-            # needed for prune_date_files(), for pruning by number
-            touch_file(logfile_path,
-                       'the {0} logfile' .
-                           format(_logfile_info[name_str]['descr_str']),
-                       None, use_logger=True, warn_only=False,
-                       exit_val=exitvals['startup']['num'])
+    The queue is flushed and the thread is stopped at exit; see also
+    logging_flush_async().
 
-    # handle parent_str/propagate defaults
-    if parent_str is not None:
-        real_parent_str = parent_str
-    else:
-        real_parent_str = _logfile_info[name_str]['parent_str']
-    if propagate is not None:
-        real_propagate = propagate
-    else:
-        real_propagate = _logfile_info[name_str]['propagate']
+    Dependencies:
+        globals: _log_queue, _log_thread, _atexit_stop_async_registered
+        functions: logging_stop_async()
+        modules: Queue / queue, threading, atexit
 
-    # rotate and prune logfiles
-    # (also tests in case there is no logfile, and prints status
-    # accordingly)
-    rotate_prune_logfiles(name_str)
+    """
 
-    # logger object
-    # (in the case of the built-in output logs, the actual output will
-    # be sent with the file object (below); this is for adding things
-    # like pre- and post-run status messages)
-    file_loggers[name_str] = logging.getLogger(
-        real_parent_str + '.logfile-' + name_str
-    )
-    file_loggers[name_str].propagate = real_propagate
-    if not cfg['quiet']:
-        file_loggers[name_str].addHandler(_stdout_handler)
-    if cfg[name_str + '_log']:
-        try:
-            # appending is always safe / the right thing to do, because
-            # either the file won't exist, or it will have been moved out of
-            # the way by the rotation - except in one case:
-            # if we're using a date layout, and the script has been run more
-            # recently than the datestring allows for, we should append so
-            # as not to lose information
-            logfile_handler = (
-                logging.FileHandler(fix_path(logfile_path), 'a')
-            )
-        except IOError as e:
-            email_logger.error('Error: could not open the {0} logfile '
-                               '({1}); exiting.\nDetails: [Errno {2}] {3}' .
-                               format(_logfile_info[name_str]['descr_str'],
-                                      pps(logfile_path), e.errno,
-                                      e.strerror))
-            sys.exit(exitvals['startup']['num'])
-        file_loggers[name_str].addHandler(logfile_handler)
-    # every logger must have at least one handler, so we have to account
-    # for the case in which everything is turned off
-    if cfg['quiet'] and not cfg[name_str + '_log']:
-        file_loggers[name_str].addHandler(_null_handler)
+    global _log_queue, _log_thread, _atexit_stop_async_registered
 
-    # log file object
-    # (in the case of the built-in output logs, used by (e.g.)
-    # run_with_logging())
-    try:
+    if _log_thread is not None:
+        return
+
+    def log_worker(log_q):
+        while True:
+            item = log_q.get()
+            try:
+                if item is None:
+                    return
+                item[0].handle(item[1])
+            except Exception:
+                item[0].handleError(item[1])
+            finally:
+                log_q.task_done()
+
+    _log_queue = queue.Queue()
+    _log_thread = threading.Thread(target=log_worker, args=(_log_queue, ))
+    _log_thread.daemon = True
+    _log_thread.start()
+
+    # this is registered early, so it will run after the other atexit
+    # functions, which may log things
+    if not _atexit_stop_async_registered:
+        atexit.register(logging_stop_async)
+        _atexit_stop_async_registered = True
+
+
+def logging_flush_async():
+    """
+    Wait until all queued log messages have been written out.
+    Does nothing if the logging thread isn't running (or if called from
+    the logging thread itself).
+    Dependencies:
+        globals: _log_queue, _log_thread
+        modules: threading
+    """
+    if (_log_thread is not None and
+          threading.current_thread() is not _log_thread):
+        _log_queue.join()
+
+
+def logging_stop_async():
+    """
+    Flush the log queue and stop the background logging thread.
+    Handlers that were already wrapped keep queueing, so this should
+    only be called at exit (which happens automatically).
+    Dependencies:
+        globals: _log_queue, _log_thread
+        functions: logging_flush_async()
+    """
+    global _log_thread
+    if _log_thread is None:
+        return
+    logging_flush_async()
+    _log_queue.put(None)
+    _log_thread.join()
+    _log_thread = None
+
+
+def _get_logfile_path(name_str, timestamp):
+    """
+    Get the complete path to a logfile, including any date string.
+    Returns None if the logfile is turned off.
+    Parameters:
+        name_str: a string to use in setting names, e.g. 'output'
+        timestamp: the time to use for the date string, if any
+    Dependencies:
+        config settings: [where * = name_str]: *_log, *_log_layout,
+                         *_log_sep, *_log_date, *_log_compress
+        globals: cfg, LOG_COMPRESS_SUFFIXES
+        modules: time
+    """
+    if not cfg[name_str + '_log']:
+        return None
+    logfile_path = cfg[name_str + '_log']
+    if cfg[name_str + '_log_layout'] == 'date':
+        logfile_path += (cfg[name_str + '_log_sep'] +
+                         time.strftime(cfg[name_str + '_log_date'],
+                                       time.localtime(timestamp)))
+    if cfg[name_str + '_log_compress']:
+        logfile_path += LOG_COMPRESS_SUFFIXES[cfg[name_str + '_log_compress']]
+    return logfile_path
+
+
+def log_compress_types():
+    """
+    Return a list of the logfile compression types that are available.
+    See the *_log_compress settings.
+    Dependencies:
+        modules: sys, (bz2), (lzma), (compression.zstd)
+    """
+    types_avail = ['gz']
+    # appending requires Python 3.3+
+    if 'bz2' in sys.modules and sys.hexversion >= 0x03030000:
+        types_avail.append('bz2')
+    if 'lzma' in sys.modules:
+        types_avail.append('xz')
+    if 'compression.zstd' in sys.modules:
+        types_avail.append('zst')
+    return types_avail
+
+
+class RotatingLogfile(object):
+
+    """
+    A logfile object that can be reopened without being replaced.
+
+    This is used for the logfile_objs[] file objects (which are also
+    what the file_loggers[] handlers write to), so that logfiles can be
+    rotated while the script is running (see logging_rotate_logfile()).
+    References to the object, such as output_log_fo or the target of a
+    background command's output thread, stay valid across rotations.
+    Processes that were handed the file descriptor itself keep writing
+    to the previous file, since they have their own copy of it.
+
+    Writes, flushes, and reopening are serialized with a lock.  Other
+    attributes are passed through to the current underlying file object.
+
+    The file can also be compressed as it's written (see the
+    *_log_compress settings).  In that case, text is encoded as UTF-8,
+    and every LOG_COMPRESS_SYNC_SECS seconds after data is written, the
+    compressed stream is ended and a new one is appended (see sync()),
+    so that a partial logfile can always be read.  Compressed files have
+    no usable file descriptor; fileno() raises io.UnsupportedOperation.
+
+    """
+
+    def __init__(self, path, compress=None):
+        """
+        Open the file, in append mode.
+        May raise an IOError exception.
+        Parameters:
+            path: the path to the file (already run through fix_path())
+            compress: None, or a value from log_compress_types()
+        Dependencies:
+            modules: threading
+        """
+        self._fo = None
+        self._lock = threading.RLock()
+        self._sync_timer = None
+        self.compress = compress
+        self.reopen(path)
+
+
+    def _open(self, path):
+        """
+        Open and return the underlying file object.
+        May raise an IOError exception.
+        Dependencies:
+            modules: gzip, (bz2), (lzma), (compression.zstd)
+        """
+        if self.compress is None:
+            return open(path, 'a')
+        elif self.compress == 'gz':
+            return gzip.open(path, 'ab')
+        elif self.compress == 'bz2':
+            return bz2.open(path, 'ab')
+        elif self.compress == 'xz':
+            return lzma.open(path, 'ab')
+        else:  # 'zst'
+            return zstd.open(path, 'ab')
+
+
+    def reopen(self, path, before_open=None):
+        """
+        Close the current file, if any, and open a new one in its place.
+        May raise an IOError exception, in which case the object is left
+        closed.
+        Parameters:
+            path: the path to the new file (already run through
+                  fix_path())
+            before_open: if not None, a function to call after the old
+                         file has been closed and before the new one is
+                         opened (e.g., to rotate the files)
+        Dependencies:
+            modules: time
+        """
+        with self._lock:
+            if self._fo is not None:
+                try:
+                    self._fo.close()
+                except IOError:
+                    pass
+            if before_open is not None:
+                before_open()
+            self._fo = self._open(path)
+            self.path = path
+            self.opened = time.time()
+
+
+    def write(self, data):
+        """
+        Write to the current file.
+        Dependencies:
+            instance methods: sync()
+            globals: LOG_COMPRESS_SYNC_SECS
+            modules: threading
+        """
+        with self._lock:
+            if self.compress is None:
+                return self._fo.write(data)
+            if not isinstance(data, bytes):
+                data = data.encode('utf-8')
+            if self._sync_timer is None:
+                self._sync_timer = threading.Timer(LOG_COMPRESS_SYNC_SECS,
+                                                   self.sync)
+                self._sync_timer.daemon = True
+                self._sync_timer.start()
+            return self._fo.write(data)
+
+
+    def flush(self):
+        """
+        Flush the current file.
+        For compressed files, data is only pushed out by sync(), which
+        is called on a timer; flushing the compressor for every line
+        would ruin the compression ratio.
+        """
+        with self._lock:
+            if self.compress is None:
+                return self._fo.flush()
+
+
+    def sync(self):
+        """
+        End the current compressed stream and start a new one.
+        After this, everything written so far can be decompressed.
+        Errors are ignored here; they'll show up on the next write.
+        """
+        with self._lock:
+            self._sync_timer = None
+            if self._fo is None or self._fo.closed:
+                return
+            try:
+                self._fo.close()
+                self._fo = self._open(self.path)
+            except (IOError, OSError):
+                pass
+
+
+    def fileno(self):
+        """
+        Return the file descriptor of the current file.
+        Dependencies:
+            modules: io
+        """
+        if self.compress is not None:
+            raise io.UnsupportedOperation(
+                'compressed logfiles have no usable file descriptor'
+            )
+        return self._fo.fileno()
+
+
+    def close(self):
+        """Close the current file."""
+        with self._lock:
+            if self._sync_timer is not None:
+                self._sync_timer.cancel()
+                self._sync_timer = None
+            return self._fo.close()
+
+
+    @property
+    def closed(self):
+        """Is the current file closed?"""
+        return self._fo.closed
+
+
+    @property
+    def name(self):
+        """The name of the current file."""
+        if self.compress is not None:
+            return self.path  # not all compressed file objects have it
+        return self._fo.name
+
+
+    def __getattr__(self, attr):
+        """Pass other attributes through to the current file."""
+        return getattr(self._fo, attr)
+
+
+def logging_init_logfile(name_str, parent_str=None, propagate=None):
+
+    """
+    Initialize logfile logging, including both logger and file objects.
+
+    The file_loggers[name_str] object logs to the logfile and stdout (if
+    the 'quiet' setting is False).  Whether the message is then handed
+    off to the parent logger depends on the 'propagate' parameter.  (But
+    see logging_start_logfile_prop() and logging_stop_logfile_prop().)
+
+    Direct access to the logfile is available via the
+    logfile_objs[name_str] file object, which is a RotatingLogfile (so
+    that the logfile can be rotated while the script is running; see
+    logging_rotate_logfile()).  The logger object writes to the logfile
+    through the same object.
+
+    If name_str is 'output', aliases called output_logger and
+    output_log_fo are created (for the built-in output logging; see
+    run_with_logging()).
+
+    If the name_str + '_log' setting is None, the objects are still
+    created.  The logger only prints to stdout (subject to the 'quiet'
+    setting) and propagates to the parent logger (subject to the
+    'propagate' argument).  The file object points to /dev/null or its
+    equivalent.
+
+    Parameters:
+        name_str: a string to use in setting names, e.g. 'output'
+        parent_str: a string naming the parent logger object to use;
+                    if None, the value from the original
+                    create_logfile_settings() call is used
+        propagate: if True, messages are handed off to the parent logger
+                   if None, the value from the original
+                   create_logfile_settings() call is used
+
+    Dependencies:
+        config settings: [where * = name_str]: quiet, *_log,
+                         *_log_layout, *_log_sep, *_log_date,
+                         (*_log_num), (*_log_days), *_log_compress
+        globals: cfg, _logfile_info, file_loggers, logfile_objs,
+                 output_logger, output_log_fo, email_logger,
+                 _null_handler, _stdout_handler, start_time,
+                 _atexit_close_logfiles_registered, exitvals['startup']
+        classes: RotatingLogfile
+        functions: _get_logfile_path(), touch_file(), fix_path(),
+                   rotate_prune_logfiles(), pps(),
+                   logging_close_logfiles(), logging_async_wrap()
+        modules: logging, sys, os, atexit
+
+    """
+
+    global output_logger, output_log_fo, _atexit_close_logfiles_registered
+
+    # assemble the complete path, including datestring if applicable
+    logfile_path = _get_logfile_path(name_str, start_time)
+    if cfg[name_str + '_log'] and cfg[name_str + '_log_layout'] == 'date':
+        # needed for prune_date_files(), for pruning by number
+        touch_file(logfile_path,
+                   'the {0} logfile' .
+                       format(_logfile_info[name_str]['descr_str']),
+                   None, use_logger=True, warn_only=False,
+                   exit_val=exitvals['startup']['num'])
+
+    # handle parent_str/propagate defaults
+    if parent_str is not None:
+        real_parent_str = parent_str
+    else:
+        real_parent_str = _logfile_info[name_str]['parent_str']
+    if propagate is not None:
+        real_propagate = propagate
+    else:
+        real_propagate = _logfile_info[name_str]['propagate']
+
+    # rotate and prune logfiles
+    # (also tests in case there is no logfile, and prints status
+    # accordingly)
+    rotate_prune_logfiles(name_str)
+
+    # log file object
+    # (in the case of the built-in output logs, used by (e.g.)
+    # run_with_logging())
+    try:
         # appending is always safe / the right thing to do, because
         # either the file won't exist, or it will have been moved out of
         # the way by the rotation - except in one case:
         # if we're using a date layout, and the script has been run more
         # recently than the datestring allows for, we should append so
         # as not to lose information
-        logfile_objs[name_str] = open(
+        logfile_objs[name_str] = RotatingLogfile(
             fix_path(logfile_path) if cfg[name_str + '_log']
                                    else os.devnull,
-            'a'
+            cfg[name_str + '_log_compress'] if cfg[name_str + '_log']
+                                            else None
         )
     except IOError as e:
         email_logger.error('Error: could not open the {0} logfile ({1}); '
@@ -3856,6 +6014,28 @@ def logging_init_logfile(name_str, parent_str=None, propagate=None):
                                   e.errno, e.strerror))
         sys.exit(exitvals['startup']['num'])
 
+    # logger object
+    # (in the case of the built-in output logs, the actual output will
+    # be sent with the file object (above); this is for adding things
+    # like pre- and post-run status messages)
+    file_loggers[name_str] = logging.getLogger(
+        real_parent_str + '.logfile-' + name_str
+    )
+    file_loggers[name_str].propagate = real_propagate
+    if not cfg['quiet']:
+        file_loggers[name_str].addHandler(_stdout_handler)
+    if cfg[name_str + '_log']:
+        _logfile_info[name_str]['handler'] = logging_async_wrap(
+            logging.StreamHandler(logfile_objs[name_str])
+        )
+        file_loggers[name_str].addHandler(
+            _logfile_info[name_str]['handler']
+        )
+    # every logger must have at least one handler, so we have to account
+    # for the case in which everything is turned off
+    if cfg['quiet'] and not cfg[name_str + '_log']:
+        file_loggers[name_str].addHandler(_null_handler)
+
     # automatically close on exit
     # (should be done anyway, but we'll be thorough)
     if not _atexit_close_logfiles_registered:
@@ -3868,16 +6048,117 @@ def logging_init_logfile(name_str, parent_str=None, propagate=None):
         output_log_fo = logfile_objs[name_str]
 
 
+def logging_rotate_logfile(name_str, force=False,
+                           exit_val=exitvals['startup']['num']):
+
+    """
+    Rotate a logfile while the script is running, if it's due.
+
+    The logfile is due if it has reached the size in the
+    *_log_rotate_bytes setting, or has been open for the time in the
+    *_log_rotate_mins setting.  The files are rotated and pruned as
+    they are at startup, and the logfile object is reopened in place
+    (see RotatingLogfile), so existing references to it stay valid.
+
+    Returns True if the logfile was rotated, False otherwise.
+
+    Parameters:
+        name_str: a string to use in setting names, e.g. 'output'
+        force: if true, rotate even if the logfile isn't due (but see
+               the note on the 'date' layout under *_log_rotate_bytes)
+        exit_val: the value to exit the script with on error
+
+    Dependencies:
+        config settings: [where * = name_str]: *_log, *_log_layout,
+                         *_log_rotate_bytes, *_log_rotate_mins
+        globals: cfg, logfile_objs, _logfile_info, email_logger,
+                 exitvals['startup']
+        functions: _get_logfile_path(), touch_file(), fix_path(),
+                   rotate_prune_logfiles(), pps()
+        modules: os, time, sys
+
+    """
+
+    if (not cfg[name_str + '_log'] or
+          cfg[name_str + '_log_layout'] == 'append' or
+          name_str not in logfile_objs):
+        return False
+    logfile_fo = logfile_objs[name_str]
+
+    # due?
+    due = force
+    if not due and cfg[name_str + '_log_rotate_bytes']:
+        try:
+            due = (os.path.getsize(logfile_fo.path) >=
+                   cfg[name_str + '_log_rotate_bytes'])
+        except OSError:
+            pass  # the rotation will report any real problems
+    if not due and cfg[name_str + '_log_rotate_mins']:
+        due = ((time.time() - logfile_fo.opened) >=
+               (cfg[name_str + '_log_rotate_mins'] * 60))
+    if not due:
+        return False
+
+    # the date layout can only rotate to a new date string
+    logfile_path = _get_logfile_path(name_str, time.time())
+    if cfg[name_str + '_log_layout'] == 'date':
+        if fix_path(logfile_path) == logfile_fo.path:
+            logfile_fo.opened = time.time()
+            return False
+        # needed for prune_date_files(), for pruning by number
+        touch_file(logfile_path,
+                   'the {0} logfile' .
+                       format(_logfile_info[name_str]['descr_str']),
+                   None, use_logger=True, warn_only=False,
+                   exit_val=exit_val)
+
+    # rotate, prune, and reopen
+    try:
+        logfile_fo.reopen(fix_path(logfile_path),
+                          lambda: rotate_prune_logfiles(name_str, exit_val))
+    except IOError as e:
+        email_logger.error('Error: could not open the {0} logfile ({1}); '
+                           'exiting.\nDetails: [Errno {2}] {3}' .
+                           format(_logfile_info[name_str]['descr_str'],
+                                  pps(logfile_path), e.errno, e.strerror))
+        sys.exit(exit_val)
+    return True
+
+
+def logging_rotate_logfiles(force=False,
+                            exit_val=exitvals['startup']['num']):
+    """
+    Rotate all logfiles that are due while the script is running.
+    Called by run_with_logging() before each command; long-running
+    scripts can also call it periodically.
+    Parameters:
+        see logging_rotate_logfile()
+    Dependencies:
+        globals: logfile_objs, exitvals['startup']
+        functions: logging_rotate_logfile()
+    """
+    # list() call is for Python 3
+    for name_str in list(logfile_objs.keys()):
+        logging_rotate_logfile(name_str, force, exit_val)
+
+
 def logging_close_logfile(name_str):
     """
     Close a logfile's file object.
-    Does not affect the logger object.
+    The logger object stops writing to the logfile, but is otherwise
+    unaffected.
     Parameters:
         name_str: a string to use in setting names, e.g. 'output'
     Dependencies:
-        globals: logfile_objs, _logfile_infg, email_logger
-        functions: pps()
+        globals: logfile_objs, file_loggers, _logfile_info, email_logger
+        functions: logging_flush_async(), pps()
     """
+    logging_flush_async()
+    if 'handler' in _logfile_info[name_str]:
+        file_loggers[name_str].removeHandler(
+            _logfile_info[name_str]['handler']
+        )
+        del(_logfile_info[name_str]['handler'])
     try:
         logfile_objs[name_str].close()
     except IOError as e:
@@ -4036,15 +6317,122 @@ def render_generic_exception(e):
     return 'Details: {0}'.format(e)
 
 
+def _log_warning(warn_msg, use_logger):
+    """
+    Log or print a warning message.
+    Parameters:
+        see generic_error_handler()
+    Dependencies:
+        globals: email_logger
+        modules: sys
+        Python: 2.0/3.2, for callable()
+    """
+    if use_logger is None:
+        pass  # no messages
+    elif callable(use_logger):
+        use_logger(warn_msg, True)
+    elif use_logger:
+        email_logger.warn(warn_msg)
+    else:
+        print('\n{0}\n'.format(warn_msg), file=sys.stderr)
+
+
+def _check_repeat_warning(key, msg, use_logger):
+    """
+    Count a warning, and check if it should be logged.
+    If it's time for a summary of suppressed repeats, logs that first.
+    Parameters:
+        key: identifies the kind of warning; see generic_error_handler()
+        msg: the central part of the warning message
+        see generic_error_handler() for the rest
+    Dependencies:
+        config settings: repeat_warning_limit, repeat_warning_interval
+        globals: cfg, _repeat_warnings, _repeat_warnings_lock,
+                 _atexit_summarize_repeat_warnings_registered
+        functions: summarize_repeat_warnings(), _log_warning()
+        modules: atexit, time
+    """
+    global _atexit_summarize_repeat_warnings_registered
+
+    # settings aren't available if we're still loading the config
+    limit = cfg.get('repeat_warning_limit', 0)
+    if not limit:
+        return True
+
+    now = time.time()
+    summary = None
+    with _repeat_warnings_lock:
+        if key not in _repeat_warnings:
+            _repeat_warnings[key] = dict(count=0, suppressed=0, since=now)
+        entry = _repeat_warnings[key]
+        entry['use_logger'] = use_logger
+        entry['msg'] = msg  # the most recent one
+        entry['count'] += 1
+        if entry['count'] <= limit:
+            return True
+        if entry['count'] == limit + 1:
+            entry['since'] = now
+            if not _atexit_summarize_repeat_warnings_registered:
+                atexit.register(summarize_repeat_warnings)
+                _atexit_summarize_repeat_warnings_registered = True
+        entry['suppressed'] += 1
+        if now - entry['since'] >= cfg['repeat_warning_interval']:
+            summary = _render_repeat_summary(entry, now)
+    if summary:
+        _log_warning(summary, use_logger)
+    return False
+
+
+def _render_repeat_summary(entry, now):
+    """
+    Return a summary of suppressed warnings, and reset the count.
+    Must be called with _repeat_warnings_lock held.
+    Parameters:
+        entry: a value in _repeat_warnings
+        now: the current time
+    """
+    summary = ('Warning: suppressed {0} similar warning(s) in the last '
+               '{1:.0f} seconds; the most recent was: {2}.' .
+               format(entry['suppressed'], now - entry['since'],
+                      entry['msg']))
+    entry['suppressed'] = 0
+    entry['since'] = now
+    return summary
+
+
+def summarize_repeat_warnings():
+    """
+    Log summaries of all warnings that have been suppressed as repeats.
+    Registered to run at exit.
+    Dependencies:
+        globals: _repeat_warnings, _repeat_warnings_lock
+        functions: _render_repeat_summary(), _log_warning()
+        modules: time
+    """
+    summaries = []
+    now = time.time()
+    with _repeat_warnings_lock:
+        for entry in _repeat_warnings.values():
+            if entry['suppressed']:
+                summaries.append((_render_repeat_summary(entry, now),
+                                  entry['use_logger']))
+    for summary, use_logger in summaries:
+        _log_warning(summary, use_logger)
+
+
 def generic_error_handler(e, msg, renderer=render_generic_exception,
                           use_logger=False, warn_only=False,
-                          exit_val=exitvals['startup']['num']):
+                          exit_val=exitvals['startup']['num'],
+                          repeat_key=None):
 
     """
     Handle exceptions with various options.
 
     If it returns, returns False.
 
+    Repeated warnings are rate-limited; see the repeat_warning_limit and
+    repeat_warning_interval settings.
+
     Parameters:
         e: the exception object; can also be None, to just work with msg
         msg: the central part of the warning/error message
@@ -4060,196 +6448,1860 @@ def generic_error_handler(e, msg, renderer=render_generic_exception,
                    prevents exiting the script)
         exit_val: the value to exit the script with; if this is None,
                   the function doesn't actually exit the script
+        repeat_key: a hashable value identifying the kind of warning,
+                    for rate limiting; it should leave out the parts of
+                    the message that vary (e.g., file paths); if None,
+                    msg is used
 
     Dependencies:
         globals: email_logger, exitvals['startup']
-        functions: render_generic_exception(), err_exit()
+        functions: render_generic_exception(), err_exit(),
+                   _check_repeat_warning(), _log_warning()
         modules: sys
         Python: 2.0/3.2, for callable()
 
     """
 
+    if warn_only:
+        if repeat_key is None:
+            repeat_key = msg
+        if (use_logger is not None and
+              not _check_repeat_warning(repeat_key, msg, use_logger)):
+            return False
+        warn_msg = 'Warning: {0}.'.format(msg)
+        if e is not None:
+            details = renderer(e)
+            if details:
+                warn_msg += '\n' + details
+        _log_warning(warn_msg, use_logger)
+        return False
+
     details = ''
     if e is not None:
         details = renderer(e)
 
-    if warn_only:
-        warn_msg = 'Warning: {0}.'.format(msg)
-        if details:
-            warn_msg += '\n' + details
-        if use_logger is None:
-            pass  # no messages
-        elif callable(use_logger):
-            use_logger(warn_msg, warn_only)
-        elif use_logger:
-            email_logger.warn(warn_msg)
-        else:
-            print('\n{0}\n'.format(warn_msg), file=sys.stderr)
+    err_msg = 'Error: {0}; exiting.'.format(msg)
+    if details:
+        err_msg += '\n' + details
+    if use_logger is None:
+        pass  # no messages
+    elif callable(use_logger):
+        use_logger(err_msg, warn_only)
+    elif use_logger:
+        email_logger.error(err_msg)
     else:
-        err_msg = 'Error: {0}; exiting.'.format(msg)
-        if details:
-            err_msg += '\n' + details
-        if use_logger is None:
-            pass  # no messages
-        elif callable(use_logger):
-            use_logger(err_msg, warn_only)
-        elif use_logger:
-            email_logger.error(err_msg)
-        else:
-            err_exit(err_msg, exit_val)
-        if exit_val is not None:
-            sys.exit(exit_val)
+        err_exit(err_msg, exit_val)
+    if exit_val is not None:
+        sys.exit(exit_val)
 
     return False
 
 
-############################
-# running external commands
-############################
-
-def render_command_exception(e):
+def _log_entry_time(m, cache):
     """
-    Return a formatted string for an external-command-related exception.
+    Return the timestamp of a status log entry or output log line.
     Parameters:
-        e: the exception to render
+        m: a match object from _LOG_HEADER_RE or _LOG_MARKER_RE
+        cache: a dict for caching the parsed hours, so that strptime()
+               only has to be called once per hour of log entries
+    Dependencies:
+        modules: time
     """
-    if isinstance(e, OSError):
-        return 'Details: [Errno {0}] {1}'.format(e.errno, e.strerror)
+    date_str = m.group(1).decode('ascii')
+    year_str = m.group(2).decode('ascii')
+    hour_key = (date_str[:13], year_str)
+    if hour_key not in cache:
+        cache[hour_key] = time.mktime(time.strptime(
+            date_str[:13] + ' ' + year_str, '%a %b %d %H %Y'
+        ))
+    return (cache[hour_key] + int(date_str[14:16]) * 60 +
+            int(date_str[17:19]))
+
+
+def _log_generations(prefix):
+    """
+    Return the paths to all generations of a logfile, oldest first.
+    This includes the current file, rotated files (by number or date),
+    and compressed files; i.e., everything in the same directory whose
+    name starts with the basename of the prefix, other than sidecar
+    files.
+    Parameters:
+        prefix: the logfile path, as in the *_log settings
+    Dependencies:
+        globals: LOG_INDEX_SUFFIX, USAGE_INDEX_SUFFIX
+        functions: fix_path()
+        modules: os, stat
+    """
+    dir_path, base = os.path.split(prefix)
+    try:
+        names = os.listdir(fix_path(dir_path or '.'))
+    except OSError:
+        return []
+    found = []
+    for f in names:
+        if (not f.startswith(base) or
+              f.endswith((LOG_INDEX_SUFFIX, USAGE_INDEX_SUFFIX,
+                          LOG_INDEX_SUFFIX + '.new'))):
+            continue
+        f_path = os.path.join(dir_path, f)
+        try:
+            st = os.stat(fix_path(f_path))
+        except OSError:
+            continue
+        if stat.S_ISREG(st.st_mode):
+            found.append((st.st_mtime, f_path))
+    return [f_path for mtime, f_path in sorted(found)]
+
+
+def _open_compressed_log(path):
+    """
+    Open a compressed logfile for reading, in binary mode.
+    Returns None if the compression type isn't available.
+    May raise IOError/OSError exceptions.
+    Dependencies:
+        functions: fix_path()
+        modules: gzip, sys, (bz2), (lzma), (compression.zstd)
+    """
+    if path.endswith('.gz'):
+        return gzip.open(fix_path(path), 'rb')
+    if path.endswith('.bz2') and 'bz2' in sys.modules:
+        return bz2.BZ2File(fix_path(path), 'rb')
+    if path.endswith('.xz') and 'lzma' in sys.modules:
+        return lzma.open(fix_path(path), 'rb')
+    if path.endswith('.zst') and 'compression.zstd' in sys.modules:
+        return zstd.open(fix_path(path), 'rb')
+    return None
+
+
+def _index_log_buf(buf, entry, kind, time_cache):
+
+    """
+    Add the complete lines after the last indexed offset to an index.
+
+    Parameters:
+        buf: the file contents (an mmap object)
+        entry: the file's entry in the sidecar index; a dict with
+               'scanned' (the offset indexing has reached), 'hours' (a
+               list of [hour timestamp, offset of the first entry in
+               that hour]), 'first', and 'last' (timestamps)
+        kind: 'status' or 'output'; see query_logs()
+        time_cache: see _log_entry_time()
+
+    Dependencies:
+        globals: _LOG_HEADER_RE, _LOG_MARKER_RE
+        functions: _log_entry_time()
+
+    """
+
+    limit = buf.rfind(b'\n', entry['scanned']) + 1
+    if limit <= entry['scanned']:
+        return
+    ts_re = _LOG_HEADER_RE if kind == 'status' else _LOG_MARKER_RE
+    hours = entry['hours']
+    last_key = None
+    m = None
+    for m in ts_re.finditer(buf, entry['scanned'], limit):
+        # only look closely at the first entry with each date/hour
+        key = m.group(1)[:13] + m.group(2)
+        if key == last_key:
+            continue
+        last_key = key
+        t = _log_entry_time(m, time_cache)
+        if entry['first'] is None:
+            entry['first'] = t
+        if entry['last'] is None or t > entry['last']:
+            entry['last'] = t
+        hour = int(t // 3600) * 3600
+        if not hours or hour > hours[-1][0]:
+            if kind == 'status':
+                hours.append([hour, m.start()])
+            else:
+                hours.append([hour, buf.rfind(b'\n', 0, m.start()) + 1])
+    if m is not None:
+        t = _log_entry_time(m, time_cache)
+        if entry['last'] is None or t > entry['last']:
+            entry['last'] = t
+    entry['scanned'] = limit
+
+
+def _scan_log_buf(buf, start, end, kind, query, state, emit, final=True):
+
+    """
+    Find the entries in part of a logfile that match a query.
+
+    Status log entries start with a timestamp and PID, and can continue
+    over several lines.  Output log lines have no timestamps of their
+    own; each one is given the time of the last start/finish line (see
+    run_mode() and run_with_logging()) before it, and a run of lines
+    is included if the time between its start/finish lines overlaps the
+    query's time range.  A finish line stays with the run it ends,
+    even if another run starts right after it.  (The last run in a file is taken to end at
+    the file's mtime.)
+
+    When there is a pattern, the scan jumps from match to match rather
+    than looking at every entry.
+
+    Returns the offset at which the next call should start (see the
+    'final' parameter).
+
+    Parameters:
+        buf: the file contents, or part of them (bytes or an mmap
+             object)
+        start: the offset of the first entry to look at
+        end: the offset after the last entry to look at
+        kind: 'status' or 'output'; see query_logs()
+        query: a dict with 'since', 'until', 'pid', and 'pattern'
+               (a compiled bytes regex); any can be None
+        state: a dict carried between successive calls on the same
+               file; contains 'time' (the time of the last output log
+               start/finish line), 'end_time' (the time of the end of
+               the file, i.e., its mtime), and 'cache' (see
+               _log_entry_time())
+        emit: a function to call with each matching entry (bytes) and
+              its timestamp
+        final: if False, and this is an output log, the last run of
+               lines is left for the next call (which should start
+               with it), since its finishing time isn't known yet
+
+    Dependencies:
+        globals: _LOG_HEADER_RE, _LOG_MARKER_RE
+        functions: _log_entry_time()
+
+    """
+
+    since, until = query['since'], query['until']
+    pattern = query['pattern']
+
+    def in_range(t0, t1):
+        return ((since is None or t1 is None or t1 > since or
+                   (t0 is not None and t0 >= since)) and
+                (until is None or t0 is None or t0 <= until))
+
+    def line_end(pos):
+        nl = buf.find(b'\n', pos, end)
+        return end if nl == -1 else nl + 1
+
+    if kind == 'status':
+        def check(m, e_end):
+            if query['pid'] is not None and int(m.group(3)) != query['pid']:
+                return
+            t = _log_entry_time(m, state['cache'])
+            if in_range(t, t):
+                emit(buf[m.start():e_end], t)
+
+        if pattern is None and query['pid'] is not None:
+            # skip straight to the process's entries
+            pid_tag = ' [{0}]: '.format(query['pid']).encode('ascii')
+            pos = buf.find(pid_tag, start, end)
+            while pos != -1:
+                m = _LOG_HEADER_RE.match(
+                    buf, max(start, buf.rfind(b'\n', start, pos) + 1)
+                )
+                e_end = pos + len(pid_tag)
+                if m is not None and m.end() == e_end:
+                    next_m = _LOG_HEADER_RE.search(buf, e_end, end)
+                    e_end = next_m.start() if next_m is not None else end
+                    check(m, e_end)
+                pos = buf.find(pid_tag, e_end, end)
+            return end
+        if pattern is None:
+            m = _LOG_HEADER_RE.search(buf, start, end)
+            while m is not None:
+                next_m = _LOG_HEADER_RE.search(buf, m.end(), end)
+                check(m, next_m.start() if next_m is not None else end)
+                m = next_m
+            return end
+        pos = start
+        while pos < end:
+            pm = pattern.search(buf, pos, end)
+            if pm is None:
+                break
+            # back up to the start of the entry
+            e_start = max(start, buf.rfind(b'\n', start, pm.start()) + 1)
+            m = _LOG_HEADER_RE.match(buf, e_start)
+            while m is None and e_start > start:
+                e_start = max(start,
+                              buf.rfind(b'\n', start, e_start - 1) + 1)
+                m = _LOG_HEADER_RE.match(buf, e_start)
+            next_m = _LOG_HEADER_RE.search(
+                buf, line_end(max(pm.start(), pm.end() - 1)), end
+            )
+            e_end = next_m.start() if next_m is not None else end
+            if m is not None:
+                check(m, e_end)
+            pos = e_end
+        return end
+
+    # output log; split into runs of lines between start/finish lines
+    # (a finish line ends the run it belongs to; any other marker starts
+    # a new one)
+    runs = []
+    run_start = start
+    for m in _LOG_MARKER_RE.finditer(buf, start, end):
+        m_start = max(start, buf.rfind(b'\n', start, m.start()) + 1)
+        t = _log_entry_time(m, state['cache'])
+        if buf[max(m_start, m.start() - 8):m.start()] == b'finished':
+            m_start = line_end(m.end())
+        runs.append((run_start, m_start, state['time'], t))
+        run_start = m_start
+        state['time'] = t
+    if final or run_start == start:
+        runs.append((run_start, end, state['time'], state['end_time']))
+        run_start = end
+    for r_start, r_end, t0, t1 in runs:
+        if r_start == r_end or not in_range(t0 if t0 is not None else t1,
+                                            t1):
+            continue
+        if pattern is None:
+            emit(buf[r_start:r_end], t0)
+            continue
+        pos = r_start
+        while pos < r_end:
+            pm = pattern.search(buf, pos, r_end)
+            if pm is None:
+                break
+            l_start = max(r_start, buf.rfind(b'\n', r_start, pm.start()) + 1)
+            pos = line_end(max(pm.start(), pm.end() - 1))
+            emit(buf[l_start:pos], t0)
+    return run_start
+
+
+def _scan_logfile(path, kind, query, index, emit):
+
+    """
+    Find the entries in one generation of a logfile that match a query.
+
+    Uncompressed files are memory-mapped, and the hourly offsets in the
+    sidecar index (see query_logs()) are used to skip straight to the
+    part of the file that covers the query's time range; the index is
+    brought up to date first.  Compressed files have to be
+    decompressed from the beginning, in chunks, but once one has been
+    read all the way through, its time range is saved in the index so
+    that it can be skipped by later queries that don't overlap.
+
+    Parameters:
+        path: the path to the file
+        kind: 'status' or 'output'; see query_logs()
+        query: see _scan_log_buf()
+        index: a tuple of (the old sidecar index, the new one); the
+               file's entry is looked up by inode in the old index, and
+               stored in the new one
+        emit: see _scan_log_buf()
+
+    Dependencies:
+        globals: ZIP_SUFFIXES, LOG_SCAN_CHUNK, _LOG_HEADER_RE,
+                 _LOG_MARKER_RE
+        functions: fix_path(), _open_compressed_log(), _index_log_buf(),
+                   _scan_log_buf()
+        modules: os, copy, mmap, bisect
+
+    """
+
+    old_index, new_index = index
+    since, until = query['since'], query['until']
+    try:
+        st = os.stat(fix_path(path))
+    except OSError:
+        return
+    state = dict(time=None, end_time=st.st_mtime, cache={})
+    key = str(st.st_ino)
+    cached = old_index.get(key)
+    if not isinstance(cached, dict):
+        cached = None
+
+    if path.endswith(tuple(ZIP_SUFFIXES)):
+        if (cached is not None and cached.get('size') == st.st_size and
+              cached.get('mtime') == st.st_mtime):
+            new_index[key] = cached
+            if cached.get('first') is not None and (
+                    (since is not None and since > (
+                        cached['last'] if kind == 'status' else st.st_mtime
+                    )) or (until is not None and cached['first'] > until)):
+                return
+        entry = dict(size=st.st_size, mtime=st.st_mtime, first=None,
+                     last=None)
+        ts_re = _LOG_HEADER_RE if kind == 'status' else _LOG_MARKER_RE
+
+        def track(buf, start, end):
+            for m in ts_re.finditer(buf, start, end):
+                t = _log_entry_time(m, state['cache'])
+                if entry['first'] is None:
+                    entry['first'] = t
+                if entry['last'] is None or t > entry['last']:
+                    entry['last'] = t
+
+        try:
+            fo = _open_compressed_log(path)
+            if fo is None:
+                return  # e.g., lzip, or a missing module
+            with fo:
+                carry = b''
+                while True:
+                    data = fo.read(LOG_SCAN_CHUNK)
+                    buf = carry + data
+                    if not data:
+                        cut = len(buf)
+                    else:
+                        # only scan complete entries/lines
+                        cut = buf.rfind(b'\n') + 1
+                        if kind == 'status':
+                            while (cut > 0 and
+                                   not _LOG_HEADER_RE.match(buf, cut)):
+                                cut = buf.rfind(b'\n', 0, cut - 1) + 1
+                    if cached is None:
+                        track(buf, 0, cut)
+                    cut = _scan_log_buf(buf, 0, cut, kind, query, state,
+                                        emit, final=not data)
+                    carry = buf[cut:]
+                    if not data:
+                        break
+        except (IOError, OSError, EOFError, ValueError):
+            return  # damaged or partially-written file
+        if cached is None:
+            new_index[key] = entry
+        return
+
+    # uncompressed; bring the index up to date, then look up the range
+    if st.st_size == 0:
+        return
+    try:
+        with open(fix_path(path), 'rb') as fo:
+            buf = mmap.mmap(fo.fileno(), 0, access=mmap.ACCESS_READ)
+    except (IOError, OSError, ValueError):
+        return
+    try:
+        head = buf[:64].decode('latin-1')
+        if (cached is None or cached.get('head') != head or
+              cached.get('scanned', 0) > len(buf)):
+            cached = dict(head=head, scanned=0, hours=[], first=None,
+                          last=None)
+        else:
+            # (the old index is compared to the new one before saving)
+            cached = copy.deepcopy(cached)
+        _index_log_buf(buf, cached, kind, state['cache'])
+        new_index[key] = cached
+        hours = cached['hours']
+        hour_starts = [h[0] for h in hours]
+        start = 0
+        end = len(buf)
+        if since is not None:
+            # for output logs, the run of lines that covers the start of
+            # the range can begin in the previous bucket
+            i = bisect.bisect_right(hour_starts, since) - 1
+            if kind == 'output':
+                i -= 1
+            if i >= 0:
+                start = hours[i][1]
+        if until is not None:
+            i = bisect.bisect_right(hour_starts, until)
+            if i < len(hours):
+                end = hours[i][1]
+        if start < end:
+            _scan_log_buf(buf, start, end, kind, query, state, emit)
+    finally:
+        buf.close()
+
+
+def query_logs(since=None, until=None, pid=None, pattern=None,
+               out=None):
+
+    """
+    Print the log entries that match a query.
+
+    The status log and all of the logfiles (see
+    create_logfile_settings()) are searched, including all rotated
+    generations, whether or not they are compressed (see ZIP_SUFFIXES;
+    lzip files are skipped).  Generations are searched oldest first,
+    and the entries from each file are preceded by a line containing
+    the file's path.
+
+    Output log lines don't contain PIDs; if pid is given, they are
+    limited to the time between the first and last status log entries
+    from that process.
+
+    To avoid reading whole files, each log directory has a sidecar file
+    (named '.' + prefix + LOG_INDEX_SUFFIX) containing the offset of the
+    first entry in each hour of each uncompressed file and the time
+    range of each compressed file, keyed by inode (so that entries stay
+    valid across rotation).  It's updated incrementally, and it's only
+    a cache, so if it can't be read or written, it's ignored.
+
+    Parameters:
+        since: if not None, the earliest timestamp to include
+        until: if not None, the latest timestamp to include
+        pid: if not None, the process ID to include
+        pattern: if not None, a regular expression that entries must
+                 match (a string; matched against the UTF-8 bytes)
+        out: a file object to write to (in binary mode, or a text-mode
+             file in Python 2.x); if None, stdout is used
+
+    Dependencies:
+        config settings: status_log, (*_log)
+        globals: cfg, _logfile_info, LOG_INDEX_SUFFIX
+        functions: _log_generations(), _scan_logfile(), fix_path()
+        modules: sys, os, re, json
+
+    """
+
+    if out is None:
+        sys.stdout.flush()
+        out = getattr(sys.stdout, 'buffer', sys.stdout)
+    if pattern is not None:
+        if not isinstance(pattern, bytes):
+            pattern = pattern.encode('utf-8')
+        pattern = re.compile(pattern, re.MULTILINE)
+    query = dict(since=since, until=until, pid=pid, pattern=pattern)
+
+    # what to search
+    to_search = []
+    if cfg['status_log']:
+        to_search.append((cfg['status_log'], 'status'))
+    for name_str in _logfile_info:
+        if cfg.get(name_str + '_log'):
+            to_search.append((cfg[name_str + '_log'], 'output'))
+
+    def search(prefix, kind, query, emitter, seen):
+        dir_path, base = os.path.split(prefix)
+        index_path = os.path.join(dir_path, '.' + base + LOG_INDEX_SUFFIX)
+        try:
+            with open(fix_path(index_path), 'r') as index_fo:
+                old_index = json.load(index_fo)
+            if not isinstance(old_index, dict):
+                old_index = {}
+        except (IOError, OSError, ValueError):
+            old_index = {}
+        new_index = {}
+        for f_path in _log_generations(prefix):
+            if os.path.realpath(f_path) in seen:
+                continue
+            seen.add(os.path.realpath(f_path))
+            _scan_logfile(f_path, kind, query, (old_index, new_index),
+                          emitter(f_path))
+        if new_index != old_index:
+            try:
+                with open(fix_path(index_path + '.new'), 'w') as index_fo:
+                    json.dump(new_index, index_fo)
+                os.rename(fix_path(index_path + '.new'),
+                          fix_path(index_path))
+            except (IOError, OSError):
+                pass
+
+    def printer(f_path, times=None):
+        found = []
+        def emit(entry, t):
+            if times is not None:
+                times.append(t)
+            if not found:
+                out.write('==> {0} <==\n'.format(f_path).encode('utf-8'))
+                found.append(True)
+            out.write(entry)
+            if not entry.endswith(b'\n'):
+                out.write(b'\n')
+        return emit
+
+    # output log lines don't have PIDs, so get the time range of the
+    # process from the status log first
+    # (or while printing the status log, if there's no pattern)
+    pid_times = []
+    if pid is not None and pattern is not None and cfg['status_log']:
+        search(cfg['status_log'], 'status', dict(query, pattern=None),
+               lambda f_path: lambda entry, t: pid_times.append(t), set())
+
+    seen = set()
+    for prefix, kind in to_search:
+        if kind == 'status' and pid is not None and pattern is None:
+            search(prefix, kind, query,
+                   lambda f_path: printer(f_path, pid_times), seen)
+        elif kind == 'output' and pid is not None:
+            if not pid_times:
+                continue
+            search(prefix, kind,
+                   dict(query, since=min(pid_times), until=max(pid_times),
+                        pid=None),
+                   printer, seen)
+        else:
+            search(prefix, kind, query, printer, seen)
+    out.flush()
+
+
+############################
+# running external commands
+############################
+
+def render_command_exception(e):
+    """
+    Return a formatted string for an external-command-related exception.
+    Parameters:
+        e: the exception to render
+    """
+    if isinstance(e, OSError):
+        return 'Details: [Errno {0}] {1}'.format(e.errno, e.strerror)
+    else:
+        return 'Details: {0}'.format(e)
+
+
+def command_error_handler(e, cmd_descr, use_logger=False, warn_only=False,
+                          exit_val=exitvals['startup']['num']):
+    """
+    Handle external-command-related exceptions with various options.
+    If it returns, returns False.
+    Parameters:
+        cmd_descr: a string describing the command, used in messages
+                   like 'starting rsync backup'
+        see generic_error_handler() for the rest
+    Dependencies:
+        globals: exitvals['startup']
+        functions: generic_error_handler()
+    """
+    msg = ('problem running external {0} command'.format(cmd_descr))
+    return generic_error_handler(e, msg, render_command_exception,
+                                 use_logger, warn_only, exit_val)
+
+
+def render_unix_exit_status(status):
+    """
+    Turn a Unix/POSIX error status value into an informative string.
+    Parameters:
+        status: the exit status to render
+    Dependencies:
+        modules: os
+        Python: 2.3, for os.WCOREDUMP()
+    """
+    status_str = ''
+    if os.WIFEXITED(status):
+        status_str = str(os.WEXITSTATUS(status))
+    elif os.WIFSIGNALED(status):
+        status_str = 'killed by signal ' + str(os.WTERMSIG(status))
+    # probably only possible with a signal, but just in case...
+    if os.WCOREDUMP(status):
+        status_str += '; core dumped'
+    return status_str
+
+
+class _FDPoller(object):
+
+    """
+    Wait for file descriptors to become readable.
+
+    Uses selectors.DefaultSelector (epoll, kqueue, etc.) if it's
+    available (Python 3.4+); unlike select.select(), which is used
+    otherwise, this has no limit on descriptor numbers, and doesn't
+    have to be handed every descriptor on every call.
+
+    """
+
+    def __init__(self):
+        """
+        Dependencies:
+            modules: sys, (selectors)
+        """
+        self._data = {}
+        self._selector = None
+        if 'selectors' in sys.modules:
+            self._selector = selectors.DefaultSelector()
+
+
+    def __len__(self):
+        """Return the number of descriptors being watched."""
+        return len(self._data)
+
+
+    def register(self, fd, data=None):
+        """
+        Start watching a file descriptor.
+        Parameters:
+            fd: the file descriptor
+            data: anything; returned with the descriptor by poll()
+        Dependencies:
+            modules: (selectors)
+        """
+        self._data[fd] = data
+        if self._selector is not None:
+            self._selector.register(fd, selectors.EVENT_READ)
+
+
+    def unregister(self, fd):
+        """Stop watching a file descriptor."""
+        del self._data[fd]
+        if self._selector is not None:
+            self._selector.unregister(fd)
+
+
+    def poll(self, timeout=None):
+        """
+        Wait for descriptors to become readable.
+        Returns a list of (descriptor, data) tuples, which will be empty
+        if the timeout expired.
+        Parameters:
+            timeout: the maximum time to wait, in seconds; if None,
+                     wait indefinitely
+        Dependencies:
+            modules: select
+        """
+        if self._selector is not None:
+            ready = [key.fd for key, events in self._selector.select(timeout)]
+        else:
+            ready = select.select(list(self._data), [], [], timeout)[0]
+        return [(fd, self._data[fd]) for fd in ready]
+
+
+    def close(self):
+        """Release the underlying resources."""
+        if self._selector is not None:
+            self._selector.close()
+
+
+class _FanOutJob(object):
+
+    """
+    The state of one copy by multi_fan_out().
+
+    The inputs are watched by whoever is driving the copy (see
+    _FDPoller): multi_fan_out() itself, or the shared copier thread for
+    background commands (see _FanOutCopier).  handle() is called when
+    an input is readable, and tick() after each wait.
+
+    Line by line, input is read with os.read() as it becomes available,
+    and split into lines here; an incomplete line is kept until the rest
+    arrives.  (A blocking readline() would let a command that prints a
+    partial line hold up all of the others on the shared thread.)
+    Inputs that are text-mode file objects are decoded as readline()
+    would decode them, with universal newlines; file descriptors are
+    wrapped in file objects as before, to decide which.  In chunks (see
+    multi_fan_out()),
+    data is read with os.read() (into a reusable buffer, if os.readv()
+    is available) and written to file descriptors with os.write(),
+    without being split into lines or decoded.  Text-mode file objects
+    from the io module are written to through their binary buffers;
+    other file-like objects are given bytes, or UTF-8-decoded text if
+    they don't accept bytes.
+
+    In chunks, if an input has only one output, and it's a file
+    descriptor, and os.splice() is available (Linux, Python 3.10+), the
+    data is moved by the kernel and never enters Python.  This isn't
+    done if the recent output is being kept for alert emails (see the
+    alert_context_lines setting).  (Python has no os.tee(), so inputs
+    with more than one output always go through the buffer.)
+
+    Jobs also serve as the handles for copies on the shared thread,
+    with Thread-like join() and is_alive() methods.
+
+    """
+
+    def __init__(self, stream_tuples, flush_policy='line',
+                 chunk_size=None):
+
+        """
+        Set up the streams.
+
+        Parameters:
+            see multi_fan_out()
+
+        Dependencies:
+            globals: _atexit_flush_fan_out_registered, _recent_output,
+                     INTEGER_TYPES
+            functions: flush_fan_out_outputs()
+            modules: os, io, time, threading, atexit, codecs
+
+        """
+
+        global _atexit_flush_fan_out_registered
+
+        self.chunk_size = chunk_size
+        # file objects we create from file descriptors; if duplicate
+        # descriptors are wrapped and the objects go out of scope and
+        # are automatically closed, we'll get errors, so instead we
+        # keep track and close them ourselves
+        self._fo_list = []
+        self._streams = {}
+        for i, out_list in stream_tuples:
+            i_fd = i if isinstance(i, INTEGER_TYPES) else i.fileno()
+            if chunk_size is None:
+                in_obj = (self._fdopen(i, 'r')
+                              if isinstance(i, INTEGER_TYPES) else i)
+                decoder = None
+                if isinstance(in_obj, io.TextIOBase):
+                    decoder = io.IncrementalNewlineDecoder(
+                        codecs.getincrementaldecoder(
+                            getattr(in_obj, 'encoding', None) or 'utf-8'
+                        )(getattr(in_obj, 'errors', None) or 'strict'),
+                        True
+                    )
+                # have to use {} notation to have expressions as keys
+                self._streams.update({
+                    i_fd: dict(
+                        out_list=[self._fdopen(o, 'a')
+                                      if isinstance(o, INTEGER_TYPES)
+                                      else o
+                                      for o in out_list],
+                        in_obj=in_obj,
+                        decoder=decoder,
+                        newline='\n' if decoder is not None else b'\n',
+                        partial='' if decoder is not None else b'',
+                    )
+                })
+                continue
+            outs = []
+            for o in out_list:
+                if isinstance(o, INTEGER_TYPES):
+                    outs.append(dict(target=o, decoder=False))
+                elif isinstance(o, io.TextIOWrapper):
+                    o.flush()
+                    outs.append(dict(target=o.buffer, decoder=False))
+                else:
+                    outs.append(dict(target=o, decoder=None))
+            # have to use {} notation to have expressions as keys
+            self._streams.update({
+                i_fd: dict(
+                    out_list=[o['target'] for o in outs],
+                    outs=outs,
+                    partial=b'',
+                    splice=(len(outs) == 1 and
+                            isinstance(outs[0]['target'], INTEGER_TYPES)
+                            and _recent_output is None and
+                            hasattr(os, 'splice')),
+                )
+            })
+        self.open_fds = set(self._streams)
+
+        # pending holds the amount written since the last flush, keyed
+        # by the id() of the output
+        self._pending = {}
+        self._all_outs = [o for i_dict in self._streams.values()
+                              for o in i_dict['out_list']
+                              if not isinstance(o, INTEGER_TYPES)]
+        self._last_flush = time.time()
+        if flush_policy == 'line':
+            self._policy, self._limit = flush_policy, None
+        else:
+            self._policy, self._limit = flush_policy
+            if not _atexit_flush_fan_out_registered:
+                atexit.register(flush_fan_out_outputs)
+                _atexit_flush_fan_out_registered = True
+        self._buf = None
+        if chunk_size is not None and hasattr(os, 'readv'):
+            self._buf = bytearray(chunk_size)
+            self._buf_view = memoryview(self._buf)
+        self._done = threading.Event()
+
+
+    def _fdopen(self, fd, mode):
+        """Wrapper for os.fdopen() that also keeps track of files."""
+        fo = os.fdopen(fd, mode)
+        self._fo_list.append(fo)
+        return fo
+
+
+    def _flush(self, out_list):
+        """
+        Flush outputs that have data waiting, and reset their counts.
+        Dependencies:
+            globals: _fan_out_buffered
+        """
+        for o in out_list:
+            if self._pending.get(id(o)):
+                o.flush()
+                self._pending[id(o)] = 0
+                if o in _fan_out_buffered:
+                    _fan_out_buffered.remove(o)
+
+
+    def _written(self, o, amount):
+        """
+        Apply the flush policy after writing to an output.
+        Dependencies:
+            globals: _fan_out_buffered
+        """
+        if self._policy == 'line':
+            o.flush()
+            return
+        if not self._pending.get(id(o)) and o not in _fan_out_buffered:
+            _fan_out_buffered.append(o)
+        self._pending[id(o)] = self._pending.get(id(o), 0) + amount
+        if self._policy == 'size' and self._pending[id(o)] >= self._limit:
+            self._flush([o])
+
+
+    def _write_fo(self, out, data):
+        """
+        Write to a file-like object, decoding the data if necessary.
+        Dependencies:
+            modules: codecs
+        """
+        if out['decoder'] is None:
+            try:
+                out['target'].write(data)
+                out['decoder'] = False
+                return
+            except TypeError:
+                out['decoder'] = (codecs.getincrementaldecoder('utf-8')
+                                      ('replace'))
+        if out['decoder'] is False:
+            out['target'].write(data)
+        else:
+            out['target'].write(out['decoder'].decode(data))
+
+
+    def _keep_recent(self, i_dict, data):
+        """
+        Add the last complete lines in a chunk to _recent_output.
+        Dependencies:
+            globals: _recent_output, FAN_OUT_CHUNK_SIZE
+        """
+        nl = data.rfind(b'\n')
+        if nl == -1:
+            i_dict['partial'] = ((i_dict['partial'] + data)
+                                 [-FAN_OUT_CHUNK_SIZE:])
+            return
+        start = nl
+        for x in range(_recent_output.maxlen):
+            start = data.rfind(b'\n', 0, start)
+            if start == -1:
+                break
+        lines = data[start + 1:nl + 1]
+        if start == -1:
+            lines = i_dict['partial'] + lines
+        _recent_output.extend(lines.splitlines(True))
+        i_dict['partial'] = data[nl + 1:][-FAN_OUT_CHUNK_SIZE:]
+
+
+    def handle(self, fd):
+
+        """
+        Copy what's available from a readable input.
+
+        Returns False if the input has reached EOF (and has been
+        removed from open_fds), True otherwise.
+
+        May raise IOError/OSError exceptions.
+
+        Dependencies:
+            globals: _recent_output, INTEGER_TYPES, FAN_OUT_CHUNK_SIZE
+            modules: os, errno
+
+        """
+
+        i_dict = self._streams[fd]
+
+        # line by line; the input is readable, so this won't block
+        if self.chunk_size is None:
+            raw = os.read(fd, FAN_OUT_CHUNK_SIZE)
+            data = raw
+            if i_dict['decoder'] is not None:
+                data = i_dict['decoder'].decode(raw, not raw)
+            nl = i_dict['newline']
+            lines = (i_dict['partial'] + data).split(nl)
+            i_dict['partial'] = lines.pop()
+            lines = [line + nl for line in lines]
+            if not raw and i_dict['partial']:
+                lines.append(i_dict['partial'])  # no newline at the end
+            for line in lines:
+                # keep the tail for alert emails
+                if _recent_output is not None:
+                    _recent_output.append(line)
+                for o in i_dict['out_list']:
+                    o.write(line)
+                    self._written(o, len(line))
+            if not raw:
+                self.open_fds.discard(fd)
+                self._flush(i_dict['out_list'])
+                return False
+            return True
+
+        # in chunks
+        if i_dict['splice']:
+            try:
+                if os.splice(fd, i_dict['out_list'][0], self.chunk_size):
+                    return True
+                self.open_fds.discard(fd)
+                return False
+            except OSError as e:
+                # neither end is a pipe, or the output is in append mode
+                if e.errno != errno.EINVAL:
+                    raise
+                i_dict['splice'] = False
+        if self._buf is not None:
+            data = self._buf_view[:os.readv(fd, [self._buf])]
+        else:
+            data = os.read(fd, self.chunk_size)
+        if not len(data):
+            self.open_fds.discard(fd)
+            if _recent_output is not None and i_dict['partial']:
+                _recent_output.append(i_dict['partial'])
+            self._flush(i_dict['out_list'])
+            return False
+        data_bytes = None
+        for o in i_dict['outs']:
+            target = o['target']
+            if isinstance(target, INTEGER_TYPES):
+                to_write = data
+                while len(to_write):
+                    to_write = to_write[os.write(target, to_write):]
+                continue
+            if data_bytes is None:
+                data_bytes = bytes(data)
+            self._write_fo(o, data_bytes)
+            self._written(target, len(data_bytes))
+        # keep the tail for alert emails
+        if _recent_output is not None:
+            self._keep_recent(i_dict, data_bytes if data_bytes is not None
+                                          else bytes(data))
+        return True
+
+
+    def timeout(self):
+        """
+        Return how long to wait for input before calling tick().
+        Returns None if there's no need to wake up.
+        Dependencies:
+            modules: time
+        """
+        if self._policy == 'time' and any(self._pending.values()):
+            return max(0, self._last_flush + self._limit - time.time())
+        return None
+
+
+    def tick(self):
+        """
+        Flush the outputs, if they're due under a time policy.
+        Dependencies:
+            modules: time
+        """
+        if (self._policy == 'time' and
+              time.time() - self._last_flush >= self._limit):
+            self._flush(self._all_outs)
+            self._last_flush = time.time()
+
+
+    def finish(self):
+
+        """
+        Flush and clean up after all inputs have reached EOF.
+
+        May raise IOError exceptions.
+
+        Dependencies:
+            modules: errno
+
+        """
+
+        try:
+            # write out any partial characters, and make sure
+            # everything is out; outputs may be shared between inputs,
+            # so an earlier flush at EOF may have been skipped
+            for i_dict in self._streams.values():
+                for o in i_dict.get('outs', []):
+                    if o['decoder']:
+                        o['target'].write(o['decoder'].decode(b'', True))
+            self._flush(self._all_outs)
+            for fo in self._fo_list:
+                try:
+                    fo.close()
+                except IOError as e:
+                    if e.errno == errno.EBADF:
+                        pass  # already closed
+                    else:
+                        raise
+        finally:
+            self._done.set()
+
+
+    def join(self, timeout=None):
+        """Wait until the copy is finished (or the timeout expires)."""
+        self._done.wait(timeout)
+
+
+    def is_alive(self):
+        """Return True if the copy hasn't finished."""
+        return not self._done.is_set()
+
+
+class _FanOutCopier(object):
+
+    """
+    A single thread that copies the output of background commands.
+
+    Background commands run with daemon=True (see run_command()) hand
+    their streams to this thread (see _fan_out_copier), instead of each
+    getting a thread of their own.  The thread is started when the
+    first job is added, and wakes up for new jobs via a pipe.
+
+    """
+
+    def __init__(self):
+        """
+        Dependencies:
+            modules: threading
+        """
+        self._lock = threading.Lock()
+        self._new_jobs = []
+        self._thread = None
+        self._wake_r = None
+        self._wake_w = None
+
+
+    def add(self, job):
+
+        """
+        Hand a _FanOutJob to the copier thread, and return it.
+
+        Dependencies:
+            instance methods: _run()
+            modules: os, threading
+
+        """
+
+        with self._lock:
+            if self._thread is None:
+                self._wake_r, self._wake_w = os.pipe()
+                self._thread = threading.Thread(target=self._run,
+                                                name='fan-out copier')
+                self._thread.daemon = True
+                self._thread.start()
+            self._new_jobs.append(job)
+        os.write(self._wake_w, b'x')
+        return job
+
+
+    def _run(self):
+
+        """
+        Copy data for all of the jobs until the script exits.
+
+        Errors only stop the job they occurred in; they're logged as
+        warnings.
+
+        Dependencies:
+            classes: _FDPoller
+            functions: generic_error_handler(),
+                       render_command_exception()
+            modules: os
+
+        """
+
+        def drop(job, e):
+            for fd in list(job.open_fds):
+                poller.unregister(fd)
+                job.open_fds.discard(fd)
+            if job in jobs:
+                jobs.remove(job)
+            generic_error_handler(
+                e, 'problem copying the output of a background command',
+                render_command_exception, use_logger=True, warn_only=True
+            )
+            try:
+                job.finish()
+            except (IOError, OSError, ValueError):
+                pass
+
+        poller = _FDPoller()
+        poller.register(self._wake_r)
+        jobs = []
+        while True:
+            timeouts = [t for t in [job.timeout() for job in jobs]
+                            if t is not None]
+            for fd, job in poller.poll(min(timeouts) if timeouts else None):
+                if job is None:
+                    os.read(self._wake_r, 4096)
+                    with self._lock:
+                        new_jobs, self._new_jobs = self._new_jobs, []
+                    for new_job in new_jobs:
+                        for new_fd in new_job.open_fds:
+                            poller.register(new_fd, new_job)
+                        jobs.append(new_job)
+                    continue
+                if fd not in job.open_fds:
+                    continue  # dropped earlier in this round
+                try:
+                    if not job.handle(fd):
+                        poller.unregister(fd)
+                except (IOError, OSError, ValueError, TypeError) as e:
+                    drop(job, e)
+            for job in jobs[:]:
+                try:
+                    job.tick()
+                    if not job.open_fds:
+                        jobs.remove(job)
+                        job.finish()
+                except (IOError, OSError, ValueError, TypeError) as e:
+                    drop(job, e)
+
+
+def multi_fan_out(stream_tuples, flush_policy='line', chunk_size=None):
+
+    """
+    Copy data from multiple streams to multiple streams, line by line.
+
+    Or in chunks, if chunk_size is not None; see _FanOutJob.  This is
+    much faster for commands with a lot of output, but lines from
+    different inputs that share an output can be interleaved.
+
+    May raise IOError exceptions.
+
+    Parameters:
+        stream_tuples: a list of tuples, each of which must have two
+                       elements (input and output); the first element of
+                       each tuple must be a file descriptor or file
+                       object, and the second must be a list of file
+                       descriptors and/or file objects
+                       * file-like objects are also allowed; for input,
+                         they must have a fileno() method (they're read
+                         through their descriptors, so they must not
+                         have data buffered already), and for output,
+                         they must have write() and flush() methods
+                       * input elements may only appear once, but output
+                         elements may be duplicated
+        flush_policy: when to flush the outputs; one of:
+                          * 'line': after every line
+                          * ('size', n): when at least n bytes
+                            (characters, for text outputs) have been
+                            written to an output since it was last
+                            flushed
+                          * ('time', secs): at least every secs seconds
+                            (which may be a float)
+                      outputs are always flushed when their input
+                      reaches EOF, and at exit (see
+                      flush_fan_out_outputs())
+        chunk_size: if not None, copy the data in chunks of up to this
+                    many bytes, rather than line by line
+
+    Dependencies:
+        classes: _FanOutJob, _FDPoller
+
+    """
+
+    job = _FanOutJob(stream_tuples, flush_policy, chunk_size)
+    poller = _FDPoller()
+    try:
+        for fd in job.open_fds:
+            poller.register(fd)
+        while len(poller):
+            for fd, data in poller.poll(job.timeout()):
+                if not job.handle(fd):
+                    poller.unregister(fd)
+            job.tick()
+    finally:
+        poller.close()
+    job.finish()
+
+
+def flush_fan_out_outputs():
+    """
+    Flush all outputs with data buffered by multi_fan_out().
+    Registered to run at exit, for background commands.
+    Errors are ignored; we're probably exiting anyway.
+    Dependencies:
+        globals: _fan_out_buffered
+    """
+    for o in _fan_out_buffered[:]:
+        try:
+            o.flush()
+        except (IOError, OSError, ValueError):
+            pass  # ValueError: already closed
+        if o in _fan_out_buffered:
+            _fan_out_buffered.remove(o)
+
+
+def _has_fileno(target):
+    """
+    Check if an output target can be handed to a process directly.
+    Parameters:
+        target: a file descriptor or file-like object
+    Dependencies:
+        modules: io
+    """
+    if isinstance(target, INTEGER_TYPES):
+        return True
+    try:
+        target.fileno()
+    except (AttributeError, IOError, OSError, ValueError,
+            io.UnsupportedOperation):
+        return False
+    return True
+
+
+class CapturedOutput(object):
+
+    """
+    A target for command output that collects it for use in the script.
+
+    Can be used anywhere run_command() accepts an output target,
+    including in a list with other targets (e.g., the output log), so
+    the output can be logged and captured at the same time:
+        out = CapturedOutput()
+        run_command('listing', ['ls'], stdout=[out, output_log_fo])
+        for line in out:
+            ...
+
+    The output is kept in a tempfile.SpooledTemporaryFile, which is in
+    memory until it grows past max_size bytes, and is then moved to a
+    temporary file on disk, so memory use stays bounded however much
+    output there is.  The output is stored as bytes; text is encoded
+    as UTF-8.
+
+    The object has no file descriptor, so the output always goes
+    through the copying in multi_fan_out(); for background commands,
+    wait for the copying to finish (see run_command()) before reading.
+
+    """
+
+    def __init__(self, max_size=None, spool_dir=None):
+        """
+        Parameters:
+            max_size: how many bytes to keep in memory before spilling
+                      to disk; if None, use CAPTURE_SPOOL_SIZE
+            spool_dir: the directory for the temporary file, or None
+                       for the default (see the tempfile module)
+        Dependencies:
+            globals: CAPTURE_SPOOL_SIZE
+            modules: tempfile
+        """
+        if max_size is None:
+            max_size = CAPTURE_SPOOL_SIZE
+        self.max_size = max_size
+        self._spool = tempfile.SpooledTemporaryFile(max_size=max_size,
+                                                    dir=spool_dir)
+        self.size = 0
+
+
+    def write(self, data):
+        """Add data (bytes or text) to the end of the output."""
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+        self._spool.seek(0, os.SEEK_END)
+        self._spool.write(data)
+        self.size += len(data)
+
+
+    def flush(self):
+        """Nothing to do; here for compatibility with file objects."""
+        pass
+
+
+    def on_disk(self):
+        """Return true if the output has spilled to disk."""
+        return self.size > self.max_size
+
+
+    def read(self, size=-1, offset=0):
+        """
+        Return up to size bytes of the output, starting at offset.
+        With the default arguments, returns all of the output, so for
+        large outputs, consider reading in pieces or iterating instead.
+        """
+        self._spool.seek(offset)
+        return self._spool.read(size)
+
+
+    def getvalue(self, encoding=None):
+        """
+        Return all of the output, decoded if encoding is not None.
+        Undecodable bytes are replaced.
+        """
+        data = self.read()
+        if encoding is not None:
+            return data.decode(encoding, 'replace')
+        return data
+
+
+    def __iter__(self):
+        """
+        Iterate over the lines of the output (as bytes).
+        Only one line at a time is read into memory.
+        """
+        self._spool.seek(0)
+        while True:
+            line = self._spool.readline()
+            if not line:
+                break
+            yield line
+
+
+    def close(self):
+        """Discard the output, and remove the temporary file (if any)."""
+        self._spool.close()
+
+
+def _check_fan_out_args(func_name, flush_policy, chunk_size):
+    """
+    Make sure a flush policy and chunk size are valid; exit if not.
+    Parameters:
+        func_name: the name of the calling function, for messages
+        see multi_fan_out() for the rest
+    Dependencies:
+        globals: email_logger, exitvals['internal'], NUMBER_TYPES,
+                 INTEGER_TYPES
+        functions: pps()
+        modules: sys
+    """
+    if (flush_policy != 'line' and
+          not (isinstance(flush_policy, tuple) and
+               len(flush_policy) == 2 and
+               flush_policy[0] in ('size', 'time') and
+               isinstance(flush_policy[1], NUMBER_TYPES) and
+               not isinstance(flush_policy[1], bool) and
+               flush_policy[1] > 0)):
+        email_logger.error(
+            "Internal Error: invalid flush policy {0} in call to "
+            "{1}(); must be 'line',\n('size', n), or "
+            "('time', secs), with n/secs > 0; exiting." .
+            format(pps(flush_policy), func_name)
+        )
+        sys.exit(exitvals['internal']['num'])
+    if chunk_size is not None and (
+          not isinstance(chunk_size, INTEGER_TYPES) or
+          isinstance(chunk_size, bool) or chunk_size <= 0):
+        email_logger.error(
+            'Internal Error: invalid chunk size {0} in call to '
+            '{1}(); must be None\nor an integer > 0; exiting.' .
+            format(pps(chunk_size), func_name)
+        )
+        sys.exit(exitvals['internal']['num'])
+
+
+def _prepare_command_targets(stdin, stdout, stderr):
+
+    """
+    Sort out the input/output targets for an external command.
+
+    Returns a tuple: (stdin, stdout, real_stdout, stderr, real_stderr).
+    stdout and stderr are the lists of targets, with 'devnull' and
+    None values resolved; real_stdout and real_stderr are the values to
+    give to the process itself, which are subprocess.PIPE if the output
+    has to be copied (see multi_fan_out()).
+
+    Parameters:
+        see run_command()
+
+    Dependencies:
+        globals: email_logger, exitvals['external'], _devnull_fo
+        functions: scalar_to_list(), _has_fileno(), pps()
+        modules: os, subprocess, sys, atexit
+
+    """
+
+    global _devnull_fo
+
+    # if stdout/stderr are scalars, make them lists
+    stdout = scalar_to_list(stdout)
+    stderr = scalar_to_list(stderr)
+
+    # simulate DEVNULL
+    if ((stdin == 'devnull' or 'devnull' in stdout or
+           'devnull' in stderr) and _devnull_fo is None):
+        try:
+            _devnull_fo = open(os.devnull, 'a+')
+        except IOError as e:
+            email_logger.error('Error: could not open the null device '
+                               '({0}); exiting.\nDetails: [Errno {1}] {2}' .
+                               format(pps(os.devnull), e.errno, e.strerror))
+            sys.exit(exitvals['external']['num'])
+
+        # automatically close on exit
+        # (should be done anyway, but we'll be thorough)
+        def _close_devnull_fo():
+            """
+            Close the devnull file object.
+            Ignore errors; we're probably exiting anyway.
+            Dependencies:
+                globals: _devnull_fo
+            """
+            _devnull_fo.close()
+        atexit.register(_close_devnull_fo)
+    if stdin == 'devnull':
+        stdin = _devnull_fo
+
+    # prepare the stdout target(s)
+    # (a single target can be handed to the process directly, unless it
+    # has no usable file descriptor, e.g. a compressed logfile)
+    stdout[:] = [_devnull_fo if x == 'devnull' else x for x in stdout]
+    stdout[:] = [x for x in stdout if x is not None]
+    if len(stdout) == 0:
+        real_stdout = None
+    elif len(stdout) == 1 and _has_fileno(stdout[0]):
+        real_stdout = stdout[0]
     else:
-        return 'Details: {0}'.format(e)
+        real_stdout = subprocess.PIPE
+
+    # prepare the stderr target(s)
+    stderr[:] = [_devnull_fo if x == 'devnull' else x for x in stderr]
+    if len(stderr) == 1 and stderr[0] == subprocess.STDOUT:
+        real_stderr = stderr[0]
+    else:
+        stderr[:] = [x for x in stderr
+                       if x != subprocess.STDOUT and x is not None]
+        if len(stderr) == 0:
+            real_stderr = None
+        elif len(stderr) == 1 and _has_fileno(stderr[0]):
+            real_stderr = stderr[0]
+        else:
+            real_stderr = subprocess.PIPE
 
+    return (stdin, stdout, real_stdout, stderr, real_stderr)
 
-def command_error_handler(e, cmd_descr, use_logger=False, warn_only=False,
-                          exit_val=exitvals['startup']['num']):
+
+def _add_command_env(env_add, kwargs):
     """
-    Handle external-command-related exceptions with various options.
-    If it returns, returns False.
+    Apply env_add to the keyword arguments for an external command.
     Parameters:
-        cmd_descr: a string describing the command, used in messages
-                   like 'starting rsync backup'
-        see generic_error_handler() for the rest
+        see run_command()
     Dependencies:
-        globals: exitvals['startup']
-        functions: generic_error_handler()
+        modules: copy, os
     """
-    msg = ('problem running external {0} command'.format(cmd_descr))
-    return generic_error_handler(e, msg, render_command_exception,
-                                 use_logger, warn_only, exit_val)
+    if env_add is not None:
+        if 'env' not in kwargs or kwargs['env'] is None:
+            kwargs['env'] = copy.copy(os.environ)
+        kwargs['env'].update(env_add)
 
 
-def render_unix_exit_status(status):
+# ionice -c values
+_IONICE_CLASSES = {'realtime': '1', 'best-effort': '2', 'idle': '3'}
+
+
+def _resolve_command_limits(func_name, nice, ionice, cgroup_limits):
     """
-    Turn a Unix/POSIX error status value into an informative string.
+    Fill in the defaults for run_command()'s priority/limit arguments.
+    Returns a tuple of (nice, ionice, cgroup_limits).
     Parameters:
-        status: the exit status to render
+        func_name: the name of the calling function, for messages
+        see run_command() for the rest
+    Dependencies:
+        config settings: cmd_nice, cmd_ionice_class, cmd_ionice_level,
+                         cmd_cgroup_parent, cmd_cgroup_limits
+        globals: cfg, email_logger, exitvals['internal'], _IONICE_CLASSES
+        functions: pps()
+        modules: sys
+    """
+    if nice == 'default':
+        nice = cfg.get('cmd_nice')
+    if ionice == 'default':
+        if cfg.get('cmd_ionice_class') is None:
+            ionice = None
+        else:
+            ionice = (cfg['cmd_ionice_class'], cfg.get('cmd_ionice_level'))
+    if cgroup_limits == 'default':
+        cgroup_limits = cfg.get('cmd_cgroup_limits')
+    if ((ionice is not None and
+           (not isinstance(ionice, tuple) or len(ionice) != 2 or
+            ionice[0] not in _IONICE_CLASSES)) or
+          (cgroup_limits and cfg.get('cmd_cgroup_parent') is None)):
+        email_logger.error(
+'''Internal Error: invalid priority/limit arguments to {0}(), or
+cgroup limits without cmd_cgroup_parent; arguments were (in expanded
+notation):
+
+nice={1}, ionice={2},
+cgroup_limits={3}
+
+Exiting.''' .
+                           format(func_name, *map(pps, [nice, ionice,
+                                                        cgroup_limits]))
+        )
+        sys.exit(exitvals['internal']['num'])
+    return (nice, ionice, cgroup_limits)
+
+
+def _make_command_cgroup(cgroup_limits):
+    """
+    Create a transient cgroup for a command, and apply limits to it.
+    Returns the cgroup's path.  Raises OSError/IOError on failure, in
+    which case the cgroup is not left behind.
+    Parameters:
+        see run_command()
     Dependencies:
+        config settings: cmd_cgroup_parent
+        globals: cfg, script_shortname, _cgroup_counter,
+                 _cgroup_lock
+        functions: _remove_command_cgroup()
         modules: os
-        Python: 2.3, for os.WCOREDUMP()
     """
-    status_str = ''
-    if os.WIFEXITED(status):
-        status_str = str(os.WEXITSTATUS(status))
-    elif os.WIFSIGNALED(status):
-        status_str = 'killed by signal ' + str(os.WTERMSIG(status))
-    # probably only possible with a signal, but just in case...
-    if os.WCOREDUMP(status):
-        status_str += '; core dumped'
-    return status_str
+    global _cgroup_counter
+    with _cgroup_lock:
+        _cgroup_counter += 1
+        n = _cgroup_counter
+    path = os.path.join(cfg['cmd_cgroup_parent'],
+                        '{0}-{1}-{2}'.format(script_shortname, os.getpid(),
+                                             n))
+    os.mkdir(path)
+    try:
+        for control, value in sorted(cgroup_limits.items()):
+            with open(os.path.join(path, control), 'w') as f:
+                f.write('{0}\n'.format(value))
+    except (OSError, IOError):
+        _remove_command_cgroup(path)
+        raise
+    return path
 
 
-def multi_fan_out(stream_tuples):
+def _remove_command_cgroup(path):
+    """
+    Remove a transient cgroup, if possible.
+    Returns false if it couldn't be removed (e.g., it still contains a
+    running process); errors are otherwise ignored.
+    Dependencies:
+        modules: os, errno
+    """
+    try:
+        os.rmdir(path)
+    except OSError as e:
+        return e.errno == errno.ENOENT  # already gone
+    return True
+
 
+def _remove_bg_cgroups():
     """
-    Copy data from multiple streams to multiple streams, line by line.
+    Remove the transient cgroups of background commands that have
+    finished.  Called by kill_bg_commands(), and registered with atexit;
+    see run_command().
+    Dependencies:
+        globals: _bg_cgroups, _cgroup_lock
+        functions: _remove_command_cgroup()
+    """
+    with _cgroup_lock:
+        _bg_cgroups[:] = [path for path in _bg_cgroups
+                          if not _remove_command_cgroup(path)]
 
-    May raise IOError exceptions.
+
+def _limit_command(cmd, nice, ionice, cgroup_path):
+    """
+    Prefix a command (or each stage of a pipeline) so that it runs with
+    a nice level, an I/O scheduling class, and/or in a cgroup.
+
+    The prefixes are external commands (nice, ionice, and sh), which
+    exec() the real command, so no Python code runs in the child
+    between fork() and exec(); unlike a Popen preexec_fn, this is safe
+    in the presence of threads.
 
     Parameters:
-        stream_tuples: a list of tuples, each of which must have two
-                       elements (input and output); the first element of
-                       each tuple must be a file descriptor or file
-                       object, and the second must be a list of file
-                       descriptors and/or file objects
-                       * file-like objects are also allowed; for input,
-                         they must have a readline() method, and for
-                         output, they must have write() and flush()
-                         methods
-                       * input elements may only appear once, but output
-                         elements may be duplicated
+        cgroup_path: the path of the cgroup to join, or None
+        see run_command() for the rest
+    Dependencies:
+        globals: _IONICE_CLASSES
+        functions: _is_pipeline()
+        modules: os
+        external commands: nice, ionice, sh
+    """
+    prefix = []
+    if cgroup_path is not None:
+        # join the cgroup, then become the command
+        prefix += ['sh', '-c', 'echo $$ > "$0" && exec "$@"',
+                   os.path.join(cgroup_path, 'cgroup.procs')]
+    if nice is not None:
+        prefix += ['nice', '-n', str(nice)]
+    if ionice is not None:
+        prefix += ['ionice', '-c', _IONICE_CLASSES[ionice[0]]]
+        if ionice[1] is not None and ionice[0] != 'idle':
+            prefix += ['-n', str(ionice[1])]
+    if not prefix:
+        return cmd
+    if _is_pipeline(cmd):
+        return [prefix + stage for stage in cmd]
+    return prefix + list(cmd)
 
+
+def _is_pipeline(cmd):
+    """
+    Return true if a command is a pipeline (a list of commands).
+    See run_command().
+    """
+    return (isinstance(cmd, list) and len(cmd) > 0 and
+            all([isinstance(stage, list) for stage in cmd]))
+
+
+def _is_iterable_stdin(stdin):
+    """
+    Return true if a stdin value for run_command() is an iterable of
+    data, rather than a file or file descriptor.
     Dependencies:
-        modules: os, select, errno
+        globals: INTEGER_TYPES, STRINGISH_TYPES
+        functions: _has_fileno()
+    """
+    return (stdin is not None and stdin != 'devnull' and
+            not isinstance(stdin, INTEGER_TYPES + STRINGISH_TYPES) and
+            not _has_fileno(stdin) and hasattr(stdin, '__iter__'))
+
+
+def _feed_stdin(source, fd, chunk_size, cmd_descr):
 
     """
+    Write the data from an iterable to a pipe, in chunks.
 
-    def fdopen_list(fd, mode='r', bufsize=None):
-        """
-        Wrapper for os.fdopen() that also keeps track of files.
-        If we create file objects from duplicate file descriptors, when
-        they go out of scope and are automatically closed, we'll get
-        errors.  Instead, we'll keep track and close them ourselves.
-        """
-        if bufsize is None:
-            fo = os.fdopen(fd, mode)
-        else:
-            fo = os.fdopen(fd, mode, bufsize)
-        fo_list.append(fo)
-        return fo
+    The target of the feeder threads for run_command().  Items are
+    collected until there are at least chunk_size bytes, then written
+    together; writes block while the pipe is full, so the iterable is
+    only consumed as fast as the command reads its input.  The pipe is
+    closed at the end, so the command sees EOF.
 
-    fo_list = []
-    stream_dict = {}
-    for i, out_list in stream_tuples:
-        if isinstance(i, int):
-            # have to use {} notation to have expressions as keys
-            stream_dict.update({
-                i: dict(
-                    out_list=[fdopen_list(o, 'a')
-                                  if isinstance(o, int) else o
-                                  for o in out_list],
-                    in_obj=fdopen_list(i, 'r'),
-                    in_eof=False,
-                )
-            })
-        else:
-            # have to use {} notation to have expressions as keys
-            stream_dict.update({
-                i.fileno(): dict(
-                    out_list=[fdopen_list(o, 'a')
-                                  if isinstance(o, int) else o
-                                  for o in out_list],
-                    in_obj=i,
-                    in_eof=False,
-                )
-            })
+    Errors are logged as warnings (there's no way to exit the script
+    from here); if the command stops reading, the rest of the input is
+    discarded quietly.
 
-    while True:
-        sel = select.select([i for i in stream_dict], [], [])
-        for i in sel[0]:
-            line = stream_dict[i]['in_obj'].readline()
-            if not line:
-                stream_dict[i]['in_eof'] = True
-                continue
-            for o in stream_dict[i]['out_list']:
-                o.write(line)
-                o.flush()
-        if False not in [i_dict['in_eof']
-                             for i, i_dict in stream_dict.items()]:
-            break
+    Parameters:
+        source: the iterable; items can be strings (which are encoded
+                as UTF-8) or bytes
+        fd: the write end of the pipe
+        chunk_size: the minimum size of each write, except the last
+        cmd_descr: the command description, for error messages
+
+    Dependencies:
+        globals: STRING_TYPES
+        functions: generic_error_handler(), render_command_exception()
+        modules: os, errno
+
+    """
+
+    def write_all(data):
+        while len(data):
+            data = data[os.write(fd, data):]
 
-    for fo in fo_list:
+    chunk = []
+    size = 0
+    try:
         try:
-            fo.close()
-        except IOError as e:
-            if e.errno == errno.EBADF:
-                pass  # already closed
-            else:
-                raise
+            for item in source:
+                if (isinstance(item, STRING_TYPES) and
+                      not isinstance(item, bytes)):
+                    item = item.encode('utf-8')
+                size += len(item)
+                chunk.append(item)
+                if size >= chunk_size:
+                    write_all(b''.join(chunk))
+                    chunk = []
+                    size = 0
+        finally:
+            # even if the iterable failed, pass on what we got
+            if chunk:
+                write_all(b''.join(chunk))
+    except (IOError, OSError) as e:
+        if e.errno != errno.EPIPE:
+            generic_error_handler(
+                e, 'problem feeding input to {0} command' .
+                       format(cmd_descr),
+                render_command_exception, use_logger=True, warn_only=True
+            )
+    except Exception as e:
+        # e.g., a TypeError for an unusable item, or an error from a
+        # generator
+        generic_error_handler(
+            e, 'problem feeding input to {0} command'.format(cmd_descr),
+            render_command_exception, use_logger=True, warn_only=True
+        )
+    finally:
+        os.close(fd)
+
+
+def _stdin_feeder_pipe():
+    """
+    Make a pipe for feeding stdin from an iterable.
+    Returns a tuple: (read_fd, write_fd); the write end is not
+    inherited by child processes.
+    Dependencies:
+        modules: os, (fcntl)
+    """
+    r, w = os.pipe()
+    # Python 3.4+ makes pipes non-inheritable; before that, if the
+    # write end leaked into the command, it would never see EOF
+    if 'fcntl' in sys.modules:
+        flags = fcntl.fcntl(w, fcntl.F_GETFD)
+        fcntl.fcntl(w, fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+    return (r, w)
+
+
+def _render_command(cmd):
+    """
+    Return a command or pipeline as a string, for logging.
+    See run_command().
+    Dependencies:
+        functions: _is_pipeline(), pps()
+    """
+    if _is_pipeline(cmd):
+        return ' | '.join([' '.join(map(pps, stage)) for stage in cmd])
+    return ' '.join(map(pps, cmd))
+
+
+def _start_pipeline(cmd, stdin, real_stdout, real_stderr, kwargs):
+
+    """
+    Start the stages of a pipeline, connected by OS pipes.
+
+    Returns a tuple: (procs, stdout_in, stderr_in).  procs is a list of
+    the Popen objects for the stages; stdout_in and stderr_in are file
+    objects for reading the pipeline's output, if real_stdout or
+    real_stderr (respectively) is subprocess.PIPE, otherwise None.
+
+    Unlike a single Popen() call, the stderr pipe (if any) is shared by
+    all of the stages, so we have to make our own pipes for copying
+    output; they're opened in text mode if universal_newlines or text
+    is true in kwargs, like the ones from Popen().
+
+    May raise OSError/ValueError exceptions; if it does, any stages
+    that were started have been killed.
+
+    Parameters:
+        cmd: the pipeline; a list of lists
+        stdin, real_stdout, real_stderr, kwargs: what to pass to
+            Popen(); see run_command() and _prepare_command_targets()
+
+    Dependencies:
+        functions: kill_bg_commands()
+        modules: os, subprocess
+
+    """
+
+    text = kwargs.get('universal_newlines') or kwargs.get('text')
+    mode = 'r' if text else 'rb'
+    parent_fds = []  # to close once the stages have their copies
+    stdout_in = stderr_in = None
+    if real_stdout == subprocess.PIPE:
+        r, real_stdout = os.pipe()
+        stdout_in = os.fdopen(r, mode)
+        parent_fds.append(real_stdout)
+    if real_stderr == subprocess.PIPE:
+        r, real_stderr = os.pipe()
+        stderr_in = os.fdopen(r, mode)
+        parent_fds.append(real_stderr)
+
+    # with subprocess.STDOUT, the middle stages' stderr goes where the
+    # last stage's stdout does (and None means ours)
+    mid_stderr = real_stderr
+    if real_stderr == subprocess.STDOUT:
+        mid_stderr = 1 if real_stdout is None else real_stdout
+
+    procs = []
+    try:
+        stage_stdin = stdin
+        for i, stage in enumerate(cmd):
+            last = (i == len(cmd) - 1)
+            procs.append(subprocess.Popen(
+                stage, stdin=stage_stdin,
+                stdout=real_stdout if last else subprocess.PIPE,
+                stderr=real_stderr if last else mid_stderr, **kwargs
+            ))
+            # the next stage gets its own copy; if we kept ours, an
+            # early exit by the next stage wouldn't cause a SIGPIPE
+            if i > 0:
+                stage_stdin.close()
+            stage_stdin = procs[-1].stdout
+    except (OSError, ValueError):
+        if procs and procs[-1].stdout is not None:
+            procs[-1].stdout.close()
+        for fo in (stdout_in, stderr_in):
+            if fo is not None:
+                fo.close()
+        kill_bg_commands(procs, kill_timeout=0)
+        raise
+    finally:
+        for fd in parent_fds:
+            os.close(fd)
+    return (procs, stdout_in, stderr_in)
 
 
 def run_command(cmd_descr, cmd, stdin=None, stdout=None, stderr=None,
                 bg=False, atexit_reg=True, daemon=True, use_logger=False,
                 warn_only=False, exit_val=exitvals['startup']['num'],
-                env_add=None, **kwargs):
+                env_add=None, flush_policy='line', chunk_size=None,
+                return_usage=False, nice='default', ionice='default',
+                cgroup_limits='default', **kwargs):
 
     """
     Run an external command, with flexible input/output targeting.
@@ -4258,15 +8310,47 @@ def run_command(cmd_descr, cmd, stdin=None, stdout=None, stderr=None,
     returns the command's exit value.  If bg is true, returns a tuple
     of (popen, thread).  The popen element is the Popen object for the
     process; the caller must ensure that its wait() method is eventually
-    called.  The thread element is the Thread object for the I/O copier
-    thread associated with the process (see multi_fan_out()); if there
-    is no thread (because there is at most one target each for stdout
-    and stderr), the thread element is None.
+    called.  The thread element is a handle for the process' output
+    copying (see multi_fan_out()), with join() and is_alive() methods:
+    if daemon is true, the copying is done by a thread shared by all
+    such background commands (see _FanOutCopier), and the handle is a
+    _FanOutJob; otherwise, it's the Thread object for a copier thread
+    of the process' own.  If there is no copying to do (because there
+    is at most one target each for stdout and stderr, with a usable
+    file descriptor), the thread element is None.
+
+    The command can also be a pipeline: a list of commands, each of
+    which is a list containing a command and its arguments, e.g.:
+        [dump_cmd, ['gzip'], ssh_cmd + ['cat > file']]
+    Each stage's stdout is connected to the next stage's stdin by an OS
+    pipe, so the data never passes through Python.  stdin is attached
+    to the first stage and stdout to the last; stderr is attached to
+    every stage, so errors from all of them are logged (with
+    subprocess.STDOUT, they go wherever the last stage's stdout goes,
+    like '2>&1' on each stage in the shell).  For pipelines, the exit
+    value is a list of the stages' exit values (like the shell's
+    PIPESTATUS), and the popen element is a list of Popen objects, all
+    of which must be waited for.  If any stage can't be started, the
+    ones that were are killed, and the pipeline is treated as a failed
+    command.
+
+    The command's CPU and I/O priority can be lowered (or raised), and
+    its resources limited with a cgroup, using the nice, ionice, and
+    cgroup_limits arguments or the corresponding config settings.  This
+    is done by running the command under the nice, ionice, and sh
+    commands, which replace themselves with the real command (in the
+    messages and logs, the command is shown without them).  If the
+    cgroup can't be created or set up, the command is treated as a
+    failed command.
+
+    For running many commands at once from an asyncio event loop, see
+    run_command_async() in the asynccmd submodule (Python 3.5+).
 
     Parameters:
         cmd_descr: a string describing the command, used in messages
                    like 'starting rsync backup'
-        cmd: a list containing the command and its arguments
+        cmd: a list containing the command and its arguments, or a
+             list of such lists (see above)
         stdin: what to attach to the process' stdin stream; can be
                a file descriptor, a file object, None,
                subprocess.DEVNULL if using Python 3.3+, or 'devnull' to
@@ -4275,14 +8359,23 @@ def run_command(cmd_descr, cmd, stdin=None, stdout=None, stderr=None,
                  cause the script to exit with an internal error
                * file-like objects are allowed, however, and may be
                  passed instead
+               * may also be an iterable (e.g., a generator) of
+                 strings or bytes, which is fed to the process by a
+                 thread of its own (daemonic if bg and daemon are
+                 true); writes are done in chunks of at least
+                 chunk_size bytes (FAN_OUT_CHUNK_SIZE if chunk_size
+                 is None), and block while the process isn't reading,
+                 so the iterable is consumed only as fast as the data
+                 is used
         stdout: what to attach to the process' stdout stream; can be
                 anything valid for stdin, or a list of such values
                 * may _not_ be/contain subprocess.PIPE, which will
                   cause the script to exit with an internal error
                 * file-like objects are allowed, however, and may be
                   passed instead; specifically, if more than one
-                  non-None value is supplied, the object must have
-                  write() and flush() methods
+                  non-None value is supplied, or if the value has no
+                  usable file descriptor (e.g., a compressed logfile),
+                  the object must have write() and flush() methods
         stderr: what to attach to the process' stderr stream; can be
                 anything valid for stdout, or subprocess.STDOUT (which
                 may not be part of a list, and will be ignored if in a
@@ -4292,9 +8385,11 @@ def run_command(cmd_descr, cmd, stdin=None, stdout=None, stderr=None,
             Popen object for the process
         atexit_reg: if true, and if bg is true, register a callback to
                     kill the command on exit
-        daemon: if true, and if bg is true, make the associated thread a
-                daemon thread (i.e. kill it when everything else is
-                done; otherwise, even sys.exit() won't kill it)
+        daemon: if true, and if bg is true, copy the output in the
+                shared daemon thread (i.e., stop copying when
+                everything else is done); otherwise, give the command
+                its own non-daemon thread (which even sys.exit() won't
+                kill)
         env_add: if not None, a dictionary of keys and values to add to
                  the environment in which the command will run; this is
                  added to the current environment if there is no env
@@ -4303,21 +8398,71 @@ def run_command(cmd_descr, cmd, stdin=None, stdout=None, stderr=None,
                  * keys that already exist in the target environment
                    will be overridden
                  * values must be strings, or a TypeError will be raised
+        flush_policy: when to flush the outputs, if there is more than
+                      one target for stdout or stderr; see
+                      multi_fan_out()
+                      * 'line' (the default) is best for interactive
+                        use; for chatty commands, a ('size', n) or
+                        ('time', secs) policy saves a flush per line
+                        per target
+        chunk_size: if not None, output is copied to multiple targets
+                    in chunks of up to this many bytes, instead of line
+                    by line; see multi_fan_out()
+                    * much faster for commands with a lot of output,
+                      e.g. FAN_OUT_CHUNK_SIZE
+        return_usage: if true, and bg is false, return a tuple of
+                      (exit value, usage) instead of just the exit
+                      value; see wait_with_usage() (for a pipeline,
+                      both elements are lists)
+                      * for background commands, use wait_with_usage()
+                        in place of the Popen object's wait() method
+        nice: the nice level adjustment for the command, from -20 to
+              19, or None for none; if 'default', use the cmd_nice
+              config setting
+        ionice: the I/O scheduling class and level for the command, as
+                a tuple like ('best-effort', 7) (the level may be
+                None), or None to leave them alone; if 'default', use
+                the cmd_ionice_class and cmd_ionice_level config
+                settings
+        cgroup_limits: a dict of cgroup control files and values (e.g.,
+                       {'memory.max': '2G'}) to apply to a transient
+                       cgroup created for the command (or pipeline)
+                       under cmd_cgroup_parent, or None or an empty dict
+                       for no cgroup; if 'default', use the
+                       cmd_cgroup_limits config setting
+                       * the cgroup is removed when the command is
+                         waited for, or for background commands, by
+                         kill_bg_commands() or at exit (once the
+                         command has finished)
         kwargs: passed to subprocess.Popen(); but see env_add
         see command_error_handler() for the rest
 
     Dependencies:
+        config settings: (cmd_nice), (cmd_ionice_class),
+                         (cmd_ionice_level), (cmd_cgroup_parent),
+                         (cmd_cgroup_limits)
         globals: exitvals['startup'], exitvals['internal'],
-                 exitvals['external'], email_logger, _devnull_fo,
-                 _atexit_kill_bg_commands_registered,
-                 _running_bg_commands
-        functions: scalar_to_list(), multi_fan_out(), pps(),
-                   kill_bg_commands()
-        modules: copy, os, subprocess, threading, sys, atexit
-
-    """
-
-    global _devnull_fo, _atexit_kill_bg_commands_registered
+                 email_logger, _atexit_kill_bg_commands_registered,
+                 _running_bg_commands, _fan_out_copier,
+                 _fan_out_copier_lock, FAN_OUT_CHUNK_SIZE,
+                 _atexit_remove_cgroups_registered,
+                 _bg_cgroups, _cgroup_lock
+        classes: _FanOutJob, _FanOutCopier
+        functions: multi_fan_out(), pps(), kill_bg_commands(),
+                   wait_with_usage(), _check_fan_out_args(),
+                   _prepare_command_targets(), _add_command_env(),
+                   _is_pipeline(), _start_pipeline(),
+                   _is_iterable_stdin(), _stdin_feeder_pipe(),
+                   _feed_stdin(), _resolve_command_limits(),
+                   _make_command_cgroup(), _remove_command_cgroup(),
+                   _remove_bg_cgroups(), _limit_command()
+        modules: os, subprocess, threading, sys, atexit, time
+        external commands: (nice), (ionice), (sh)
+
+    """
+
+    global _atexit_kill_bg_commands_registered, _fan_out_copier
+    global _atexit_remove_cgroups_registered
 
     # sanity check
     if (stdin == subprocess.PIPE or
@@ -4344,121 +8489,318 @@ Exiting.''' .
                                              exit_val, env_add, kwargs]))
         )
         sys.exit(exitvals['internal']['num'])
+    _check_fan_out_args('run_command', flush_policy, chunk_size)
+    nice, ionice, cgroup_limits = _resolve_command_limits(
+        'run_command', nice, ionice, cgroup_limits
+    )
 
-    # if stdout/stderr are scalars, make them lists
-    stdout = scalar_to_list(stdout)
-    stderr = scalar_to_list(stderr)
-
-    # simulate DEVNULL
-    if (('devnull' in stdout or 'devnull' in stderr)
-          and _devnull_fo is None):
-        try:
-            _devnull_fo = open(os.devnull, 'a+')
-        except IOError as e:
-            email_logger.error('Error: could not open the null device '
-                               '({0}); exiting.\nDetails: [Errno {1}] {2}' .
-                               format(pps(os.devnull), e.errno, e.strerror))
-            sys.exit(exitvals['external']['num'])
-
-        # automatically close on exit
-        # (should be done anyway, but we'll be thorough)
-        def _close_devnull_fo():
-            """
-            Close the devnull file object.
-            Ignore errors; we're probably exiting anyway.
-            Dependencies:
-                globals: _devnull_fo
-            """
-            _devnull_fo.close()
-        atexit.register(_close_devnull_fo)
-
-    # prepare the stdout target(s)
-    stdout[:] = [_devnull_fo if x == 'devnull' else x for x in stdout]
-    stdout[:] = [x for x in stdout if x is not None]
-    if len(stdout) == 0:
-        real_stdout = None
-    elif len(stdout) == 1:
-        real_stdout = stdout[0]
-    else:
-        real_stdout = subprocess.PIPE
+    # sort out the targets and the environment
+    stdin, stdout, real_stdout, stderr, real_stderr = (
+        _prepare_command_targets(stdin, stdout, stderr)
+    )
+    _add_command_env(env_add, kwargs)
 
-    # prepare the stderr target(s)
-    stderr[:] = [_devnull_fo if x == 'devnull' else x for x in stderr]
-    if len(stderr) == 1 and stderr[0] == subprocess.STDOUT:
-        real_stderr = stderr[0]
-    else:
-        stderr[:] = [x for x in stderr
-                       if x != subprocess.STDOUT and x is not None]
-        if len(stderr) == 0:
-            real_stderr = None
-        elif len(stderr) == 1:
-            real_stderr = stderr[0]
-        else:
-            real_stderr = subprocess.PIPE
+    # set up the cgroup, if any
+    cgroup_path = None
+    if cgroup_limits:
+        try:
+            cgroup_path = _make_command_cgroup(cgroup_limits)
+        except (OSError, IOError) as e:
+            command_error_handler(e, cmd_descr, use_logger, warn_only,
+                                  exit_val)
+            return None
+    limited_cmd = _limit_command(cmd, nice, ionice, cgroup_path)
 
-    # set up the environment
-    if env_add is not None:
-        if 'env' not in kwargs or kwargs['env'] is None:
-            kwargs['env'] = copy.copy(os.environ).update(env_add)
-        else:
-            kwargs['env'].update(env_add)
+    # iterable input goes through a pipe of our own
+    stdin_source = None
+    if _is_iterable_stdin(stdin):
+        stdin_source = stdin
+        stdin, stdin_w = _stdin_feeder_pipe()
 
     # run the command
+    start_time = time.time()
     try:
-        p = subprocess.Popen(cmd, stdin=stdin, stdout=real_stdout,
-                             stderr=real_stderr, **kwargs)
+        if _is_pipeline(cmd):
+            procs, stdout_in, stderr_in = _start_pipeline(
+                limited_cmd, stdin, real_stdout, real_stderr, kwargs
+            )
+        else:
+            p = subprocess.Popen(limited_cmd, stdin=stdin,
+                                 stdout=real_stdout, stderr=real_stderr,
+                                 **kwargs)
+            procs, stdout_in, stderr_in = [p], p.stdout, p.stderr
     except (OSError, ValueError) as e:
+        if stdin_source is not None:
+            os.close(stdin)
+            os.close(stdin_w)
+        if cgroup_path is not None:
+            _remove_command_cgroup(cgroup_path)
         command_error_handler(e, cmd_descr, use_logger, warn_only, exit_val)
         return None
 
+    # start feeding the input
+    feeder = None
+    if stdin_source is not None:
+        os.close(stdin)  # the command has its own copy
+        feeder = threading.Thread(
+            target=_feed_stdin,
+            args=(stdin_source, stdin_w,
+                  chunk_size if chunk_size is not None
+                             else FAN_OUT_CHUNK_SIZE,
+                  cmd_descr)
+        )
+        feeder.daemon = bg and daemon
+        feeder.start()
+
     # deal with the output
     stream_tuples = []
-    if len(stdout) > 1:
-        stream_tuples.append((p.stdout, stdout))
-    if len(stderr) > 1:
-        stream_tuples.append((p.stderr, stderr))
+    if real_stdout == subprocess.PIPE:
+        stream_tuples.append((stdout_in, stdout))
+    if real_stderr == subprocess.PIPE:
+        stream_tuples.append((stderr_in, stderr))
     if stream_tuples:
         if not bg:
-            multi_fan_out(stream_tuples)
+            multi_fan_out(stream_tuples, flush_policy, chunk_size)
         else:
-            t = threading.Thread(target=multi_fan_out,
-                                 args=(stream_tuples, ))
-            t.daemon = daemon
-            t.start()
+            if daemon:
+                with _fan_out_copier_lock:
+                    if _fan_out_copier is None:
+                        _fan_out_copier = _FanOutCopier()
+                t = _fan_out_copier.add(
+                    _FanOutJob(stream_tuples, flush_policy, chunk_size)
+                )
+            else:
+                t = threading.Thread(target=multi_fan_out,
+                                     args=(stream_tuples, flush_policy,
+                                           chunk_size))
+                t.daemon = False
+                t.start()
             if atexit_reg:
-                if p not in _running_bg_commands:
-                    _running_bg_commands.append(p)
+                for p in procs:
+                    if p not in _running_bg_commands:
+                        _running_bg_commands.append(p)
                 if not _atexit_kill_bg_commands_registered:
                     atexit.register(kill_bg_commands)
                     _atexit_kill_bg_commands_registered = True
 
     # return something
-    if not bg:
-        return p.wait()
-    return (p, t if stream_tuples else None)
+    if bg:
+        if cgroup_path is not None:
+            with _cgroup_lock:
+                _bg_cgroups.append(cgroup_path)
+                if not _atexit_remove_cgroups_registered:
+                    atexit.register(_remove_bg_cgroups)
+                    _atexit_remove_cgroups_registered = True
+        if _is_pipeline(cmd):
+            return (procs, t if stream_tuples else None)
+        return (p, t if stream_tuples else None)
+    waited = [wait_with_usage(p, start_time) if return_usage
+                  else (p.wait(), None)
+              for p in procs]
+    if feeder is not None:
+        # the command is done, so this won't block for long
+        feeder.join()
+    if cgroup_path is not None:
+        _remove_command_cgroup(cgroup_path)
+    if _is_pipeline(cmd):
+        ret = ([w[0] for w in waited], [w[1] for w in waited])
+    else:
+        ret = waited[0]
+    return ret if return_usage else ret[0]
 
 
-def kill_bg_commands():
+def wait_with_usage(p_obj, start_time=None):
+
     """
-    Kill all background commands.
+    Wait for a process, and return its exit value and resource usage.
+
+    Returns a tuple: (exit value, usage).  usage is a dict containing:
+        user: user CPU time, in seconds
+        system: system CPU time, in seconds
+        max_rss: maximum resident set size, in KiB (on some systems,
+                 including Linux, this can include memory used by our
+                 own process before the command was executed)
+        blocks_in, blocks_out: the number of block input/output
+                               operations
+        wall: the elapsed time since start_time, in seconds, or None
+    The figures include any children of the process that it waited
+    for (e.g., the commands run by 'sh -c').  usage is None if it isn't
+    available (no os.wait4(), or the process was already waited for).
+
+    The process is reaped with os.wait4() instead of Popen.wait(), but
+    the Popen object is updated as if its wait() method had been
+    called.
+
+    Parameters:
+        p_obj: the Popen object for the process
+        start_time: when the process was started (as a timestamp)
+
     Dependencies:
-        globals: _running_bg_commands
-        functions: kill_bg_command()
+        modules: os, sys, time, errno
+        Python: 2.6 (for os.wait4())
+
     """
-    # have to use a copy because kill_bg_command() changes the list
-    for p_obj in _running_bg_commands[:]:
-        kill_bg_command(p_obj)
 
+    if not hasattr(os, 'wait4') or p_obj.returncode is not None:
+        return (p_obj.wait(), None)
 
-def kill_bg_command(p_obj, kill_timeout=10, wait_timeout=None):
+    # Popen.wait() holds this lock while it waits, so that poll() in
+    # another thread doesn't reap the process out from under it
+    lock = getattr(p_obj, '_waitpid_lock', None)
+    if lock is not None:
+        lock.acquire()
+    try:
+        if p_obj.returncode is not None:
+            return (p_obj.returncode, None)
+        pid = None
+        while True:
+            try:
+                pid, status, ru = os.wait4(p_obj.pid, 0)
+                break
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                if e.errno == errno.ECHILD:
+                    # reaped elsewhere
+                    break
+                raise
+    finally:
+        if lock is not None:
+            lock.release()
+    if p_obj.returncode is not None or pid != p_obj.pid:
+        return (p_obj.wait(), None)
+    p_obj._handle_exitstatus(status)
+
+    max_rss = ru.ru_maxrss
+    if sys.platform == 'darwin':
+        max_rss //= 1024  # bytes there, KiB elsewhere
+    return (p_obj.returncode,
+            dict(user=ru.ru_utime, system=ru.ru_stime, max_rss=max_rss,
+                 blocks_in=ru.ru_inblock, blocks_out=ru.ru_oublock,
+                 wall=(time.time() - start_time
+                           if start_time is not None else None)))
+
+
+def _usage_messages(usage):
+    """
+    Return a list of log messages for the resource usage of a command.
+    Parameters:
+        usage: the usage dict from wait_with_usage(), None, or a list
+               of these (for a pipeline)
+    """
+    if isinstance(usage, list):
+        usage_list = usage
+    else:
+        usage_list = [usage]
+    msgs = []
+    for i, u in enumerate(usage_list):
+        if u is None:
+            continue
+        msg = 'Resource usage'
+        if isinstance(usage, list):
+            msg += ' (stage {0})'.format(i + 1)
+        msg += (': {0:.2f}s user, {1:.2f}s system, '.
+                format(u['user'], u['system']))
+        if u['wall'] is not None:
+            msg += '{0:.2f}s wall, '.format(u['wall'])
+        msg += ('{0} KiB max RSS, {1} blocks in, {2} blocks out.' .
+                format(u['max_rss'], u['blocks_in'], u['blocks_out']))
+        msgs.append(msg)
+    return msgs
+
+
+def _wait_for_processes(p_objs, timeout=None):
 
     """
-    Kill a background command.
+    Wait for processes to exit, without reaping them.
 
-    Returns a tuple: (exit value, was_already_dead?).
+    Returns a list of the processes that are still running when the
+    timeout expires (which is empty if they've all exited).
 
-    First tries SIGTERM, then sends SIGKILL if the process is still
-    running one second later.
+    Where pidfds are available (Linux 5.3+, Python 3.9+), the
+    processes are watched all at once (see _FDPoller), and we wake up
+    as soon as one exits.  Otherwise, the processes are polled, at
+    intervals that start at a millisecond and back off to 50 ms.
+
+    Parameters:
+        p_objs: a list of process objects
+        timeout: the maximum time to wait, in seconds; if None, wait
+                 indefinitely
+
+    Dependencies:
+        classes: _FDPoller
+        modules: os, time, errno
+
+    """
+
+    deadline = None if timeout is None else time.time() + timeout
+    running = [p for p in p_objs if p.poll() is None]
+
+    # watch pidfds, if we can
+    pidfds = []
+    if running and hasattr(os, 'pidfd_open'):
+        for p in running[:]:
+            try:
+                pidfds.append((os.pidfd_open(p.pid), p))
+            except OSError as e:
+                if e.errno == errno.ESRCH:
+                    # reaped in the meantime (e.g., by another thread)
+                    running.remove(p)
+                    continue
+                # e.g., ENOSYS on older kernels; poll instead
+                for fd, p in pidfds:
+                    os.close(fd)
+                pidfds = None
+                break
+    if pidfds:
+        poller = _FDPoller()
+        try:
+            for fd, p in pidfds:
+                poller.register(fd, p)
+            while len(poller):
+                if deadline is None:
+                    ready = poller.poll()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    ready = poller.poll(remaining)
+                for fd, p in ready:
+                    poller.unregister(fd)
+        finally:
+            poller.close()
+            for fd, p in pidfds:
+                os.close(fd)
+        return [p for p in running if p.poll() is None]
+
+    # otherwise, poll with backoff
+    delay = 0.001
+    while True:
+        running = [p for p in running if p.poll() is None]
+        if not running:
+            return running
+        if deadline is None:
+            time.sleep(delay)
+        else:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return running
+            time.sleep(min(delay, remaining))
+        delay = min(delay * 2, 0.05)
+
+
+def kill_bg_commands(p_objs=None, kill_timeout=10, wait_timeout=None):
+
+    """
+    Kill background commands, all at once.
+
+    Returns a list of tuples: (exit value, was_already_dead?), in the
+    same order as p_objs.
+
+    Sends SIGTERM to all of the processes, then waits for them
+    together, returning as soon as they've all exited; any that are
+    still running after the grace period (see kill_timeout) are sent
+    SIGKILL.
 
     May raise a TimeoutExpired exception (see wait_timeout).
 
@@ -4467,19 +8809,23 @@ def kill_bg_command(p_obj, kill_timeout=10, wait_timeout=None):
     can't be removed).
 
     Parameters:
-        p_obj: the process object for the command
-        timeout: how long to wait after sending SIGTERM to send SIGKILL
-                 (in seconds); if 0, don't send SIGKILL, just wait for
-                 the process to die
+        p_objs: a list of the process objects for the commands, or None
+                for all of the commands registered to be killed on exit
+                (see run_command())
+        kill_timeout: how long to wait after the first second after
+                      sending SIGTERM before sending SIGKILL (in
+                      seconds); i.e., the grace period is
+                      1 + kill_timeout seconds
         wait_timeout: if using Python 3.3, and this is not None, how
-                      long to wait if the process hasn't died even
+                      long to wait if the processes haven't died even
                       after SIGKILL (in seconds) before raising a
                       TimeoutExpired exception
 
     Dependencies:
         globals: email_logger, exitvals['internal'],
                  _running_bg_commands
-        modules: (subprocess), time, sys
+        functions: _wait_for_processes(), _remove_bg_cgroups()
+        modules: (subprocess), sys
         Python: 2.6
 
     """
@@ -4487,7 +8833,7 @@ def kill_bg_command(p_obj, kill_timeout=10, wait_timeout=None):
     # sanity check
     if sys.hexversion < 0x03030000 and wait_timeout is not None:
         email_logger.error('Internal Error: wait_timeout is not None in '
-                           'kill_bg_command(), but Python \n version is '
+                           'kill_bg_commands(), but Python \n version is '
                            'less than 3.3.')
         sys.exit(exitvals['internal']['num'])
 
@@ -4496,43 +8842,178 @@ def kill_bg_command(p_obj, kill_timeout=10, wait_timeout=None):
         if p in _running_bg_commands:
             _running_bg_commands.remove(p)
 
-    # is it already dead?
-    if p_obj.poll() is not None:
-        cleanup(p_obj)
-        return (p_obj.wait(), True)
+    if p_objs is None:
+        # have to use a copy because cleanup() changes the list
+        p_objs = _running_bg_commands[:]
+    results = {}
+
+    # are they already dead?
+    alive = []
+    for p_obj in p_objs:
+        if id(p_obj) in results or p_obj in alive:
+            continue
+        if p_obj.poll() is not None:
+            cleanup(p_obj)
+            results[id(p_obj)] = (p_obj.wait(), True)
+        else:
+            alive.append(p_obj)
 
     # SIGTERM
-    try:
-        p_obj.terminate()
-    except OSError:
-        # apparently happens only if it's dead and p_obj.wait() was
-        # already called
-        pass
-    time.sleep(1)
-    if p_obj.poll() is not None:
-        cleanup(p_obj)
-        return (p_obj.wait(), False)
+    for p_obj in alive:
+        try:
+            p_obj.terminate()
+        except OSError:
+            # apparently happens only if it's dead and p_obj.wait() was
+            # already called
+            pass
+    still_alive = _wait_for_processes(alive, 1 + kill_timeout)
+    for p_obj in alive:
+        if p_obj not in still_alive:
+            cleanup(p_obj)
+            results[id(p_obj)] = (p_obj.wait(), False)
 
     # SIGKILL
-    if kill_timeout != 0:
-        for i in range(kill_timeout):
-            time.sleep(1)
-            if p_obj.poll() is not None:
-                cleanup(p_obj)
-                return (p_obj.wait(), False)
-    try:
-        p_obj.kill()
-    except OSError:
-        # apparently happens only if it's dead and p_obj.wait() was
-        # already called
-        pass
-    cleanup(p_obj)
+    for p_obj in still_alive:
+        try:
+            p_obj.kill()
+        except OSError:
+            # apparently happens only if it's dead and p_obj.wait() was
+            # already called
+            pass
+        cleanup(p_obj)
+
+    # hopefully they're actually dead by now, otherwise this could hang
+    if sys.hexversion >= 0x03030000 and wait_timeout is not None:
+        unkillable = _wait_for_processes(still_alive, wait_timeout)
+        for p_obj in still_alive:
+            # raises TimeoutExpired if it's still running
+            results[id(p_obj)] = (
+                p_obj.wait(0 if p_obj in unkillable else None), False
+            )
+    else:
+        for p_obj in still_alive:
+            results[id(p_obj)] = (p_obj.wait(), False)
+
+    # the commands' cgroups (if any) can be removed now
+    _remove_bg_cgroups()
+
+    return [results[id(p_obj)] for p_obj in p_objs]
+
+
+def kill_bg_command(p_obj, kill_timeout=10, wait_timeout=None):
+
+    """
+    Kill a background command.
+
+    Returns a tuple: (exit value, was_already_dead?).
+
+    First tries SIGTERM, then sends SIGKILL if the process is still
+    running at the end of the grace period; returns as soon as the
+    process exits.  To kill several commands, kill_bg_commands() is
+    faster, because it waits for them all at once.
+
+    May raise a TimeoutExpired exception (see wait_timeout).
+
+    Parameters:
+        p_obj: the process object for the command
+        see kill_bg_commands() for the rest
 
-    # hopefully it's actually dead by now, otherwise this could hang
-    if sys.hexversion >= 0x03030000:
-        return (p_obj.wait(wait_timeout), False)
+    Dependencies:
+        functions: kill_bg_commands()
+
+    """
+
+    return kill_bg_commands([p_obj], kill_timeout, wait_timeout)[0]
+
+
+def _start_logged_command(cmd_descr, cmd, env_add, output_logger,
+                          output_log_fo):
+    """
+    Log the start of a command run by run_with_logging().
+    Rotates the logfiles first, if necessary.
+    Parameters:
+        see run_with_logging(); output_logger and output_log_fo must
+        not be 'default'
+    Dependencies:
+        config_settings: log_cmds
+        globals: cfg, FULL_DATE_FORMAT
+        functions: logging_rotate_logfiles(), logging_flush_async(),
+                   _log_command()
+        modules: time
+    """
+
+    # rotate the logfiles between commands, if necessary
+    logging_rotate_logfiles()
+
+    # log the starting time
+    if output_logger:
+        output_logger.info('Starting %s %s.', cmd_descr,
+                           time.strftime(FULL_DATE_FORMAT,
+                                         time.localtime()))
+
+    # queued log messages must go out before we write to the output log
+    # directly
+    logging_flush_async()
+
+    # print the command
+    if cfg['log_cmds']:
+        def write(msg):
+            print(msg, file=output_log_fo)  # no stdout yet
+            output_log_fo.flush()
+        _log_command(cmd, env_add, write)
+        logging_flush_async()
+
+
+def _log_command(cmd, env_add, write):
+    """
+    Log a command and its environment additions (see the log_cmds
+    setting) to the status log, and with a supplied function.
+    Parameters:
+        write: a function that takes the message (without a trailing
+               newline) and writes it to the output log
+        see run_with_logging() for the rest
+    Dependencies:
+        globals: status_logger
+        functions: pps(), _render_command()
+        modules: operator
+    """
+    cmd_msg = 'Comand is:\n'
+    cmd_msg += _render_command(cmd) + '\n'
+    if env_add is not None:
+        cmd_msg += 'with environment additions:\n'
+        for k, v in sorted(env_add.items(), key=operator.itemgetter(0)):
+            cmd_msg += k + '=' + pps(v) + '\n'
+    write(cmd_msg.strip())
+    status_logger.info(cmd_msg.strip())
+
+
+def _logged_command_targets(log_stdout, log_stderr, print_output,
+                            output_log_fo):
+    """
+    Return the stdout and stderr targets for run_with_logging().
+    Parameters:
+        see run_with_logging()
+    Dependencies:
+        modules: subprocess, sys
+    """
+    stderr = 'devnull'
+    if log_stdout:
+        if print_output:
+            stdout = [output_log_fo, sys.stdout]
+        else:
+            stdout = output_log_fo
+        if log_stderr:
+            # redirect stderr so we get everything in the same order as
+            # we would on the command line
+            stderr = subprocess.STDOUT
     else:
-        return (p_obj.wait(), False)
+        stdout = 'devnull'
+        if log_stderr:
+            if print_output:
+                stderr = [output_log_fo, sys.stdout]
+            else:
+                stderr = output_log_fo
+    return (stdout, stderr)
 
 
 def run_with_logging(cmd_descr, cmd, log_stdout=True, log_stderr=True,
@@ -4540,13 +9021,18 @@ def run_with_logging(cmd_descr, cmd, log_stdout=True, log_stderr=True,
                      print_output=True, output_logger='default',
                      output_log_fo='default', use_logger=False,
                      warn_only=False, exit_val=exitvals['startup']['num'],
-                     env_add=None, **kwargs):
+                     env_add=None, flush_policy='line', chunk_size=None,
+                     return_usage=False, stdin=None, **kwargs):
 
     """
     Run a command and log its output to the output log and stdout.
 
     See run_command() for the possible return values.
 
+    Unless the command is run in the background, its resource usage
+    (see wait_with_usage()) is logged to the output log just before
+    the finishing time.
+
     Parameters:
         cmd_descr: a string describing the command, used in messages
                    like 'starting rsync backup'
@@ -4561,14 +9047,16 @@ def run_with_logging(cmd_descr, cmd, log_stdout=True, log_stderr=True,
         output_log_fo: a file object to use in place of the default
                        output log file object, or 'default' to use the
                        default (output_log_fo); may _not_ be None
+        stdin: what to attach to the command's stdin stream; see
+               run_command()
         see run_command() and command_error_handler() for the rest
 
     Dependencies:
-        config_settings: log_cmds
-        globals: cfg, output_logger, output_log_fo, status_logger,
-                 FULL_DATE_FORMAT, exitvals['startup']
-        functions: run_command(), pps()
-        modules: time, operator, subprocess, sys
+        globals: output_logger, output_log_fo, FULL_DATE_FORMAT,
+                 exitvals['startup']
+        functions: run_command(), _start_logged_command(),
+                   _logged_command_targets(), _usage_messages()
+        modules: time
 
     """
 
@@ -4579,49 +9067,19 @@ def run_with_logging(cmd_descr, cmd, log_stdout=True, log_stderr=True,
     if output_log_fo == 'default':
         output_log_fo = globals()['output_log_fo']
 
-    # log the starting time
-    if output_logger:
-        output_logger.info('Starting {0} {1}.' .
-                           format(cmd_descr,
-                                  time.strftime(FULL_DATE_FORMAT,
-                                                time.localtime())))
-
-    # print the command
-    if cfg['log_cmds']:
-        cmd_msg = 'Comand is:\n'
-        cmd_msg += ' '.join(map(pps, cmd)) + '\n'
-        if env_add is not None:
-            cmd_msg += 'with environment additions:\n'
-            for k, v in sorted(env_add.items(),
-                               key=operator.itemgetter(0)):
-                cmd_msg += k + '=' + pps(v) + '\n'
-        print(cmd_msg.strip(), file=output_log_fo)  # no stdout yet
-        output_log_fo.flush()
-        status_logger.info(cmd_msg.strip())
+    # log the start and the command
+    _start_logged_command(cmd_descr, cmd, env_add, output_logger,
+                          output_log_fo)
 
     # get the streams sorted out
-    stderr = 'devnull'
-    if log_stdout:
-        if print_output:
-            stdout = [output_log_fo, sys.stdout]
-        else:
-            stdout = output_log_fo
-        if log_stderr:
-            # redirect stderr so we get everything in the same order as
-            # we would on the command line
-            stderr = subprocess.STDOUT
-    else:
-        stdout = 'devnull'
-        if log_stderr:
-            if print_output:
-                stderr = [output_log_fo, sys.stdout]
-            else:
-                stderr = output_log_fo
+    stdout, stderr = _logged_command_targets(log_stdout, log_stderr,
+                                             print_output, output_log_fo)
 
     # run the command
-    ret = run_command(cmd_descr, cmd, None, stdout, stderr, bg, atexit_reg,
-                      daemon, use_logger, warn_only, exit_val, env_add,
-                      **kwargs)
+    ret = run_command(cmd_descr, cmd, stdin, stdout, stderr, bg,
+                      atexit_reg, daemon, use_logger, warn_only, exit_val,
+                      env_add, flush_policy, chunk_size,
+                      return_usage=(not bg), **kwargs)
 
     # failure?
     if ret is None:
@@ -4631,15 +9089,335 @@ def run_with_logging(cmd_descr, cmd, log_stdout=True, log_stderr=True,
     if bg:
         return ret
 
-    # log the ending time
+    # log the resource usage and the ending time
     if output_logger:
-        output_logger.info('{0} finished {1}.' .
-                           format(cmd_descr.capitalize(),
-                                  time.strftime(FULL_DATE_FORMAT,
-                                                time.localtime())))
+        for msg in _usage_messages(ret[1]):
+            output_logger.info(msg)
+        output_logger.info('%s finished %s.', cmd_descr.capitalize(),
+                           time.strftime(FULL_DATE_FORMAT,
+                                         time.localtime()))
 
     # return the command's exit value
-    return ret
+    return ret if return_usage else ret[0]
+
+
+class _PrefixWriter(object):
+
+    """
+    A file-like object that prefixes each line written to it.
+
+    Used by run_commands_parallel() to keep track of which lines in a
+    shared output came from which command.  Only complete lines are
+    passed on, each batch in a single write() call under a lock, so
+    that lines from commands running at the same time don't get mixed
+    together.  Bytes are decoded as UTF-8.
+
+    """
+
+    def __init__(self, prefix, target, lock):
+        """
+        Parameters:
+            prefix: the string to put at the start of each line
+            target: the file-like object to write to
+            lock: a lock shared by all writers with the same target
+        Dependencies:
+            modules: codecs
+        """
+        self.prefix = prefix
+        self.target = target
+        self.lock = lock
+        self._partial = ''
+        self._decoder = codecs.getincrementaldecoder('utf-8')('replace')
+
+
+    def write(self, data):
+        """
+        Write the complete lines in the data, with prefixes.
+        The rest is held until the line is finished (or close()).
+        """
+        if isinstance(data, bytes):
+            data = self._decoder.decode(data)
+        lines = (self._partial + data).split('\n')
+        self._partial = lines.pop()
+        if lines:
+            with self.lock:
+                self.target.write(''.join([self.prefix + line + '\n'
+                                           for line in lines]))
+
+
+    def flush(self):
+        """Flush the target."""
+        with self.lock:
+            self.target.flush()
+
+
+    def close(self):
+        """
+        Write out any partial line, and flush the target.
+        The target is not closed.
+        """
+        self.write(self._decoder.decode(b'', True))
+        if self._partial:
+            self.write('\n')
+        self.flush()
+
+
+def run_commands_parallel(jobs, max_procs=4, log_stdout=True,
+                          log_stderr=True, print_output=False,
+                          output_log_fo='default', log_dir=None,
+                          use_logger=False, warn_only=False,
+                          exit_val=exitvals['startup']['num'],
+                          env_add=None, flush_policy='line',
+                          chunk_size=None, **kwargs):
+
+    """
+    Run several commands at once, and log their output.
+
+    Up to max_procs commands are run at a time, in the order given;
+    each is started as soon as a slot is free.  Each command's output
+    goes to one of:
+        * if log_dir is None, output_log_fo (and stdout, if
+          print_output is true), with each line prefixed by
+          '[<cmd_descr>] '; lines from different commands can be
+          interleaved, but not mixed together
+        * otherwise, a logfile of its own in log_dir, named
+          <cmd_descr>.log (with characters other than letters, numbers,
+          '.', '_', and '-' replaced by '_', and a number added if
+          necessary to make the names unique); in this case, if
+          print_output is true, the output is also sent to stdout, with
+          prefixes
+    As with run_with_logging(), start and finish lines with timestamps
+    are written before and after each command's output (so that the
+    'logs' mode can find it; see query_logs()).
+
+    Returns a list of dicts, one per job, in the same order as the
+    jobs.  Each contains:
+        descr: the command description
+        cmd: the command
+        status: the command's exit value (a list, for a pipeline), or
+                None if it couldn't be run
+        start: the time the command was started (as a timestamp), or
+               None
+        end: the time it finished, or None
+        duration: the difference, in seconds, or None
+        usage: the command's resource usage (see wait_with_usage()),
+               or None (a list, for a pipeline)
+        log_path: the path to the command's logfile, or None
+
+    The commands are background commands as far as the rest of the
+    library is concerned (so that they'll be killed at exit if
+    necessary; see kill_bg_commands()), and their output is copied by
+    the shared copier thread (see _FanOutCopier).  If a command can't be
+    started, the error is handled according to use_logger, warn_only,
+    and exit_val (see command_error_handler()); if that means exiting,
+    no more commands are started, and the exit happens in the calling
+    thread (i.e., the running commands are killed by the exit
+    handlers).
+
+    Parameters:
+        jobs: a list of (cmd_descr, cmd) tuples; see run_command()
+        max_procs: the maximum number of commands to run at once
+        log_stdout, log_stderr: if true, log the respective stream;
+                                if both are true, the streams will be
+                                combined
+        print_output: if true, the commands' output is sent to stdout
+                      as well, with prefixes
+        output_log_fo: a file object to use in place of the default
+                       output log file object, or 'default' to use the
+                       default (output_log_fo); only used if log_dir is
+                       None, in which case it may _not_ be None
+        log_dir: if not None, a directory in which to create a logfile
+                 for each command; see above
+        see run_command() and command_error_handler() for the rest
+
+    Dependencies:
+        config settings: log_cmds
+        globals: cfg, output_log_fo, status_logger, email_logger,
+                 _running_bg_commands, FULL_DATE_FORMAT,
+                 exitvals['startup'], exitvals['internal'],
+                 INTEGER_TYPES
+        classes: _PrefixWriter
+        functions: logging_rotate_logfiles(), logging_flush_async(),
+                   run_command(), fix_path(), file_error_handler(),
+                   generic_error_handler(), render_command_exception(),
+                   wait_with_usage(), pps(), _log_command(),
+                   _is_pipeline(), _usage_messages(),
+                   _remove_bg_cgroups()
+        modules: os, re, sys, time, threading, subprocess, queue
+                 (Queue in Python 2.x)
+
+    """
+
+    # handle defaults; we can't set this in the definition because at
+    # the time it's processed, it hasn't been set yet
+    if output_log_fo == 'default':
+        output_log_fo = globals()['output_log_fo']
+
+    # sanity check
+    if (not isinstance(max_procs, INTEGER_TYPES) or
+          isinstance(max_procs, bool) or max_procs < 1):
+        email_logger.error('Internal Error: invalid max_procs {0} in call '
+                           'to run_commands_parallel(); must be\nan '
+                           'integer > 0; exiting.' .
+                           format(pps(max_procs)))
+        sys.exit(exitvals['internal']['num'])
+
+    # rotate the logfiles between batches, if necessary; queued log
+    # messages must go out before we write to the output log directly
+    logging_rotate_logfiles()
+    logging_flush_async()
+
+    # per-job output targets
+    stdout_lock = threading.Lock()
+    log_lock = threading.Lock()
+    used_names = set()
+    results = []
+    for cmd_descr, cmd in jobs:
+        log_path = None
+        if log_dir is not None:
+            name = re.sub(r'[^A-Za-z0-9._-]', '_', cmd_descr)
+            unique_name = name
+            n = 1
+            while unique_name in used_names:
+                n += 1
+                unique_name = '{0}.{1}'.format(name, n)
+            used_names.add(unique_name)
+            log_path = os.path.join(log_dir, unique_name + '.log')
+        results.append(dict(descr=cmd_descr, cmd=cmd, status=None,
+                            start=None, end=None, duration=None,
+                            usage=None, log_path=log_path))
+
+    def run_job(job):
+        """
+        Run one job and fill in its results.
+        """
+        prefix = '[{0}] '.format(job['descr'])
+        targets = []
+        log_fo = None
+        if job['log_path'] is not None:
+            try:
+                log_fo = open(fix_path(job['log_path']), 'a')
+            except IOError as e:
+                file_error_handler(e, 'open',
+                                   'logfile for {0}'.format(job['descr']),
+                                   job['log_path'], must_exist=True,
+                                   use_logger=use_logger,
+                                   warn_only=warn_only, exit_val=exit_val)
+                return
+            targets.append(log_fo)
+        else:
+            targets.append(_PrefixWriter(prefix, output_log_fo, log_lock))
+        if print_output:
+            targets.append(_PrefixWriter(prefix, sys.stdout, stdout_lock))
+
+        def log_line(msg):
+            for t in targets:
+                t.write(msg + '\n')
+                t.flush()
+
+        log_line('Starting {0} {1}.' .
+                 format(job['descr'],
+                        time.strftime(FULL_DATE_FORMAT, time.localtime())))
+        if cfg['log_cmds']:
+            _log_command(job['cmd'], env_add, log_line)
+
+        # get the streams sorted out
+        out_targets = targets[0] if len(targets) == 1 else targets
+        stdout = stderr = 'devnull'
+        if log_stdout:
+            stdout = out_targets
+            if log_stderr:
+                # redirect stderr so we get everything in the same order
+                # as we would on the command line
+                stderr = subprocess.STDOUT
+        elif log_stderr:
+            stderr = out_targets
+
+        # run the command
+        job['start'] = time.time()
+        ret = run_command(job['descr'], job['cmd'], None, stdout, stderr,
+                          True, True, True, use_logger, warn_only,
+                          exit_val, env_add, flush_policy, chunk_size,
+                          **kwargs)
+        if ret is None:
+            for t in targets:
+                t.close()
+            return
+        p, copier = ret
+        if _is_pipeline(job['cmd']):
+            waited = [wait_with_usage(x, job['start']) for x in p]
+            job['status'] = [w[0] for w in waited]
+            job['usage'] = [w[1] for w in waited]
+        else:
+            job['status'], job['usage'] = wait_with_usage(p, job['start'])
+        if copier is not None:
+            copier.join()
+        for x in (p if _is_pipeline(job['cmd']) else [p]):
+            if x in _running_bg_commands:
+                _running_bg_commands.remove(x)
+        _remove_bg_cgroups()  # including this command's, if any
+        job['end'] = time.time()
+        job['duration'] = job['end'] - job['start']
+
+        for msg in _usage_messages(job['usage']):
+            log_line(msg)
+        log_line('{0} finished {1}.' .
+                 format(job['descr'].capitalize(),
+                        time.strftime(FULL_DATE_FORMAT, time.localtime())))
+        for t in targets:
+            t.close()
+
+    def worker():
+        """
+        Run jobs from the queue until it's empty or we're aborting.
+        """
+        while not abort.is_set():
+            try:
+                job = job_q.get_nowait()
+            except queue.Empty:
+                return
+            # errors that would exit the script can only do so from
+            # the calling thread
+            exit_code = None
+            try:
+                run_job(job)
+            except SystemExit as e:
+                exit_code = e.code
+            except Exception as e:
+                generic_error_handler(
+                    e, 'problem running external {0} command' .
+                           format(job['descr']),
+                    render_command_exception, use_logger=True,
+                    warn_only=True
+                )
+            if exit_code is not None:
+                abort.set()
+            done_q.put(exit_code)
+
+    job_q = queue.Queue()
+    for job in results:
+        job_q.put(job)
+    done_q = queue.Queue()
+    abort = threading.Event()
+    for i in range(min(max_procs, len(results))):
+        t = threading.Thread(target=worker)
+        t.daemon = True
+        t.start()
+
+    # wait for the jobs to finish; exit here if one of them needs to
+    for i in range(len(results)):
+        exit_code = done_q.get()
+        if exit_code is not None:
+            sys.exit(exit_code)
+
+    # a pipeline failed if any of its stages did
+    failed = len([job for job in results
+                      if (any(job['status'])
+                              if isinstance(job['status'], list)
+                              else job['status'] != 0)])
+    status_logger.info('Finished {0} parallel command(s); {1} failed.' .
+                       format(len(results), failed))
+    return results
 
 
 #####################
@@ -4671,7 +9449,8 @@ def network_error_handler(e, verb, socket_descr, remote_host, remote_port,
            '(remote: {2}:{3})' .
            format(verb, socket_descr, remote_host, remote_port))
     return generic_error_handler(e, msg, render_io_exception, use_logger,
-                                 warn_only, exit_val)
+                                 warn_only, exit_val,
+                                 ('network', verb, socket_descr))
 
 
 def test_remote_port(descr, remote_end, local_end=('', 0), timeout=5,
@@ -4820,7 +9599,9 @@ def settings_no_print_logfile(name_str, no_print=True):
     setting_list = [
         name_str + '_log', name_str + '_log_layout', name_str + '_log_sep',
         name_str + '_log_date', name_str + '_log_num',
-        name_str + '_log_days',
+        name_str + '_log_days', name_str + '_log_max_bytes',
+        name_str + '_log_rotate_bytes', name_str + '_log_rotate_mins',
+        name_str + '_log_compress',
     ]
     if name_str + '_log_heading' in config_settings:
         setting_list = [name_str + '_log_heading'] + setting_list
@@ -5856,7 +10637,7 @@ def check_status():
         functions: fix_path(), file_newer_than(),
                    logging_stop_email_logging(),
                    logging_start_email_logging(), pps(),
-                   lockfile_cleanup()
+                   lockfile_cleanup(), write_state_file()
         modules: sys, atexit, os, errno
 
     """
@@ -5928,10 +10709,10 @@ def check_status():
             # (email only; we already logged it)
             if not os.path.exists(fix_path(cfg['lockfile_alert_file'])):
                 # first, touch the semaphore
-                touch_file(cfg['lockfile_alert_file'],
-                           "cfg['lockfile_alert_file']",
-                           None, use_logger=True, warn_only=False,
-                           exit_val=None)
+                write_state_file(cfg['lockfile_alert_file'],
+                                 "cfg['lockfile_alert_file']",
+                                 use_logger=True, warn_only=False,
+                                 exit_val=None)
                            # don't exit yet, we're already about to exit
 
                 # send the email and exit
@@ -5986,10 +10767,10 @@ def check_status():
                 sys.exit(exitvals['lockfile']['num'])
 
             # touch the semaphore
-            touch_file(cfg['lockfile_alert_file'],
-                       "cfg['lockfile_alert_file']",
-                       None, use_logger=True, warn_only=False,
-                       exit_val=None)
+            write_state_file(cfg['lockfile_alert_file'],
+                             "cfg['lockfile_alert_file']",
+                             use_logger=True, warn_only=False,
+                             exit_val=None)
                        # don't exit yet, we're already about to exit
 
             # send another alert email
@@ -6119,7 +10900,7 @@ def render_status_metadata(full=False):
                          lockfile_alert_file
         globals: cfg, render_status_metadata_hooks, LF_ALERTS_SILENCED,
                  SCRIPT_DISABLED
-        functions: get_file_metadata()
+        functions: get_files_metadata()
         modules: os
         Python: 2.0/3.2, for callable()
 
@@ -6144,15 +10925,13 @@ lf_alerts_silenced:
 
 script_disabled:
 {4}''' .
-           format(get_file_metadata(cfg['last_started_file'], '(none)'),
-                  get_file_metadata(cfg['lockfile'], '(none)'),
-                  get_file_metadata(cfg['lockfile_alert_file'], '(none)'),
-                  get_file_metadata(os.path.join(cfg['lockfile'],
-                                                 LF_ALERTS_SILENCED),
-                                    '(none)'),
-                  get_file_metadata(os.path.join(cfg['lockfile'],
-                                                 SCRIPT_DISABLED),
-                                    '(none)'))
+           format(*get_files_metadata([
+                      cfg['last_started_file'],
+                      cfg['lockfile'],
+                      cfg['lockfile_alert_file'],
+                      os.path.join(cfg['lockfile'], LF_ALERTS_SILENCED),
+                      os.path.join(cfg['lockfile'], SCRIPT_DISABLED),
+                  ], '(none)'))
           )
 
     # hooks for adding more metadata;
@@ -6193,7 +10972,7 @@ def silence_lf_alerts():
                  LF_ALERTS_SILENCED
         functions: fix_path(), logging_stop_stdouterr(),
                    logging_start_stdouterr(), log_cl_config(), pps(),
-                   err_exit()
+                   err_exit(), write_state_file()
         modules: sys, os
 
     """
@@ -6212,9 +10991,9 @@ def silence_lf_alerts():
     # touch the semaphore;
     # using a file in the lockfile dir means that we automatically
     # get the silencing cleared when the lockfile is removed
-    touch_file(os.path.join(cfg['lockfile'], LF_ALERTS_SILENCED),
-               'the semaphore file', None, use_logger=False,
-               warn_only=False, exit_val=exitvals['startup']['num'])
+    write_state_file(os.path.join(cfg['lockfile'], LF_ALERTS_SILENCED),
+                     'the semaphore file', use_logger=False,
+                     warn_only=False, exit_val=exitvals['startup']['num'])
 
     # print and log status, separately
     print('\nLockfile alerts have been silenced.\n')
@@ -6282,7 +11061,7 @@ def disable_script():
                  tasks_name, exitvals['startup'], SCRIPT_DISABLED
         functions: fix_path(), logging_stop_stdouterr(),
                    logging_start_stdouterr(), log_cl_config(), pps(),
-                   err_exit()
+                   err_exit(), write_state_file()
         modules: sys, os, errno
 
     """
@@ -6313,9 +11092,9 @@ def disable_script():
                      exitvals['startup']['num'])
         else:  # it existed already
             pass
-    touch_file(os.path.join(cfg['lockfile'], SCRIPT_DISABLED),
-               'the semaphore file', None, use_logger=False,
-               warn_only=False, exit_val=exitvals['startup']['num'])
+    write_state_file(os.path.join(cfg['lockfile'], SCRIPT_DISABLED),
+                     'the semaphore file', use_logger=False,
+                     warn_only=False, exit_val=exitvals['startup']['num'])
 
     # print and log status, separately
     print('\n{0} have been disabled; remember to re-enable them later!\n' .
@@ -6623,13 +11402,15 @@ def validate_config():
 
     Dependencies:
         config settings: (all except *_emails_*, *_log*)
-        globals: cfg, validate_config_hooks, NONE_TYPE, STRING_TYPES
+        globals: cfg, validate_config_hooks, NONE_TYPE, STRING_TYPES,
+                 INTEGER_TYPES, MAPPING_TYPES
         functions: setting_check_type(), setting_check_integer(),
                    setting_check_number(),
                    setting_check_filedir_create(),
                    setting_check_not_blank(), setting_check_length(),
                    setting_check_file_type(),
-                   setting_check_file_access(), setting_check_list()
+                   setting_check_file_access(), setting_check_list(),
+                   setting_check_no_blanks()
         modules: socket, logging.handlers
         Python: 2.0/3.2, for callable()
 
@@ -6641,6 +11422,19 @@ def validate_config():
     if 'umask' in cfg:
         setting_check_integer('umask', 0, 511)  # 511 = 0o777
     setting_check_type('log_cmds', bool)
+    if setting_check_type('cmd_nice',
+                          INTEGER_TYPES + (NONE_TYPE, )) is not NONE_TYPE:
+        setting_check_integer('cmd_nice', -20, 19)
+    setting_check_list('cmd_ionice_class',
+                       [None, 'idle', 'best-effort', 'realtime'])
+    if setting_check_type('cmd_ionice_level',
+                          INTEGER_TYPES + (NONE_TYPE, )) is not NONE_TYPE:
+        setting_check_integer('cmd_ionice_level', 0, 7)
+    setting_check_no_blanks('cmd_cgroup_limits', MAPPING_TYPES,
+                            mapping_values=False)
+    if cfg['cmd_cgroup_limits']:
+        setting_check_file_type('cmd_cgroup_parent', 'd')
+        setting_check_file_access('cmd_cgroup_parent', 'w')
     setting_check_type('debug', bool)
     setting_check_number('run_every', 0)
     setting_check_filedir_create('last_started_file', 'f')
@@ -6660,6 +11454,9 @@ def validate_config():
             setting_check_file_access('syslog_addr', 'w')
         setting_check_list('syslog_sock_type', [socket.SOCK_DGRAM,
                                                 socket.SOCK_STREAM])
+        setting_check_type('syslog_batched', bool)
+        if cfg['syslog_batched']:
+            setting_check_integer('syslog_backlog', 1)
         sl_class = logging.handlers.SysLogHandler  # for readability
         # encodePriority() doesn't do enough checking (e.g., it will
         # allow any integer), so just use the list from the
@@ -6693,6 +11490,11 @@ def validate_config():
     setting_check_type('status_log', STRING_TYPES + (NONE_TYPE, ))
     if cfg['status_log']:
         setting_check_filedir_create('status_log', 'f')
+    setting_check_type('async_logging', bool)
+    setting_check_integer('alert_context_lines', 0)
+    setting_check_integer('repeat_warning_limit', 0)
+    if cfg['repeat_warning_limit']:
+        setting_check_number('repeat_warning_interval', 0)
 
     # hooks for adding more validations
     for hook in validate_config_hooks:
@@ -6715,7 +11517,7 @@ def validate_email_config(name_str):
         functions: setting_check_type(), setting_check_not_blank(),
                    setting_check_not_empty(), setting_check_no_blanks(),
                    setting_check_length(), setting_check_integer(),
-                   setting_check_file_read()
+                   setting_check_number(), setting_check_file_read()
         Python: 2.0/3.2, for callable()
     """
     if (name_str in _ignore_email_config and
@@ -6744,6 +11546,9 @@ def validate_email_config(name_str):
             setting_check_length(name_str + '_emails_sec', 0, 2)
             for i, f in enumerate(cfg[name_str + '_emails_sec']):
                 setting_check_file_read((name_str + '_emails_sec', i))
+        setting_check_number(name_str + '_emails_digest_secs', 0)
+        setting_check_integer(name_str + '_emails_digest_max', 0)
+        setting_check_integer(name_str + '_emails_max_per_hour', 0)
 
 
 def validate_logfile_config(name_str):
@@ -6779,6 +11584,11 @@ def validate_logfile_config(name_str):
         if cfg[name_str + '_log_layout'] != 'append':
             setting_check_integer(name_str + '_log_num', 0)
             setting_check_number(name_str + '_log_days', 0)
+            setting_check_integer(name_str + '_log_max_bytes', 0)
+            setting_check_integer(name_str + '_log_rotate_bytes', 0)
+            setting_check_integer(name_str + '_log_rotate_mins', 0)
+        setting_check_list(name_str + '_log_compress',
+                           [None] + log_compress_types())
 
 
 def process_config(arg_ns):
@@ -6796,12 +11606,15 @@ def process_config(arg_ns):
                 (see create_arg_parser() and process_command_line())
 
     Dependencies:
-        config settings: exec_path, umask
+        config settings: exec_path, umask, last_started_file,
+                         lockfile_alert_file, lockfile
         globals: cfg, config_file_paths, cl_config, config_settings,
-                 process_config_hooks, exitvals['startup']
+                 process_config_hooks, exitvals['startup'],
+                 LF_ALERTS_SILENCED, SCRIPT_DISABLED
         functions: import_config_by_name(), check_bogus_config(),
                    apply_config_defaults(), validate_config(),
-                   logging_init_main(), pps(), err_exit()
+                   logging_init_main(), pps(), err_exit(),
+                   _remove_stale_state_tmpfiles()
         modules: argparse, os
         Python: 2.7/3.2, for argparse; 2.0/3.2, for callable()
 
@@ -6866,6 +11679,11 @@ def process_config(arg_ns):
         os.environ['PATH'] = cfg['exec_path']
     if 'umask' in cfg:
         os.umask(cfg['umask'])
+    _remove_stale_state_tmpfiles([
+        cfg['last_started_file'], cfg['lockfile_alert_file'],
+        os.path.join(cfg['lockfile'], LF_ALERTS_SILENCED),
+        os.path.join(cfg['lockfile'], SCRIPT_DISABLED),
+    ])
 
     # hooks for adding more initializations
     for hook in process_config_hooks:
@@ -7139,6 +11957,24 @@ def create_arg_parser():
          default='run', metavar='MODE',
          help='mode in which to run the script; see below'
     )
+    logs_arg_group = arg_parser.add_argument_group("'logs' mode")
+    logs_arg_group.add_argument(
+        '--since', metavar='TIME',
+        help="only entries at or after TIME, e.g. '2013-05-01 14:30' "
+             "or '2h' (ago)"
+    )
+    logs_arg_group.add_argument(
+        '--until', metavar='TIME',
+        help='only entries at or before TIME; see --since'
+    )
+    logs_arg_group.add_argument(
+        '--pid', type=int,
+        help='only entries from the script process with this PID'
+    )
+    logs_arg_group.add_argument(
+        '--grep', metavar='REGEX',
+        help='only entries matching this regular expression'
+    )
 
     # hooks for adding more arguments
     for hook in create_arg_parser_hooks:
@@ -7206,6 +12042,68 @@ def statusall_mode():
     print('\n' + render_status(True) + '\n')
 
 
+def _parse_logs_time(time_str):
+    """
+    Convert a --since or --until argument to a timestamp.
+    The argument can be a local date and time, in the form
+    'YYYY-MM-DD[ HH:MM[:SS]]' (a 'T' can be used instead of the space),
+    or a time relative to now, in the form '<number><unit>', where the
+    unit is s, m, h, d, or w (e.g., '90m' means 90 minutes ago).
+    Returns None if the argument can't be parsed.
+    Dependencies:
+        modules: re, time
+    """
+    time_str = time_str.strip()
+    rel_match = re.match(r'^([0-9]+(?:\.[0-9]*)?) ?([smhdw])$', time_str)
+    if rel_match:
+        unit_secs = dict(s=1, m=60, h=3600, d=86400, w=604800)
+        return (time.time() -
+                float(rel_match.group(1)) * unit_secs[rel_match.group(2)])
+    for fmt in ['%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d',
+                '%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M']:
+        try:
+            return time.mktime(time.strptime(time_str, fmt))
+        except ValueError:
+            pass
+    return None
+
+
+def logs_mode():
+
+    """
+    Search the logs, as specified on the command line.
+
+    See query_logs() and create_arg_parser().
+
+    Dependencies:
+        globals: logs_mode_args, exitvals['startup']
+        functions: _parse_logs_time(), query_logs(), pps(), err_exit()
+        modules: re
+
+    """
+
+    args = logs_mode_args if logs_mode_args is not None else {}
+    times = {}
+    for arg in ['since', 'until']:
+        times[arg] = None
+        if args.get(arg) is not None:
+            times[arg] = _parse_logs_time(args[arg])
+            if times[arg] is None:
+                err_exit('Error: invalid time for --{0} ({1}); exiting.' .
+                         format(arg, pps(args[arg])),
+                         exitvals['startup']['num'])
+    if args.get('grep') is not None:
+        try:
+            re.compile(args['grep'])
+        except re.error as e:
+            err_exit('Error: invalid regular expression for --grep ({0}); '
+                     'exiting.\nDetails: {1}' .
+                     format(pps(args['grep']), e),
+                     exitvals['startup']['num'])
+    query_logs(since=times['since'], until=times['until'],
+               pid=args.get('pid'), pattern=args.get('grep'))
+
+
 def createfull_mode():
     """Wrapper for create_blank_config_files(True)."""
     create_blank_config_files(True)
@@ -7225,7 +12123,7 @@ def run_mode():
                  _logfile_info, run_mode_hooks, task_name,
                  FULL_DATE_FORMAT, exitvals['startup']
         functions: log_cl_config(), check_status(),
-                   logging_init_logfile(), touch_file()
+                   logging_init_logfile(), write_state_file()
         modules: time
         Python: 2.0/3.2, for callable()
 
@@ -7252,9 +12150,9 @@ def run_mode():
 
     # log that we're starting the task
     status_logger.info('Starting {0}.'.format(task_name))
-    touch_file(cfg['last_started_file'], "cfg['last_started_file']", None,
-               use_logger=True, warn_only=False,
-               exit_val=exitvals['startup']['num'])
+    write_state_file(cfg['last_started_file'], "cfg['last_started_file']",
+                     use_logger=True, warn_only=False,
+                     exit_val=exitvals['startup']['num'])
     output_logger.info('{0} started {1}.' .
                        format(task_name.capitalize(),
                               time.strftime(FULL_DATE_FORMAT,
@@ -7285,9 +12183,10 @@ def process_command_line():
     To change the modes the script offers, change script_modes.
 
     Dependencies:
-        globals: config_file_paths, default_config_files,
-                 script_modes, exitvals['no_error'],
-                 exitvals['internal']
+        globals: config_file_paths, logs_mode_args,
+                 default_config_files, script_modes,
+                 exitvals['no_error'], exitvals['internal'],
+                 exitvals['startup']
         functions: (mode callbacks), create_arg_parser(),
                    process_config(), pps(), err_exit()
         modules: argparse, sys
@@ -7295,7 +12194,7 @@ def process_command_line():
 
     """
 
-    global config_file_paths
+    global config_file_paths, logs_mode_args
 
     # parse the command line
     arg_ns = create_arg_parser().parse_args()
@@ -7313,6 +12212,16 @@ def process_command_line():
     # get the script mode; be defensive in case the args were changed
     mode = arg_ns.mode if hasattr(arg_ns, 'mode') else 'run'
 
+    # get the 'logs' mode query; same
+    logs_mode_args = {}
+    for arg in ['since', 'until', 'pid', 'grep']:
+        logs_mode_args[arg] = getattr(arg_ns, arg, None)
+    if (script_modes[mode].get('alias_of', mode) != 'logs' and
+          [v for v in logs_mode_args.values() if v is not None]):
+        err_exit("Error: --since, --until, --pid, and --grep can only be "
+                 "used in 'logs' mode; exiting.",
+                 exitvals['startup']['num'])
+
     # get the mode info
     mode_dict = None
     mode_dict_temp = script_modes[mode]
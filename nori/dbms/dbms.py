@@ -256,6 +256,7 @@ from pprint import pprint as pp  # for debugging
 import sys
 import getpass
 import atexit
+import logging
 
 
 ###############
@@ -1001,9 +1002,11 @@ Options must be supplied as a dict.
             methods: error_handler()
             modules: (module containing func), core
         """
-        core.status_logger.debug('Calling DBMS function {0} with '
-                                 'args:\n{1}\nand kwargs:\n{2}' .
-                                 format(func, args, kwargs))
+        # args may be huge (e.g., for executemany()), so only render
+        # them if the message will actually be logged
+        core.status_logger.debug('Calling DBMS function %s with '
+                                 'args:\n%s\nand kwargs:\n%s',
+                                 func, args, kwargs)
         err = False
         ret = None
         try:
@@ -1058,8 +1061,8 @@ Options must be supplied as a dict.
 
         # DBMS connection
         core.status_logger.info(
-            'Connecting to {0} DBMS (config prefix/delim {1})...' .
-            format(self.DBMS_NAME, core.pps(pd))
+            'Connecting to %s DBMS (config prefix/delim %s)...',
+            self.DBMS_NAME, core.pps(pd)
         )
         try:
             self.conn = self.MODULE.connect(**self._conn_args)
@@ -1076,8 +1079,8 @@ Options must be supplied as a dict.
         if not DBMS._atexit_close_conns_registered:
             atexit.register(DBMS.close_conns)
             DBMS._atexit_close_conns_registered = True
-        core.status_logger.info('{0} connection established.' .
-                                format(self.DBMS_NAME))
+        core.status_logger.info('%s connection established.',
+                                self.DBMS_NAME)
         return True
 
 
@@ -1109,9 +1112,9 @@ Options must be supplied as a dict.
         # already closed?
         if self.conn is None:
             core.status_logger.info(
-                '{0} connection (config prefix/delim {1})\n'
-                'was already closed.' .
-                format(self.DBMS_NAME, core.pps(pd))
+                '%s connection (config prefix/delim %s)\n'
+                'was already closed.',
+                self.DBMS_NAME, core.pps(pd)
             )
             return True
 
@@ -1138,9 +1141,9 @@ Options must be supplied as a dict.
         self.conn = None
         if not err:
             core.status_logger.info(
-                '{0} connection (config prefix/delim {1})\n'
-                'has been closed.' .
-                format(self.DBMS_NAME, core.pps(pd))
+                '%s connection (config prefix/delim %s)\n'
+                'has been closed.',
+                self.DBMS_NAME, core.pps(pd)
             )
         if self in DBMS._open_conns:
             DBMS._open_conns.remove(self)
@@ -1197,9 +1200,9 @@ Options must be supplied as a dict.
             if not DBMS._atexit_close_cursors_registered:
                 atexit.register(DBMS.close_cursors)
                 DBMS._atexit_close_cursors_registered = True
-            core.status_logger.debug('Got {0}{1} cursor.' .
-                                     format('main ' if main else '',
-                                            self.DBMS_NAME))
+            core.status_logger.debug('Got %s%s cursor.',
+                                     'main ' if main else '',
+                                     self.DBMS_NAME)
 
         return cur
 
@@ -1227,7 +1230,7 @@ Options must be supplied as a dict.
                            err_no_exit, warn_no_exit
             methods: save_err_warn(), restore_err_warn(),
                      error_handler()
-            modules: (contents of MODULE), core
+            modules: (contents of MODULE), core, logging
 
         """
 
@@ -1235,11 +1238,12 @@ Options must be supplied as a dict.
 
         # main and already closed?
         if cur is None and self.cur is None:
-            core.status_logger.debug(
-                'Main {0} cursor (config prefix/delim {1})\n'
-                'was already closed.' .
-                format(self.DBMS_NAME, core.pps(pd))
-            )
+            if core.status_logger.isEnabledFor(logging.DEBUG):
+                core.status_logger.debug(
+                    'Main %s cursor (config prefix/delim %s)\n'
+                    'was already closed.',
+                    self.DBMS_NAME, core.pps(pd)
+                )
             return True
 
         main_str = 'main ' if cur is None else ''
@@ -1271,11 +1275,11 @@ Options must be supplied as a dict.
         # calling this function again with the same value of cur would
         # refer to the main cursor
 
-        if not err:
+        if not err and core.status_logger.isEnabledFor(logging.DEBUG):
             core.status_logger.debug(
-                '{0}{1} cursor (config prefix/delim {2})\n'
-                'has been closed.' .
-                format(main_str.capitalize(), self.DBMS_NAME, core.pps(pd))
+                '%s%s cursor (config prefix/delim %s)\n'
+                'has been closed.',
+                main_str.capitalize(), self.DBMS_NAME, core.pps(pd)
             )
 
         if cur is None:
@@ -13,6 +13,7 @@ import subprocess
 import time
 import socket
 import logging
+import threading
 
 #sys.path.insert(0, os.path.dirname(__file__) + os.sep + '..')
 import nori
@@ -374,6 +375,24 @@ def run_mode_hook():
     #nori.logging_start_email_logging('report')
     #nori.core.email_loggers['report'].error('asdf5c')
 
+    # batched TCP syslog against a local listener; run with
+    # use_syslog=True, syslog_addr=('127.0.0.1', 5514),
+    # syslog_sock_type=socket.SOCK_STREAM, syslog_batched=True, and
+    # (in another shell) 'nc -lk 5514'; stop and restart nc to test
+    # reconnection and the backlog
+    #for i in range(100):
+    #    nori.core.status_logger.info('syslog test %d', i)
+    #    time.sleep(0.1)
+
+    # log queries (also available as the 'logs' mode, e.g.
+    # 'nori-test.py logs --since 2h --grep Warning'); the first query
+    # builds the sidecar indexes, later ones should be much faster
+    #nori.query_logs(since=time.time() - 7200)
+    #nori.query_logs(pid=os.getpid())
+    #nori.query_logs(pattern='^Starting')
+    #nori.query_logs(since=time.time() - 86400, until=time.time() - 3600,
+    #                pattern='(?i)error')
+
     #nori.logging_stop_syslog()
     #nori.logging_stop_stdouterr()
     #nori.core.status_logger.info('asdf1')
@@ -387,6 +406,10 @@ def run_mode_hook():
     #nori.core.email_logger.error('asdf5b')
     #nori.logging_start_email_logging()
     #nori.core.email_logger.error('asdf5c')
+    # with alert_emails_digest_max=3, alert_emails_digest_secs=0, and
+    # alert_emails_max_per_hour=0: one digest of 3, then 1 at exit
+    #for i in range(4):
+    #    nori.core.email_logger.error('digest {0}'.format(i))
     #nori.core.output_logger.info('asdf6')
     #nori.core.output_log_fo.write('asdf7\n')
     #nori.core.output_log_fo.flush()
@@ -549,6 +572,82 @@ def run_mode_hook():
     #                            False, False))
     #print(nori.run_with_logging('listing', ['ls', '/tmp', '/adsf'],
     #                            False, False, True))
+    #nori.run_with_logging('listing', ['find', '/usr'], True, True,
+    #                      flush_policy=('time', 0.2))
+    #nori.run_with_logging('listing', ['find', '/usr'], True, True,
+    #                      flush_policy=('size', 65536))
+    #nori.run_with_logging('listing', ['find', '/usr'], True, True,
+    #                      chunk_size=nori.FAN_OUT_CHUNK_SIZE)
+    #print(nori.run_with_logging('listing', ['find', '/usr'], True, True,
+    #                            return_usage=True))
+    #p, t = nori.run_command('listing', ['find', '/usr'],
+    #                        stdout=[sys.stdout, 'devnull'], bg=True)
+    #print(nori.wait_with_usage(p, time.time()))
+    #print(nori.run_with_logging('counting', ['wc', '-l'],
+    #                            stdin=('row {0}\n'.format(i)
+    #                                   for i in range(1000000))))
+    #out = nori.CapturedOutput()
+    #print(nori.run_command('listing', ['ls', '/tmp', '/adsf'],
+    #                       stdout=[out, sys.stdout], stderr='devnull'))
+    #print(out.size, out.on_disk(), out.getvalue('utf-8'))
+    #for line in out:
+    #    print(line)
+    #print(nori.run_command('nice check', ['ps', '-o', 'ni=', '-p', 'self'],
+    #                       stdout=sys.stdout, nice=10))
+    #print(nori.run_with_logging('idle check', ['ionice'],
+    #                            ionice=('idle', None)))
+    #print(nori.run_with_logging('limited', ['cat', '/proc/self/cgroup'],
+    #                            cgroup_limits={'memory.max': '100M'}))
+    #print(nori.run_with_logging('compressed listing',
+    #                            [['ls', '-l', '/usr/bin', '/adsf'],
+    #                             ['gzip'], ['gunzip'], ['wc', '-l']]))
+    #res = nori.run_commands_parallel(
+    #    [('dump db{0}'.format(i), ['sh', '-c', 'echo db{0}; sleep 1; '
+    #                                'exit {1}'.format(i, i % 3)])
+    #     for i in range(10)], max_procs=3, print_output=True,
+    #    universal_newlines=True)
+    #for r in res:
+    #    print(r['descr'], r['status'], r['duration'])
+    #print(nori.run_commands_parallel(
+    #    [('listing', ['ls', '/tmp']), ('listing', ['ls', '/adsf'])],
+    #    log_dir='/tmp', warn_only=True))
+
+    # coroutine versions (Python 3.5+)
+    #import asyncio
+    #loop = asyncio.get_event_loop()
+    #print(loop.run_until_complete(asyncio.gather(*[
+    #    nori.run_command_async('echo', ['sh', '-c', 'sleep 1; echo $N'],
+    #                           stdout=[sys.stdout, 'devnull'],
+    #                           env_add={'N': str(i)})
+    #    for i in range(200)
+    #])))
+    #print(loop.run_until_complete(
+    #    nori.run_with_logging_async('listing', ['ls', '/tmp', '/adsf'])
+    #))
+
+    # line-by-line vs. chunked fan-out; ~200 MB of 61-byte lines to
+    # a pipe took 18.6 s line by line and 0.18 s in chunks
+    # (run with -o alert_context_lines 0 to let the chunked copy use
+    # os.splice(), where available)
+    #r, w = os.pipe()
+    #def drain():
+    #    while os.read(r, 1048576):
+    #        pass
+    #for cs in [None, nori.FAN_OUT_CHUNK_SIZE]:
+    #    w2 = os.dup(w)  # the line-by-line copy closes its outputs
+    #    p = subprocess.Popen(['sh', '-c', 'yes 0123456789abcdef0123456789'
+    #                                      'abcdef0123456789abcdef0123456789'
+    #                                      ' | head -c 200000000'],
+    #                         stdout=subprocess.PIPE, universal_newlines=True)
+    #    t = threading.Thread(target=drain)
+    #    t.daemon = True
+    #    t.start()
+    #    start = time.time()
+    #    nori.multi_fan_out([(p.stdout, [w2])], chunk_size=cs)
+    #    p.wait()
+    #    if cs is not None:
+    #        os.close(w2)
+    #    print(cs, time.time() - start)
     #try:
     #    nori.run_with_logging('listing', ['find', '/'], True, True)
     #except IOError as e:
@@ -1094,6 +1193,28 @@ def run_mode_hook():
 
     #print(nori.render_config())
 
+    # per-call cost of debug messages when debug is off; eager .format()
+    # renders the arguments anyway, lazy %-style arguments don't
+    #import timeit
+    #params = [(i, 'x' * 20, i * 1.5) for i in range(10000)]
+    #args = ('INSERT INTO t VALUES (%s, %s, %s)', params)
+    #kwargs = {}
+    #n = 1000
+    #eager = timeit.timeit(
+    #    lambda: nori.core.status_logger.debug(
+    #        'Calling DBMS function {0} with args:\n{1}\nand kwargs:\n{2}' .
+    #        format('executemany', args, kwargs)
+    #    ), number=n
+    #)
+    #lazy = timeit.timeit(
+    #    lambda: nori.core.status_logger.debug(
+    #        'Calling DBMS function %s with args:\n%s\nand kwargs:\n%s',
+    #        'executemany', args, kwargs
+    #    ), number=n
+    #)
+    #print('eager: {0:.2f} us/call; lazy: {1:.2f} us/call' .
+    #      format(eager / n * 1e6, lazy / n * 1e6))
+
     pass
 
 nori.core.task_article = 'a'
@@ -162,16 +162,21 @@ class SSH(object):
     def close_tunnels(cls):
         """
         Close all SSH tunnels.
+        The tunnels are killed all at once; see core.kill_bg_commands().
         NOTE: * do not override in subclasses
               * call with SSH.close_tunnels()
         Dependencies:
             class vars: _open_tunnels
-            instance methods: close_tunnel()
+            instance vars: p_obj
+            instance methods: _tunnel_closed()
+            modules: core
         """
-        import threading
-        # have to copy the array because close_tunnel() changes it
-        for ssh_obj in cls._open_tunnels[:]:
-            ssh_obj.close_tunnel()
+        # have to copy the array because _tunnel_closed() changes it
+        ssh_objs = cls._open_tunnels[:]
+        results = core.kill_bg_commands([ssh_obj.p_obj
+                                             for ssh_obj in ssh_objs])
+        for ssh_obj, (ret, already) in zip(ssh_objs, results):
+            ssh_obj._tunnel_closed(already)
 
 
     #####################################
@@ -512,6 +517,10 @@ one second).
 
         Returns the tunnel's process object on success, otherwise False.
 
+        The tunnel command is run with the priority and resource limits
+        from the cmd_nice, cmd_ionice_*, and cmd_cgroup_* config
+        settings, like other external commands; see core.run_command().
+
         Parameters:
             descr: a description of the tunnel's purpose (e.g. 'mysql
                    dumps' or 'rsync backups'); this is used in status
@@ -538,11 +547,11 @@ one second).
 
         # log that we're running the command
         core.logging_stop_stdouterr()
-        core.status_logger.info('Running SSH tunnel command for {0}...' .
-                                format(descr))
+        core.status_logger.info('Running SSH tunnel command for %s...',
+                                descr)
         core.logging_start_stdouterr()
-        core.output_logger.info('Running SSH tunnel command for {0}...' .
-                                format(descr))
+        core.output_logger.info('Running SSH tunnel command for %s...',
+                                descr)
 
         # run the command
         p, t = core.run_with_logging(
@@ -598,11 +607,11 @@ one second).
         if connected:
             self.p_obj = p
             core.logging_stop_stdouterr()
-            core.status_logger.info('SSH tunnel for {0} established.' .
-                                    format(descr))
+            core.status_logger.info('SSH tunnel for %s established.',
+                                    descr)
             core.logging_start_stdouterr()
-            core.output_logger.info('SSH tunnel for {0} established.' .
-                                    format(descr))
+            core.output_logger.info('SSH tunnel for %s established.',
+                                    descr)
             if self not in SSH._open_tunnels:
                 SSH._open_tunnels.append(self)
             if not SSH._atexit_close_tunnels_registered:
@@ -620,16 +629,29 @@ one second).
         Can be called even if the tunnel already died / was closed / was
         killed.
         Dependencies:
-            class vars: _open_tunnels
-            instance vars: descr, p_obj
+            instance vars: p_obj
+            methods: _tunnel_closed()
             modules: core
         """
         ret, already = core.kill_bg_command(self.p_obj)
+        self._tunnel_closed(already)
+
+
+    def _tunnel_closed(self, already):
+        """
+        Log that a tunnel has been closed, and stop tracking it.
+        Parameters:
+            already: true if the tunnel had already died / been closed
+        Dependencies:
+            class vars: _open_tunnels
+            instance vars: descr
+            modules: core
+        """
         if already:
-            core.status_logger.info('SSH tunnel for {0} was already '
-                                    'closed.'.format(self.descr))
+            core.status_logger.info('SSH tunnel for %s was already '
+                                    'closed.', self.descr)
         else:
-            core.status_logger.info('SSH tunnel for {0} has been closed.' .
-                                    format(self.descr))
+            core.status_logger.info('SSH tunnel for %s has been closed.',
+                                    self.descr)
         if self in SSH._open_tunnels:
             SSH._open_tunnels.remove(self)